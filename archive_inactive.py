@@ -0,0 +1,21 @@
+"""Move inactive ('راکد') cases older than a threshold into files/archive.db.
+
+Their upload folders are packed into files/archive/<id>.tar.xz. Archived
+cases stay searchable (tick 'شامل بایگانی' in the search window) and can be
+brought back from their details window.
+
+    python archive_inactive.py [days]
+"""
+import sys
+
+from database import archive_inactive_cases, ARCHIVE_AFTER_DAYS
+
+
+def main():
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else ARCHIVE_AFTER_DAYS
+    archived = archive_inactive_cases(days)
+    print(f'{archived} case(s) archived.')
+
+
+if __name__ == '__main__':
+    main()
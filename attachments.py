@@ -0,0 +1,235 @@
+import os
+import stat
+import shutil
+import hashlib
+import mimetypes
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+CHUNK_SIZE = 1024 * 1024
+INGEST_WORKERS = 4
+
+
+class IngestCancelled(Exception):
+    """Raised in an ingestion worker once its job has been cancelled."""
+
+
+def _chunks(f, chunk_size, progress, cancelled):
+    while True:
+        if cancelled is not None and cancelled.is_set():
+            raise IngestCancelled()
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+        if progress is not None:
+            progress(len(chunk))
+
+
+def hash_file(path, chunk_size=CHUNK_SIZE, progress=None, cancelled=None):
+    """Return (sha256 hex digest, size) of a file, reading it in chunks.
+
+    `progress(nbytes)` is called after each chunk; setting the `cancelled`
+    event stops the read with IngestCancelled.
+    """
+    h = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in _chunks(f, chunk_size, progress, cancelled):
+            h.update(chunk)
+            size += len(chunk)
+    return h.hexdigest(), size
+
+
+def _make_writable_and_retry(func, path, exc_info):
+    os.chmod(path, stat.S_IWRITE | stat.S_IREAD)
+    func(path)
+
+
+def remove_tree(path, blobs=()):
+    """shutil.rmtree that also removes read-only files (stored attachments are read-only).
+
+    `blobs` are the paths of the blobs files in the tree may be hard links
+    to. Windows only deletes a read-only file after its flag is cleared,
+    which clears it on every link to the file, so they are made read-only
+    again afterwards.
+    """
+    try:
+        shutil.rmtree(path, onerror=_make_writable_and_retry)
+    finally:
+        for blob in blobs:
+            if os.path.exists(blob):
+                os.chmod(blob, stat.S_IREAD)
+
+
+class BlobStore:
+    """Content-addressed store for attachment files.
+
+    Each distinct file is kept once at `<root>/<sha[:2]>/<sha[2:4]>/<sha>`
+    and made read-only. Case folders get a hard link to the blob (or a copy
+    where the filesystem cannot link), so they still open normally in the
+    file manager while identical documents share one copy on disk.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put(self, src, progress=None, cancelled=None):
+        """Add a file to the store; returns (digest, size).
+
+        The file is read once: it is hashed while it is copied into a temp
+        file in the store, which is then renamed to its digest (or dropped
+        if that content is already stored). `progress` and `cancelled` are
+        as for hash_file().
+        """
+        os.makedirs(self.root, exist_ok=True)
+        # A unique temp name: two workers may be storing the same content.
+        # collect_garbage() removes any left behind by a crash.
+        fd, tmp = tempfile.mkstemp(suffix='.part', dir=self.root)
+        h = hashlib.sha256()
+        size = 0
+        try:
+            with open(src, 'rb') as f, os.fdopen(fd, 'wb') as out:
+                for chunk in _chunks(f, CHUNK_SIZE, progress, cancelled):
+                    h.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            digest = h.hexdigest()
+            path = self.path(digest)
+            if os.path.exists(path):
+                os.remove(tmp)
+                # Touch it so a concurrent collect_garbage() sees it as fresh.
+                os.chmod(path, stat.S_IREAD)
+                os.utime(path)
+                return digest, size
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        os.chmod(path, stat.S_IREAD)
+        return digest, size
+
+    def unlink(self, path):
+        """Delete a file in a case folder, which may be a link to a blob."""
+        # Removing a file needs write access to its folder, not to the file;
+        # making `path` writable would make the blob it links to writable
+        # for every case.
+        try:
+            os.unlink(path)
+        except PermissionError:
+            # Windows refuses to delete a read-only file. Clear the flag,
+            # then set it again on the blob `path` was a link to.
+            old = hash_file(path)[0] if os.stat(path).st_nlink > 1 else None
+            os.chmod(path, stat.S_IWRITE | stat.S_IREAD)
+            os.unlink(path)
+            if old and os.path.exists(self.path(old)):
+                os.chmod(self.path(old), stat.S_IREAD)
+
+    def link(self, digest, dst):
+        """Place the blob at `dst`, replacing any existing file there."""
+        if os.path.lexists(dst):
+            self.unlink(dst)
+        try:
+            os.link(self.path(digest), dst)
+        except OSError:
+            shutil.copyfile(self.path(digest), dst)
+
+    def collect_garbage(self, live, older_than):
+        """Delete blobs not in `live` and last touched before `older_than` (epoch seconds).
+
+        Returns how many were removed.
+        """
+        removed = 0
+        if not os.path.isdir(self.root):
+            return removed
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for name in filenames:
+                if name in live:
+                    continue
+                path = os.path.join(dirpath, name)
+                if os.path.getmtime(path) >= older_than:
+                    continue
+                os.chmod(path, stat.S_IWRITE | stat.S_IREAD)
+                os.remove(path)
+                removed += 1
+        return removed
+
+
+class IngestJob:
+    """Put a list of files into a BlobStore on a thread pool.
+
+    Workers only update plain counters, so the Tk thread can poll
+    progress() and done() from after() without locking. Nothing is linked
+    into a case folder or written to the database here; the caller does
+    that with records() once done() is true and errors is empty.
+    """
+
+    def __init__(self, store, paths, workers=INGEST_WORKERS):
+        self.store = store
+        self.paths = list(paths)
+        self.workers = workers
+        self.sizes = []
+        self.mtimes = []
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+                self.sizes.append(st.st_size)
+                self.mtimes.append(st.st_mtime)
+            except OSError:
+                self.sizes.append(0)
+                self.mtimes.append(None)
+        self.done_bytes = [0] * len(self.paths)
+        self.results = [None] * len(self.paths)
+        self.errors = {}
+        self._cancelled = threading.Event()
+        self._futures = []
+
+    def start(self):
+        if not self.paths:
+            return self
+        executor = ThreadPoolExecutor(max_workers=min(self.workers, len(self.paths)),
+                                      thread_name_prefix='attachments-ingest')
+        self._futures = [executor.submit(self._ingest, i) for i in range(len(self.paths))]
+        # Let the workers finish on their own; start() must not block.
+        executor.shutdown(wait=False)
+        return self
+
+    def _ingest(self, i):
+        def advance(n):
+            self.done_bytes[i] += n
+        try:
+            self.results[i] = self.store.put(self.paths[i], advance, self._cancelled)
+        except Exception as e:
+            self.errors[self.paths[i]] = e
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def done(self):
+        return all(f.done() for f in self._futures)
+
+    def progress(self):
+        """Return (bytes processed, total bytes)."""
+        return sum(self.done_bytes), sum(self.sizes)
+
+    def file_progress(self, i):
+        """Return the fraction (0..1) of file `i` that has been processed."""
+        total = self.sizes[i]
+        return min(1.0, self.done_bytes[i] / total) if total else float(self.results[i] is not None)
+
+    def records(self):
+        """Return attachment records (name, sha256, size, mtime, mime) for the stored files."""
+        return [{'name': os.path.basename(path), 'sha256': result[0], 'size': result[1],
+                 'mtime': mtime, 'mime': mimetypes.guess_type(path)[0]}
+                for path, result, mtime in zip(self.paths, self.results, self.mtimes) if result is not None]
@@ -0,0 +1,628 @@
+import os
+import json
+import zlib
+import struct
+import hashlib
+import functools
+import contextlib
+import sqlite3
+import threading
+import time
+import jdatetime
+
+
+# Grandfather-father-son retention. Each tier is (max_age_seconds, bucket):
+# a backup falls in the first tier it is younger than, and within that tier
+# only the newest backup per bucket is kept. The bucket is a prefix length of
+# the Jalali timestamp in the file name (10 = hour, 8 = day, 6 = month);
+# None keeps every backup. A last tier with max_age None never expires.
+DEFAULT_RETENTION = (
+    (3600, None),         # everything from the last hour
+    (86400, 10),          # one per hour for a day
+    (30 * 86400, 8),      # one per day for a month
+    (None, 6),            # one per month forever
+)
+
+MANIFEST_NAME = 'manifest.json'
+CHUNKS_DIR_NAME = 'chunks'
+# Copy of the database as of the last page snapshot. The next snapshot
+# copies only the pages committed since then into it, from the WAL; the
+# state file ties the copy to its page list and WAL position.
+BASE_IMAGE_NAME = 'last_snapshot.db'
+BASE_STATE_NAME = 'last_snapshot.json'
+FULL_SUFFIX = '.db'
+PAGES_SUFFIX = '.pages'
+
+# SQLite WAL file layout (https://www.sqlite.org/fileformat.html#the_write_ahead_log).
+WAL_MAGIC = (0x377f0682, 0x377f0683)
+WAL_HEADER_SIZE = 32
+WAL_FRAME_HEADER_SIZE = 24
+
+
+def expired_backups(entries, now, retention=DEFAULT_RETENTION):
+    """Return the manifest entries that `retention` no longer keeps."""
+    kept_buckets = set()
+    expired = []
+    # Newest first, so the newest backup claims each bucket.
+    for entry in sorted(entries, key=lambda e: e['ts'], reverse=True):
+        age = now - entry['created']
+        for max_age, bucket in retention:
+            if max_age is None or age < max_age:
+                break
+        else:
+            expired.append(entry)
+            continue
+        if bucket is None:
+            continue
+        key = (bucket, entry['ts'][:bucket])
+        if key in kept_buckets:
+            expired.append(entry)
+        else:
+            kept_buckets.add(key)
+    return expired
+
+
+def parse_backup_name(name):
+    """Return the Jalali timestamp in a `cases_<ts>.db`/`.pages` name, or None."""
+    root, ext = os.path.splitext(name)
+    if not root.startswith('cases_') or ext not in (FULL_SUFFIX, PAGES_SUFFIX):
+        return None
+    ts = root[len('cases_'):]
+    return ts if len(ts) == 14 and ts.isdigit() else None
+
+
+class ChunkStore:
+    """Content-addressed, zlib-compressed store of database pages.
+
+    Each distinct page is written once to `<root>/<sha[:2]>/<sha>`; snapshots
+    only list the hashes of their pages.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._known = None
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _load_known(self):
+        if self._known is not None:
+            return
+        self._known = set()
+        if not os.path.isdir(self.root):
+            return
+        with os.scandir(self.root) as fan:
+            for d in fan:
+                if d.is_dir():
+                    with os.scandir(d.path) as it:
+                        self._known.update(e.name for e in it if not e.name.endswith('.part'))
+
+    def put(self, page, digest=None):
+        """Store `page` if it is new; returns (digest, whether it was written).
+
+        `digest` is the page's hash if the caller already knows it.
+        """
+        self._load_known()
+        if digest is None:
+            digest = hashlib.sha256(page).hexdigest()
+        if digest in self._known:
+            return digest, False
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.part'
+        with open(tmp, 'wb') as f:
+            f.write(zlib.compress(page, 6))
+        os.replace(tmp, path)
+        self._known.add(digest)
+        return digest, True
+
+    def get(self, digest):
+        with open(self._path(digest), 'rb') as f:
+            return zlib.decompress(f.read())
+
+    def collect_garbage(self, live):
+        """Delete every stored page whose hash is not in `live`; returns the count."""
+        self._load_known()
+        dead = self._known - set(live)
+        for digest in dead:
+            try:
+                os.remove(self._path(digest))
+            except FileNotFoundError:
+                pass
+        self._known -= dead
+        return len(dead)
+
+
+def read_page_snapshot(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_page_snapshot(image_path, page_size, store, path, base=None):
+    """Store the pages of the database file at `image_path` in `store` and write the page list to `path`.
+
+    The file is read one page at a time. `base` is (file path, page list)
+    of an earlier image: a page equal byte for byte to the page at the same
+    offset there takes its hash from the list instead of being hashed
+    again. Returns (page list, number of pages not already in the store).
+    """
+    pages = []
+    written = 0
+    length = 0
+    base_pages = base[1] if base else ()
+    with open(image_path, 'rb') as f, (open(base[0], 'rb') if base else contextlib.nullcontext()) as old:
+        for index, page in enumerate(iter(functools.partial(f.read, page_size), b'')):
+            previous = old.read(page_size) if old is not None else None
+            known = base_pages[index] if previous == page and index < len(base_pages) else None
+            digest, new = store.put(page, known)
+            pages.append(digest)
+            written += new
+            length += len(page)
+    _write_page_list(path, page_size, length, pages)
+    return pages, written
+
+
+def update_page_snapshot(image_path, page_size, store, path, pages, changed, page_count):
+    """Like write_page_snapshot(), for an image whose earlier page list was `pages`.
+
+    Only the pages numbered in `changed` (1-based, as in SQLite) are read
+    and stored; every other page keeps its hash from `pages`. The image has
+    `page_count` pages. Raises ValueError if that leaves a page unaccounted
+    for.
+    """
+    pages = list(pages[:page_count]) + [None] * (page_count - len(pages))
+    written = 0
+    with open(image_path, 'rb') as f:
+        for number in sorted(n for n in changed if n <= page_count):
+            f.seek((number - 1) * page_size)
+            digest, new = store.put(f.read(page_size))
+            pages[number - 1] = digest
+            written += new
+    if None in pages:
+        raise ValueError(f'{pages.count(None)} pages of {image_path} are in neither the WAL nor the base')
+    _write_page_list(path, page_size, page_count * page_size, pages)
+    return pages, written
+
+
+def _write_page_list(path, page_size, length, pages):
+    tmp = path + '.part'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'page_size': page_size, 'length': length, 'pages': pages}, f)
+    os.replace(tmp, path)
+
+
+def read_wal_header(wal_path):
+    """Return (page size, salt) from the header of a WAL file, or None if it has none."""
+    try:
+        with open(wal_path, 'rb') as f:
+            header = f.read(WAL_HEADER_SIZE)
+    except FileNotFoundError:
+        return None
+    if len(header) < WAL_HEADER_SIZE or struct.unpack('>I', header[:4])[0] not in WAL_MAGIC:
+        return None
+    return struct.unpack('>I', header[8:12])[0], header[16:24].hex()
+
+
+def apply_wal_frames(wal_path, image_path, page_size, start, stop):
+    """Copy the newest version of each page in WAL frames start+1..stop into the database file at `image_path`.
+
+    Frame `stop` must end a commit. Returns (page numbers written, page
+    count after that commit), or None, with the image untouched, when the
+    frames are not all of the current WAL generation. With no frames to
+    apply the page count is None.
+    """
+    if stop <= start:
+        return set(), None
+    header = read_wal_header(wal_path)
+    if header is None or header[0] != page_size:
+        return None
+    salt = bytes.fromhex(header[1])
+    frame_size = WAL_FRAME_HEADER_SIZE + page_size
+    newest = {}
+    page_count = 0
+    with open(wal_path, 'rb') as wal:
+        for frame in range(start, stop):
+            wal.seek(WAL_HEADER_SIZE + frame * frame_size)
+            head = wal.read(WAL_FRAME_HEADER_SIZE)
+            if len(head) < WAL_FRAME_HEADER_SIZE or head[8:16] != salt:
+                return None
+            number, page_count = struct.unpack('>II', head[:8])
+            newest[number] = frame
+        if not page_count:
+            return None
+        with open(image_path, 'r+b') as image:
+            for number, frame in newest.items():
+                wal.seek(WAL_HEADER_SIZE + frame * frame_size + WAL_FRAME_HEADER_SIZE)
+                image.seek((number - 1) * page_size)
+                image.write(wal.read(page_size))
+            image.truncate(page_count * page_size)
+    return set(newest), page_count
+
+
+def restore_backup(backup_path, dst_path):
+    """Rebuild a standalone `.db` at `dst_path` from a full or page snapshot."""
+    tmp = dst_path + '.part'
+    if backup_path.endswith(PAGES_SUFFIX):
+        snap = read_page_snapshot(backup_path)
+        store = ChunkStore(os.path.join(os.path.dirname(backup_path), CHUNKS_DIR_NAME))
+        with open(tmp, 'wb') as f:
+            for digest in snap['pages']:
+                f.write(store.get(digest))
+    else:
+        src = sqlite3.connect(backup_path)
+        target = sqlite3.connect(tmp)
+        try:
+            src.backup(target)
+        finally:
+            target.close()
+            src.close()
+    os.replace(tmp, dst_path)
+    return dst_path
+
+
+class BackupManifest:
+    """Small JSON index of the snapshots in the backup folder.
+
+    Pruning works from this index so the folder is only listed once, when the
+    manifest does not exist yet.
+    """
+
+    def __init__(self, backup_dir):
+        self.backup_dir = backup_dir
+        self.path = os.path.join(backup_dir, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self._entries = {e['name']: e for e in json.load(f)}
+        except (OSError, ValueError):
+            self._entries = {}
+            self._rebuild()
+            self._save()
+
+    def _rebuild(self):
+        if not os.path.isdir(self.backup_dir):
+            return
+        with os.scandir(self.backup_dir) as it:
+            for de in it:
+                ts = parse_backup_name(de.name)
+                if ts is None:
+                    continue
+                self._entries[de.name] = {
+                    'name': de.name,
+                    'ts': ts,
+                    'created': jdatetime.datetime.strptime(ts, '%Y%m%d%H%M%S').togregorian().timestamp(),
+                    'size': de.stat().st_size,
+                }
+
+    def _save(self):
+        tmp = self.path + '.part'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(sorted(self._entries.values(), key=lambda e: e['ts']), f)
+        os.replace(tmp, self.path)
+
+    def entries(self):
+        with self._lock:
+            self._load()
+            return list(self._entries.values())
+
+    def add(self, name, ts, created, size):
+        with self._lock:
+            self._load()
+            self._entries[name] = {'name': name, 'ts': ts, 'created': created, 'size': size}
+            self._save()
+
+    def remove(self, names):
+        with self._lock:
+            self._load()
+            for name in names:
+                self._entries.pop(name, None)
+            self._save()
+
+
+class BackupScheduler:
+    """Coalesce database writes into occasional consistent snapshots.
+
+    Writers call request() after committing. A background thread waits until
+    no request has arrived for `quiet_seconds` (or `max_delay_seconds` have
+    passed since the first pending request) and then takes one snapshot with
+    the SQLite online backup API, so a burst of edits costs one copy and the
+    copy never sees a half-written file.
+
+    The same thread prunes old snapshots according to `retention`, at most
+    `prune_batch` files at a time, so a large backlog is worked off gradually.
+
+    With `incremental` set (the default) a snapshot is a `.pages` list of page
+    hashes backed by a shared ChunkStore, so only pages that changed since an
+    earlier snapshot are written. A copy of the database as of the last
+    snapshot is kept (BASE_IMAGE_NAME); the next snapshot copies the pages
+    committed since then into it straight from the WAL and hashes only
+    those, so its cost follows the size of the change, across restarts too.
+    Holding the write lock meanwhile keeps the WAL still. Each snapshot
+    also runs a passive checkpoint, so the WAL is only restarted after
+    changes this class has already seen. When the WAL no longer covers
+    the gap (another connection checkpointed and restarted it, or the base
+    is missing), the database is copied with the backup API and compared
+    page by page with the base instead. Otherwise each snapshot is a full
+    `.db` copy.
+    """
+
+    def __init__(self, db_path, backup_dir, quiet_seconds=5.0, max_delay_seconds=60.0,
+                 retention=DEFAULT_RETENTION, prune_batch=50, prune_interval=1.0,
+                 incremental=True):
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.quiet_seconds = quiet_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.retention = retention
+        self.prune_batch = prune_batch
+        self.prune_interval = prune_interval
+        self.manifest = BackupManifest(backup_dir)
+        self.incremental = incremental
+        self.chunks = ChunkStore(os.path.join(backup_dir, CHUNKS_DIR_NAME))
+        self._prune_backlog = False
+        self._cond = threading.Condition()
+        self._first_request = None
+        self._last_request = None
+        self._stopping = False
+        self._conn = None
+        self._writer = None
+        self._data_version = None
+        self._thread = None
+        self._snapshot_lock = threading.Lock()
+        self._base = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        # Open the reader connection up front so its data_version baseline is
+        # taken before any write we are later asked to back up.
+        self._conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA busy_timeout=5000')
+        # Only ever takes the write lock, while the WAL is read.
+        self._writer = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        self._writer.execute('PRAGMA busy_timeout=5000')
+        self._data_version = self._read_data_version()
+        self._thread = threading.Thread(target=self._run, name='db-backup', daemon=True)
+        self._thread.start()
+
+    def request(self):
+        """Note that the database changed; a snapshot will follow once writes settle."""
+        now = time.monotonic()
+        with self._cond:
+            if self._first_request is None:
+                self._first_request = now
+            self._last_request = now
+            self._cond.notify()
+
+    def flush(self):
+        """Take any pending snapshot immediately (used on shutdown)."""
+        with self._cond:
+            pending = self._first_request is not None
+            self._first_request = self._last_request = None
+        if pending:
+            self.snapshot()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        if self._conn is not None:
+            self._conn.close()
+            self._writer.close()
+            self._conn = self._writer = None
+
+    def _run(self):
+        self._prune_safely()
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+                if self._first_request is None:
+                    # Idle: sleep until the next request, waking periodically
+                    # while there are still expired backups to remove.
+                    self._cond.wait(self.prune_interval if self._prune_backlog else None)
+                    if self._stopping or self._first_request is not None:
+                        continue
+                    take_snapshot = False
+                else:
+                    now = time.monotonic()
+                    due = min(self._last_request + self.quiet_seconds,
+                              self._first_request + self.max_delay_seconds)
+                    if now < due:
+                        self._cond.wait(due - now)
+                        continue
+                    self._first_request = self._last_request = None
+                    take_snapshot = True
+            if take_snapshot:
+                try:
+                    self.snapshot()
+                except Exception as e:
+                    print(f"Backup error: {e}")
+            self._prune_safely()
+
+    def _prune_safely(self):
+        try:
+            self.prune()
+        except Exception as e:
+            print(f"Backup prune error: {e}")
+
+    def prune(self):
+        """Delete up to `prune_batch` backups the retention policy no longer keeps.
+
+        Returns how many expired backups remain for later passes.
+        """
+        expired = expired_backups(self.manifest.entries(), time.time(), self.retention)
+        batch = expired[:self.prune_batch]
+        for entry in batch:
+            try:
+                os.remove(os.path.join(self.backup_dir, entry['name']))
+            except FileNotFoundError:
+                pass
+        if batch:
+            self.manifest.remove([e['name'] for e in batch])
+            if any(e['name'].endswith(PAGES_SUFFIX) for e in batch):
+                self._collect_chunks()
+        remaining = len(expired) - len(batch)
+        self._prune_backlog = remaining > 0
+        return remaining
+
+    def _collect_chunks(self):
+        # Held throughout, so a snapshot cannot add a manifest between
+        # reading the live set and deleting what is not in it.
+        with self._snapshot_lock:
+            live = set()
+            for entry in self.manifest.entries():
+                if entry['name'].endswith(PAGES_SUFFIX):
+                    path = os.path.join(self.backup_dir, entry['name'])
+                    try:
+                        live.update(read_page_snapshot(path)['pages'])
+                    except (OSError, ValueError):
+                        # Never collect while a snapshot we depend on is unreadable.
+                        return
+            self.chunks.collect_garbage(live)
+
+    def _read_data_version(self):
+        return self._conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def snapshot(self, force=False):
+        """Write a consistent copy of the database; returns its path or None.
+
+        Skipped when PRAGMA data_version shows no commit from another
+        connection since the previous snapshot, unless `force` is set.
+        """
+        with self._snapshot_lock:
+            return self._snapshot(force)
+
+    def _snapshot(self, force):
+        if self._conn is None:
+            return None
+        version = self._read_data_version()
+        if not force and version == self._data_version:
+            return None
+        os.makedirs(self.backup_dir, exist_ok=True)
+        ts = jdatetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        if self.incremental:
+            dst = os.path.join(self.backup_dir, f'cases_{ts}{PAGES_SUFFIX}')
+            page_size = self._conn.execute('PRAGMA page_size').fetchone()[0]
+            self._write_pages(page_size, dst)
+        else:
+            dst = os.path.join(self.backup_dir, f'cases_{ts}{FULL_SUFFIX}')
+            tmp = dst + '.part'
+            self._backup_to(tmp)
+            os.replace(tmp, dst)
+        self._data_version = version
+        self.manifest.add(os.path.basename(dst), ts, time.time(), os.path.getsize(dst))
+        return dst
+
+    def _backup_to(self, path):
+        target = sqlite3.connect(path)
+        try:
+            self._conn.backup(target)
+            # Make the copy a self-contained rollback-journal database.
+            target.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            target.close()
+
+    def _write_pages(self, page_size, dst):
+        image = os.path.join(self.backup_dir, BASE_IMAGE_NAME)
+        base = self._base or self._load_base(image, page_size)
+        # The image is about to change; until the new state is saved it
+        # matches no page list.
+        self._base = None
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(self.backup_dir, BASE_STATE_NAME))
+        self._writer.execute('BEGIN IMMEDIATE')
+        try:
+            mark = self._wal_mark()
+            applied = base and self._apply_wal(image, page_size, base['mark'], mark)
+        finally:
+            self._writer.execute('ROLLBACK')
+        pages = None
+        if applied:
+            changed, page_count = applied
+            try:
+                pages, _ = update_page_snapshot(image, page_size, self.chunks, dst, base['pages'], changed,
+                                                len(base['pages']) if page_count is None else page_count)
+            except ValueError:
+                base = None
+        if pages is None:
+            # The copy starts after `mark`, so replaying the WAL from there
+            # next time only rewrites pages it already has.
+            tmp = image + '.part'
+            try:
+                self._backup_to(tmp)
+                pages, _ = write_page_snapshot(tmp, page_size, self.chunks, dst, base and (image, base['pages']))
+                os.replace(tmp, image)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+        self._base = {'pages': pages, 'mark': mark}
+        self._save_base(image, page_size, dst)
+
+    def _wal_mark(self):
+        """Return the WAL position a snapshot taken now starts from, or None outside WAL mode.
+
+        Called with the write lock held. The passive checkpoint reports how
+        many frames the WAL holds and copies what it can into the database
+        file; `db_before` is the state of that file before it did.
+        """
+        before = os.stat(self.db_path)
+        _, frames, checkpointed = self._conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+        if frames < 0:
+            return None
+        header = read_wal_header(self.db_path + '-wal')
+        st = os.stat(self.db_path)
+        return {'salt': header and header[1], 'frames': frames, 'checkpointed': checkpointed == frames,
+                'db': [st.st_size, st.st_mtime_ns], 'db_before': [before.st_size, before.st_mtime_ns]}
+
+    def _apply_wal(self, image, page_size, old, new):
+        """Bring the base image from WAL mark `old` to `new`; see apply_wal_frames().
+
+        Returns None, with the image untouched, when the WAL no longer holds
+        every change since `old`. In the same WAL generation that is the
+        frames after `old`. After a restart it is all of the frames, which
+        only holds if every frame was in the database file at `old` and the
+        file had not been written since when `new` was taken; any checkpoint
+        in between would have.
+        """
+        if old is None or new is None:
+            return None
+        if new['salt'] is not None and new['salt'] == old['salt'] and new['frames'] >= old['frames']:
+            start = old['frames']
+        elif old['checkpointed'] and new['db_before'] == old['db']:
+            start = 0
+        else:
+            return None
+        return apply_wal_frames(self.db_path + '-wal', image, page_size, start, new['frames'])
+
+    def _load_base(self, image, page_size):
+        """Return the base saved by an earlier run, or None if the image no longer matches it."""
+        try:
+            with open(os.path.join(self.backup_dir, BASE_STATE_NAME), encoding='utf-8') as f:
+                state = json.load(f)
+            st = os.stat(image)
+            if state['page_size'] != page_size or state['image'] != [st.st_size, st.st_mtime_ns]:
+                return None
+            pages = read_page_snapshot(os.path.join(self.backup_dir, state['snapshot']))['pages']
+        except (OSError, ValueError, KeyError):
+            return None
+        return {'pages': pages, 'mark': state['mark']}
+
+    def _save_base(self, image, page_size, dst):
+        st = os.stat(image)
+        state = {'snapshot': os.path.basename(dst), 'page_size': page_size, 'mark': self._base['mark'],
+                 'image': [st.st_size, st.st_mtime_ns]}
+        path = os.path.join(self.backup_dir, BASE_STATE_NAME)
+        with open(path + '.part', 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(path + '.part', path)
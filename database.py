@@ -1,31 +1,209 @@
 import sqlite3
 import os
-import shutil
 import datetime
+import threading
+import atexit
+import time
+import functools
+import collections
+import json
+import mimetypes
+import tarfile
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import jdatetime
 
+from attachments import BlobStore, IngestJob, hash_file, remove_tree
+from backup import BackupScheduler
+from extractor import extract_text, is_supported
+from normalizer import normalize_text
+
 
 ROOT = os.path.dirname(__file__)
 FILES_DIR = os.path.join(ROOT, 'files')
 UPLOADS_DIR = os.path.join(FILES_DIR, 'uploads')
 BACKUP_DIR = os.path.join(FILES_DIR, 'backup')
+TRASH_DIR = os.path.join(FILES_DIR, 'trash')
+BLOBS_DIR = os.path.join(FILES_DIR, 'blobs')
+THUMBS_DIR = os.path.join(FILES_DIR, 'thumbs')
 DB_PATH = os.path.join(FILES_DIR, 'cases.db')
+ARCHIVE_DB_PATH = os.path.join(FILES_DIR, 'archive.db')
+ARCHIVE_DIR = os.path.join(FILES_DIR, 'archive')
+
+# Applied to every new connection. WAL lets the UI keep reading while a write
+# (or a backup) is in progress; NORMAL sync is safe under WAL and much cheaper
+# than FULL. cache_size is negative => KiB, so ~16 MB page cache per connection.
+CONNECTION_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -16000),
+    ('mmap_size', 64 * 1024 * 1024),
+    ('busy_timeout', 5000),
+    ('temp_store', 'MEMORY'),
+    ('foreign_keys', 'ON'),
+)
+
+# Columns covered by the full-text index behind search_cases('full', ...).
+FTS_COLUMNS = ('id', 'title', 'subject', 'description', 'contract_amount', 'case_type')
+# The trigram tokenizer indexes every 3-character window, so it matches
+# substrings the way the old LIKE '%q%' search did and is script-agnostic,
+# which suits Persian (no stemming or word-boundary rules needed).
+FTS_TOKENIZER = 'trigram'
+FTS_MIN_TERM = 3
+# Extra index column holding the text extracted from a case's documents.
+FTS_CONTENT_COLUMN = 'content'
+# Index column holding the names of all parties of a case, so the filter
+# engine can match "any party" with one column filter.
+PARTY_COLUMNS = ('mojer', 'mostajjer', 'karfarma', 'piman')
+FTS_PARTIES_COLUMN = 'parties'
+INDEX_COLUMNS = FTS_COLUMNS + (FTS_CONTENT_COLUMN, FTS_PARTIES_COLUMN)
+# Cap on the document text indexed per case.
+MAX_CASE_CONTENT = 500000
+
+# Rows per IN (...) list, kept below SQLite's host-parameter limit.
+SQL_BATCH_SIZE = 500
+# Threads for filesystem work on upload folders.
+IO_WORKERS = 4
+# Trashed cases are purged for good after this long.
+TRASH_RETENTION_SECONDS = 30 * 86400
+# Folders with no case that the reconciler moved to TRASH_DIR are named
+# <prefix><folder>_<epoch seconds> and purged after the same retention.
+ORPHAN_PREFIX = 'orphan_'
+TRASH_PURGE_FIRST_DELAY = 60
+TRASH_PURGE_INTERVAL = 3600
+# Unreferenced blobs younger than this are kept: they may belong to a case
+# that is being saved right now.
+BLOB_GC_GRACE_SECONDS = 3600
+# The document indexer re-checks every case folder this often; saves in the
+# app queue their case for indexing straight away.
+DOCUMENT_SWEEP_INTERVAL = 3600
+# archive_inactive_cases() moves cases with this status, dated more than
+# ARCHIVE_AFTER_DAYS ago, out of the hot database.
+ARCHIVE_STATUS = 'راکد'
+ARCHIVE_AFTER_DAYS = 365
+# CaseResults loads records this many at a time and keeps the most recently
+# used pages.
+RESULT_PAGE_SIZE = 200
+RESULT_CACHE_PAGES = 10
+
+_local = threading.local()
+_dirs_ready = False
+_io_executor = None
+_workers_stop = threading.Event()
+_index_queue = set()
+_index_lock = threading.Lock()
+_index_wake = threading.Event()
 
 
 def ensure_dirs():
+    global _dirs_ready
+    if _dirs_ready:
+        return
     os.makedirs(UPLOADS_DIR, exist_ok=True)
     os.makedirs(BACKUP_DIR, exist_ok=True)
+    os.makedirs(TRASH_DIR, exist_ok=True)
+    os.makedirs(BLOBS_DIR, exist_ok=True)
+    _dirs_ready = True
 
 
-def get_connection():
+def case_folder(case_id):
+    """Return the upload folder for a case: UPLOADS_DIR/<year>/<month>/<id>.
+
+    Year and month are read from the Jalali timestamp that starts every
+    case id, so no single directory ends up holding every case. Ids that do
+    not start with one are placed directly under UPLOADS_DIR.
+    """
+    case_id = str(case_id)
+    prefix = case_id[:6]
+    if len(prefix) == 6 and prefix.isascii() and prefix.isdigit() and 1 <= int(prefix[4:]) <= 12:
+        return os.path.join(UPLOADS_DIR, prefix[:4], prefix[4:], case_id)
+    return os.path.join(UPLOADS_DIR, case_id)
+
+
+def _open_connection():
     ensure_dirs()
-    conn = sqlite3.connect(DB_PATH)
+    # isolation_level=None: no implicit BEGIN, so plain reads never hold a
+    # transaction open on the long-lived connection. Writes go through
+    # transaction() below.
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    for name, value in CONNECTION_PRAGMAS:
+        conn.execute(f'PRAGMA {name}={value}')
     return conn
 
 
+def get_connection():
+    """Return the long-lived connection for the calling thread.
+
+    The connection is opened (and the PRAGMAs applied) on first use in each
+    thread and then reused, so callers must not close it.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _open_connection()
+        _local.conn = conn
+        _local.depth = 0
+    return conn
+
+
+def close_connection():
+    """Close the calling thread's connection, if one is open."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.conn = None
+        conn.close()
+
+
+@contextmanager
+def transaction():
+    """Run a block inside a single write transaction on this thread's connection.
+
+    Nested uses join the outermost transaction; it commits when the outermost
+    block exits normally and rolls back if an exception escapes.
+    """
+    conn = get_connection()
+    if _local.depth:
+        _local.depth += 1
+        try:
+            yield conn
+        finally:
+            _local.depth -= 1
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    _local.depth = 1
+    try:
+        yield conn
+    except BaseException:
+        _local.depth = 0
+        conn.execute('ROLLBACK')
+        raise
+    _local.depth = 0
+    conn.execute('COMMIT')
+
+
 def init_db():
+    """Bring the schema up to date by running pending migrations.
+
+    The schema version lives in PRAGMA user_version, so an up-to-date
+    database costs a single integer read here. Pending migrations run in
+    order inside one transaction together with the version bump.
+    """
+    latest = MIGRATIONS[-1][0]
     conn = get_connection()
-    cur = conn.cursor()
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= latest:
+        return
+    with transaction() as conn:
+        cur = conn.cursor()
+        # Re-read under the write lock in case another instance migrated first.
+        version = cur.execute('PRAGMA user_version').fetchone()[0]
+        for number, migrate in MIGRATIONS:
+            if number > version:
+                migrate(cur)
+        cur.execute(f'PRAGMA user_version = {latest}')
+
+
+def _migrate_base_schema(cur):
+    # Databases created before versioned migrations may be missing any of
+    # the later columns, so this first step still checks each one.
     cur.execute('''
     CREATE TABLE IF NOT EXISTS cases (
         id TEXT PRIMARY KEY,
@@ -93,116 +271,1475 @@ def init_db():
     if 'guarantee_type' not in columns:
         cur.execute("ALTER TABLE cases ADD COLUMN guarantee_type TEXT")
 
-    conn.commit()
-    conn.close()
 
 
-def add_case(data: dict):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('''INSERT INTO cases (id, title, date, duration, duration_from, duration_to, mojer, mostajjer, karfarma, piman, subject, contract_amount, bank_owner_name, bank_account_number, bank_shaba_number, bank_card_number, bank_name, bank_branch, payment_id, guarantee_amount, guarantee_type, description, folder_path, case_type, status)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', (
+def _create_fts(cur, columns):
+    """Create the cases_fts index over `columns` of cases_norm and its sync triggers."""
+    cols = ', '.join(columns)
+    new_vals = ', '.join(f'new.{c}' for c in columns)
+    old_vals = ', '.join(f'old.{c}' for c in columns)
+    cur.execute(f"CREATE VIRTUAL TABLE cases_fts USING fts5({cols}, content='cases_norm', content_rowid='rowid', tokenize='{FTS_TOKENIZER}')")
+    cur.execute(f'''CREATE TRIGGER cases_norm_ai AFTER INSERT ON cases_norm BEGIN
+        INSERT INTO cases_fts(rowid, {cols}) VALUES (new.rowid, {new_vals});
+    END''')
+    cur.execute(f'''CREATE TRIGGER cases_norm_ad AFTER DELETE ON cases_norm BEGIN
+        INSERT INTO cases_fts(cases_fts, rowid, {cols}) VALUES ('delete', old.rowid, {old_vals});
+    END''')
+    cur.execute(f'''CREATE TRIGGER cases_norm_au AFTER UPDATE ON cases_norm BEGIN
+        INSERT INTO cases_fts(cases_fts, rowid, {cols}) VALUES ('delete', old.rowid, {old_vals});
+        INSERT INTO cases_fts(rowid, {cols}) VALUES (new.rowid, {new_vals});
+    END''')
+
+
+def _migrate_search_index(cur):
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'cases_norm'")
+    if cur.fetchone():
+        return
+    # Drop the earlier index that read raw text straight from `cases`.
+    for trigger in ('cases_fts_ai', 'cases_fts_ad', 'cases_fts_au'):
+        cur.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    cur.execute('DROP TABLE IF EXISTS cases_fts')
+
+    # cases_norm holds the normalized text of each case under the same rowid.
+    # add_case/update_case fill it (normalization happens in Python, once, at
+    # write time); the FTS index uses it as external content and the triggers
+    # made by _create_fts() keep the two in step.
+    cur.execute(f"CREATE TABLE cases_norm (rowid INTEGER PRIMARY KEY, {', '.join(f'{c} TEXT' for c in FTS_COLUMNS)})")
+    _create_fts(cur, FTS_COLUMNS)
+    cur.execute('''CREATE TRIGGER cases_delete_norm AFTER DELETE ON cases BEGIN
+        DELETE FROM cases_norm WHERE rowid = old.rowid;
+    END''')
+    cols = ', '.join(FTS_COLUMNS)
+    cur.execute(f'SELECT rowid, {cols} FROM cases')
+    cur.executemany(f"INSERT INTO cases_norm (rowid, {cols}) VALUES ({', '.join('?' * (len(FTS_COLUMNS) + 1))})",
+                    [(r[0], *map(normalize_text, r[1:])) for r in cur.fetchall()])
+
+
+def _migrate_typed_columns(cur):
+    # Typed shadows of the text columns: amounts as integers and Jalali dates
+    # as day ordinals, so ordering and range filters compare numbers and can
+    # use an index. The text columns stay authoritative for display.
+    cur.execute("ALTER TABLE cases ADD COLUMN contract_amount_int INTEGER")
+    cur.execute("ALTER TABLE cases ADD COLUMN date_ord INTEGER")
+    cur.execute("ALTER TABLE cases ADD COLUMN duration_from_ord INTEGER")
+    cur.execute("ALTER TABLE cases ADD COLUMN duration_to_ord INTEGER")
+    cur.execute('SELECT rowid, contract_amount, date, duration_from, duration_to FROM cases')
+    cur.executemany('UPDATE cases SET contract_amount_int=?, date_ord=?, duration_from_ord=?, duration_to_ord=? WHERE rowid=?',
+                    [(*_typed_values({'contract_amount': r[1], 'date': r[2], 'duration_from': r[3], 'duration_to': r[4]}), r[0])
+                     for r in cur.fetchall()])
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_cases_date ON cases (date_ord)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_cases_type_date ON cases (case_type, date_ord)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_cases_status_date ON cases (status, date_ord)')
+
+
+def _migrate_soft_delete(cur):
+    # deleted_at (epoch seconds) flags a trashed case. While trashed,
+    # folder_path points into TRASH_DIR and trashed_from keeps the original.
+    cur.execute("ALTER TABLE cases ADD COLUMN deleted_at INTEGER")
+    cur.execute("ALTER TABLE cases ADD COLUMN trashed_from TEXT")
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_cases_deleted ON cases (deleted_at) WHERE deleted_at IS NOT NULL')
+
+
+def _migrate_attachments(cur):
+    # One row per file attached to a case; the content lives once in the
+    # blob store under its sha256, however many cases reference it.
+    cur.execute('''CREATE TABLE attachments (
+        case_id TEXT NOT NULL REFERENCES cases(id) ON DELETE CASCADE,
+        name TEXT NOT NULL,
+        sha256 TEXT NOT NULL,
+        size INTEGER,
+        PRIMARY KEY (case_id, name)
+    )''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_attachments_sha256 ON attachments (sha256)')
+
+
+def _migrate_attachment_metadata(cur):
+    # mtime is the source file's modification time when it was attached.
+    cur.execute("ALTER TABLE attachments ADD COLUMN mtime REAL")
+    cur.execute("ALTER TABLE attachments ADD COLUMN mime TEXT")
+
+
+def _migrate_document_index(cur):
+    # document_text keeps the normalized text extracted from each distinct
+    # file (by sha256), so a template attached to many cases is read once.
+    # case_documents records what the indexer last saw in each case folder;
+    # an unchanged mtime and size means the file is not read again.
+    cur.execute('CREATE TABLE document_text (sha256 TEXT PRIMARY KEY, content TEXT)')
+    cur.execute('''CREATE TABLE case_documents (
+        case_id TEXT NOT NULL REFERENCES cases(id) ON DELETE CASCADE,
+        name TEXT NOT NULL,
+        mtime REAL,
+        size INTEGER,
+        sha256 TEXT,
+        PRIMARY KEY (case_id, name)
+    )''')
+    cur.execute(f'ALTER TABLE cases_norm ADD COLUMN {FTS_CONTENT_COLUMN} TEXT')
+    # An FTS5 table cannot gain a column, so rebuild it over INDEX_COLUMNS.
+    for trigger in ('cases_norm_ai', 'cases_norm_ad', 'cases_norm_au'):
+        cur.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    cur.execute('DROP TABLE IF EXISTS cases_fts')
+    _create_fts(cur, FTS_COLUMNS + (FTS_CONTENT_COLUMN,))
+    cur.execute("INSERT INTO cases_fts(cases_fts) VALUES ('rebuild')")
+
+
+def _migrate_sort_indexes(cur):
+    # Indexes behind the typed sort keys of the result grids (SORT_KEYS);
+    # the duration index is on the same expression the ORDER BY uses.
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_cases_amount ON cases (contract_amount_int)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_cases_duration ON cases ((duration_to_ord - duration_from_ord))')
+
+
+def _migrate_filter_index(cur):
+    # For the filter engine: the party names go into the search index, and
+    # the end date of the contract gets an index for range filters.
+    cur.execute(f'ALTER TABLE cases_norm ADD COLUMN {FTS_PARTIES_COLUMN} TEXT')
+    cur.execute(f"SELECT rowid, {', '.join(PARTY_COLUMNS)} FROM cases")
+    cur.executemany(f'UPDATE cases_norm SET {FTS_PARTIES_COLUMN} = ? WHERE rowid = ?',
+                    [(_party_text(r[1:]), r[0]) for r in cur.fetchall()])
+    for trigger in ('cases_norm_ai', 'cases_norm_ad', 'cases_norm_au'):
+        cur.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    cur.execute('DROP TABLE IF EXISTS cases_fts')
+    _create_fts(cur, INDEX_COLUMNS)
+    cur.execute("INSERT INTO cases_fts(cases_fts) VALUES ('rebuild')")
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_cases_duration_to ON cases (duration_to_ord)')
+
+
+# Numbered schema migrations, applied in order by init_db(). Append new
+# steps with the next number; never renumber or edit a released one.
+MIGRATIONS = (
+    (1, _migrate_base_schema),
+    (2, _migrate_search_index),
+    (3, _migrate_typed_columns),
+    (4, _migrate_soft_delete),
+    (5, _migrate_attachments),
+    (6, _migrate_attachment_metadata),
+    (7, _migrate_document_index),
+    (8, _migrate_sort_indexes),
+    (9, _migrate_filter_index),
+)
+
+
+def parse_amount(text):
+    """Return an amount such as '1,250,000' (any digit script) as an int, or None."""
+    digits = normalize_text(text).replace(',', '').replace(' ', '')
+    return int(digits) if digits.isdigit() else None
+
+
+def jalali_ordinal(date_str):
+    """Return the day ordinal of a 'YYYY-MM-DD' Jalali date, or None if it is not valid."""
+    try:
+        y, m, d = map(int, normalize_text(date_str).split('-'))
+        return jdatetime.date(y, m, d).toordinal()
+    except (ValueError, TypeError):
+        return None
+
+
+def _typed_values(data):
+    return (parse_amount(data.get('contract_amount')), jalali_ordinal(data.get('date')),
+            jalali_ordinal(data.get('duration_from')), jalali_ordinal(data.get('duration_to')))
+
+
+def _party_text(names):
+    """Return the normalized party names of a case as one line of text."""
+    return ' | '.join(normalize_text(n) for n in names if n)
+
+
+def _index_case(cur, case_id):
+    """Refresh the normalized search row of one case (call inside the write transaction)."""
+    cur.execute(f"SELECT rowid, {', '.join(FTS_COLUMNS + PARTY_COLUMNS)} FROM cases WHERE id = ?", (case_id,))
+    row = cur.fetchone()
+    if not row:
+        return
+    cols = FTS_COLUMNS + (FTS_PARTIES_COLUMN,)
+    updates = ', '.join(f'{c} = excluded.{c}' for c in cols)
+    cur.execute(f"INSERT INTO cases_norm (rowid, {', '.join(cols)}) VALUES ({', '.join('?' * (len(cols) + 1))}) "
+                f"ON CONFLICT(rowid) DO UPDATE SET {updates}",
+                (row[0], *map(normalize_text, row[1:len(FTS_COLUMNS) + 1]), _party_text(row[len(FTS_COLUMNS) + 1:])))
+
+
+def ingest_attachments(paths):
+    """Start storing files in the blob store on a worker pool; returns the IngestJob.
+
+    Poll job.done()/job.progress() from the UI. Once the job has finished
+    without errors, link_attachments() places the files in the case folder
+    and job.records() is passed to add_case/update_case.
+    """
+    ensure_dirs()
+    return IngestJob(_blob_store, paths).start()
+
+
+def link_attachments(folder, attachments):
+    """Link stored attachments into a case folder, creating it if needed."""
+    os.makedirs(folder, exist_ok=True)
+    for a in attachments:
+        _blob_store.link(a['sha256'], os.path.join(folder, a['name']))
+
+
+def unlink_attachments(folder, attachments, previous=()):
+    """Undo link_attachments() after the row it was for could not be saved.
+
+    `previous` are the records the case had before (get_attachments()); a
+    name that was replaced gets its earlier blob back, any other linked
+    name is removed.
+    """
+    before = {a['name']: a['sha256'] for a in previous}
+    for a in attachments:
+        path = os.path.join(folder, a['name'])
+        if a['name'] in before:
+            _blob_store.link(before[a['name']], path)
+        elif os.path.lexists(path):
+            _blob_store.unlink(path)
+
+
+def remove_case_folder(folder, attachments=()):
+    """Delete the folder of a case whose row was never saved, keeping the blobs of `attachments` read-only."""
+    remove_tree(folder, [blob_path(a['sha256']) for a in attachments])
+
+
+def blob_path(digest):
+    """Return the path of a stored attachment's content."""
+    return _blob_store.path(digest)
+
+
+def adopt_attachments(case_id, folder, names):
+    """Move files already sitting in a case folder into the blob store and record them.
+
+    Used for folders filled before attachments were tracked: each file is
+    stored, replaced by a link to its blob and given an attachments row.
+    Returns the new records.
+    """
+    ensure_dirs()
+    records = []
+    for name in names:
+        path = os.path.join(folder, name)
+        mtime = os.path.getmtime(path)
+        digest, size = _blob_store.put(path)
+        records.append({'name': name, 'sha256': digest, 'size': size, 'mtime': mtime,
+                        'mime': mimetypes.guess_type(name)[0]})
+    link_attachments(folder, records)
+    with transaction() as conn:
+        _insert_attachments(conn.cursor(), case_id, records)
+    return records
+
+
+def _insert_attachments(cur, case_id, attachments):
+    cur.executemany('''INSERT INTO attachments (case_id, name, sha256, size, mtime, mime) VALUES (?, ?, ?, ?, ?, ?)
+                       ON CONFLICT(case_id, name) DO UPDATE SET sha256 = excluded.sha256, size = excluded.size,
+                                                               mtime = excluded.mtime, mime = excluded.mime''',
+                    [(case_id, a['name'], a['sha256'], a['size'], a.get('mtime'), a.get('mime')) for a in attachments])
+
+
+def get_attachments(case_id: str):
+    """Return the attachments of a case as dicts (name, sha256, size, mtime, mime), by name."""
+    cur = get_connection().cursor()
+    cur.execute('SELECT name, sha256, size, mtime, mime FROM attachments WHERE case_id = ? ORDER BY name', (case_id,))
+    col_names = [d[0] for d in cur.description]
+    return [dict(zip(col_names, r)) for r in cur.fetchall()]
+
+
+def attachment_stats(case_ids=None):
+    """Return {case_id: (attachment count, total bytes)} in a single query.
+
+    With `case_ids`, only those cases are looked up (passed as one JSON
+    parameter, so there is no limit on how many); otherwise every case with
+    attachments is returned. Cases without attachments are left out.
+    """
+    sql = 'SELECT case_id, COUNT(*), COALESCE(SUM(size), 0) FROM attachments'
+    params = ()
+    if case_ids is not None:
+        sql += ' WHERE case_id IN (SELECT value FROM json_each(?))'
+        params = (json.dumps([str(c) for c in case_ids]),)
+    cur = get_connection().cursor()
+    cur.execute(sql + ' GROUP BY case_id', params)
+    return {r[0]: (r[1], r[2]) for r in cur.fetchall()}
+
+
+def collect_blobs(grace=BLOB_GC_GRACE_SECONDS):
+    """Delete stored blobs that no attachment references any more. Returns how many were removed.
+
+    Attachments of archived cases count too: unarchive_cases() links their
+    files back from the blob store.
+    """
+    # Always attached, so a case archived by another process while this
+    # runs is seen on one side or the other.
+    cur = _archive_connection().cursor()
+    cur.execute('SELECT sha256 FROM main.attachments UNION SELECT sha256 FROM archive.attachments')
+    return _blob_store.collect_garbage({r[0] for r in cur.fetchall()}, time.time() - grace)
+
+
+def add_case(data: dict, attachments=()):
+    with transaction() as conn:
+        cur = conn.cursor()
+        _insert_case(cur, data)
+        _index_case(cur, data['id'])
+        _insert_attachments(cur, data['id'], attachments)
+    backup_db()
+    request_document_index(data['id'])
+
+
+def _insert_case(cur, data):
+    cur.execute('''INSERT INTO cases (id, title, date, duration, duration_from, duration_to, mojer, mostajjer, karfarma, piman, subject, contract_amount, bank_owner_name, bank_account_number, bank_shaba_number, bank_card_number, bank_name, bank_branch, payment_id, guarantee_amount, guarantee_type, description, folder_path, case_type, status, contract_amount_int, date_ord, duration_from_ord, duration_to_ord)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', (
         data['id'], data.get('title'), data.get('date'), data.get('duration'), data.get('duration_from'), data.get('duration_to'),
         data.get('mojer'), data.get('mostajjer'), data.get('karfarma'), data.get('piman'),
         data.get('subject'), data.get('contract_amount'), 
         data.get('bank_owner_name'), data.get('bank_account_number'), data.get('bank_shaba_number'), data.get('bank_card_number'),
         data.get('bank_name'), data.get('bank_branch'), data.get('payment_id'),
         data.get('guarantee_amount'), data.get('guarantee_type'),
-        data.get('description'), data.get('folder_path'), data.get('case_type'), data.get('status', 'در جریان')
+        data.get('description'), data.get('folder_path'), data.get('case_type'), data.get('status', 'در جریان'),
+        *_typed_values(data)
     ))
-    conn.commit()
-    conn.close()
-    backup_db()
 
 
 def get_case_by_id(case_id: str):
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute('SELECT * FROM cases WHERE id = ?', (case_id,))
+    cur.execute('SELECT * FROM cases WHERE id = ? AND deleted_at IS NULL', (case_id,))
     row = cur.fetchone()
     if not row:
-        conn.close()
         return None
     # Use cursor.description to get the actual column order from the DB; this
     # avoids mismatches when the schema has been migrated (columns added).
     col_names = [d[0] for d in cur.description]
-    result = dict(zip(col_names, row))
-    conn.close()
-    return result
+    return dict(zip(col_names, row))
 
 
-def update_case(case_id: str, data: dict):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('''UPDATE cases SET title=?, date=?, duration=?, duration_from=?, duration_to=?, mojer=?, mostajjer=?, karfarma=?, piman=?, subject=?, contract_amount=?, bank_owner_name=?, bank_account_number=?, bank_shaba_number=?, bank_card_number=?, bank_name=?, bank_branch=?, payment_id=?, guarantee_amount=?, guarantee_type=?, description=?, folder_path=?, case_type=?, status=? WHERE id=?''', (
+def get_archived_case(case_id: str):
+    """Return an archived case as a dict (like get_case_by_id), or None."""
+    if not os.path.exists(ARCHIVE_DB_PATH):
+        return None
+    cur = _archive_connection().cursor()
+    cur.execute('SELECT * FROM archive.cases WHERE id = ?', (case_id,))
+    row = cur.fetchone()
+    if not row:
+        return None
+    return dict(zip([d[0] for d in cur.description], row))
+
+
+def update_case(case_id: str, data: dict, attachments=()):
+    with transaction() as conn:
+        cur = conn.cursor()
+        _update_case(cur, case_id, data)
+        _index_case(cur, case_id)
+        _insert_attachments(cur, case_id, attachments)
+    backup_db()
+    request_document_index(case_id)
+
+
+def _update_case(cur, case_id, data):
+    cur.execute('''UPDATE cases SET title=?, date=?, duration=?, duration_from=?, duration_to=?, mojer=?, mostajjer=?, karfarma=?, piman=?, subject=?, contract_amount=?, bank_owner_name=?, bank_account_number=?, bank_shaba_number=?, bank_card_number=?, bank_name=?, bank_branch=?, payment_id=?, guarantee_amount=?, guarantee_type=?, description=?, folder_path=?, case_type=?, status=?, contract_amount_int=?, date_ord=?, duration_from_ord=?, duration_to_ord=? WHERE id=?''', (
         data.get('title'), data.get('date'), data.get('duration'), data.get('duration_from'), data.get('duration_to'),
         data.get('mojer'), data.get('mostajjer'), data.get('karfarma'), data.get('piman'),
         data.get('subject'), data.get('contract_amount'),
         data.get('bank_owner_name'), data.get('bank_account_number'), data.get('bank_shaba_number'), data.get('bank_card_number'),
         data.get('bank_name'), data.get('bank_branch'), data.get('payment_id'),
         data.get('guarantee_amount'), data.get('guarantee_type'),
-        data.get('description'), data.get('folder_path'), data.get('case_type'), data.get('status', 'در جریان'), case_id
+        data.get('description'), data.get('folder_path'), data.get('case_type'), data.get('status', 'در جریان'),
+        *_typed_values(data), case_id
     ))
-    conn.commit()
-    conn.close()
-    backup_db()
 
 
 def delete_case(case_id: str):
-    # remove db record
+    """Move one case to the trash; see trash_cases(). Returns 1 if it was trashed, else 0."""
+    return trash_cases([case_id])
+
+
+def delete_cases(case_ids):
+    """Delete many cases in one transaction and schedule a single backup.
+
+    Upload folders are removed afterwards on a worker pool. Returns one
+    Future per folder being removed; a Future's exception() reports a
+    folder that could not be deleted. Callers in the UI poll them with
+    after() rather than blocking.
+    """
+    case_ids = [str(c) for c in case_ids]
+    folders = {}
+    with transaction() as conn:
+        cur = conn.cursor()
+        for start in range(0, len(case_ids), SQL_BATCH_SIZE):
+            chunk = case_ids[start:start + SQL_BATCH_SIZE]
+            cur.execute(f"""SELECT c.folder_path, a.sha256 FROM cases c LEFT JOIN attachments a ON a.case_id = c.id
+                            WHERE c.id IN ({','.join('?' * len(chunk))})""", chunk)
+            for folder, digest in cur.fetchall():
+                if folder:
+                    blobs = folders.setdefault(folder, [])
+                    if digest:
+                        blobs.append(blob_path(digest))
+        cur.executemany('DELETE FROM cases WHERE id = ?', [(c,) for c in case_ids])
+    backup_db()
+    return [_io_pool().submit(remove_tree, folder, blobs) for folder, blobs in folders.items() if os.path.exists(folder)]
+
+
+def trash_cases(case_ids):
+    """Soft-delete cases: flag the rows and move their upload folders to TRASH_DIR.
+
+    Moving a folder is a rename on the same filesystem, so this returns at
+    once however large the attachments are. restore_cases() undoes it and
+    purge_trash() later deletes trashed cases for good. Returns the number
+    of cases trashed.
+    """
+    now = int(time.time())
+    moved = []
+    trashed_count = 0
+    try:
+        with transaction() as conn:
+            cur = conn.cursor()
+            for case_id in map(str, case_ids):
+                cur.execute('SELECT folder_path FROM cases WHERE id = ? AND deleted_at IS NULL', (case_id,))
+                row = cur.fetchone()
+                if not row:
+                    continue
+                folder = row[0]
+                trashed = None
+                if folder and os.path.isdir(folder):
+                    ensure_dirs()
+                    trashed = os.path.join(TRASH_DIR, f'{os.path.basename(folder)}_{now}')
+                    os.rename(folder, trashed)
+                    moved.append((trashed, folder))
+                cur.execute('UPDATE cases SET deleted_at = ?, trashed_from = ?, folder_path = ? WHERE id = ?',
+                            (now, folder if trashed else None, trashed or folder, case_id))
+                trashed_count += 1
+    except Exception:
+        # The rows were rolled back; put the folders back with them.
+        for trashed, folder in reversed(moved):
+            os.rename(trashed, folder)
+        raise
+    backup_db()
+    return trashed_count
+
+
+def restore_cases(case_ids):
+    """Undo trash_cases(): clear the flag and move the folders back. Returns the number restored."""
+    moved = []
+    restored = 0
+    try:
+        with transaction() as conn:
+            cur = conn.cursor()
+            for case_id in map(str, case_ids):
+                cur.execute('SELECT folder_path, trashed_from FROM cases WHERE id = ? AND deleted_at IS NOT NULL', (case_id,))
+                row = cur.fetchone()
+                if not row:
+                    continue
+                folder, original = row
+                if original and folder and os.path.isdir(folder):
+                    os.makedirs(os.path.dirname(original), exist_ok=True)
+                    os.rename(folder, original)
+                    moved.append((folder, original))
+                    folder = original
+                cur.execute('UPDATE cases SET deleted_at = NULL, trashed_from = NULL, folder_path = ? WHERE id = ?',
+                            (folder, case_id))
+                restored += 1
+    except Exception:
+        for trashed, original in reversed(moved):
+            os.rename(original, trashed)
+        raise
+    backup_db()
+    return restored
+
+
+def shard_upload_folders():
+    """Move case folders from the old flat UPLOADS_DIR layout to case_folder().
+
+    Each move is a rename. folder_path (and trashed_from, for trashed
+    cases) is rewritten in bulk, one transaction per SQL_BATCH_SIZE moves,
+    so an interruption loses at most one batch of path updates, and running
+    this again repairs them. Folders outside UPLOADS_DIR and targets that
+    already exist are left alone. Returns the number of cases updated.
+    """
+    uploads = os.path.normcase(os.path.abspath(UPLOADS_DIR))
+    cur = get_connection().cursor()
+    cur.execute('SELECT id, folder_path, trashed_from FROM cases')
+    pending = []
+    updated = 0
+    for case_id, folder, original in cur.fetchall():
+        target = case_folder(case_id)
+        current = original or folder
+        if not current or os.path.normcase(os.path.abspath(current)) == os.path.normcase(os.path.abspath(target)):
+            continue
+        if os.path.normcase(os.path.dirname(os.path.abspath(current))) != uploads:
+            continue
+        if original is None:
+            if os.path.isdir(folder):
+                if os.path.exists(target):
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.rename(folder, target)
+            elif not os.path.isdir(target):
+                continue
+        pending.append((case_id, target, original is not None))
+        if len(pending) >= SQL_BATCH_SIZE:
+            updated += _rewrite_folder_paths(pending)
+            pending = []
+    if pending:
+        updated += _rewrite_folder_paths(pending)
+    return updated
+
+
+def _rewrite_folder_paths(moves):
+    with transaction() as conn:
+        cur = conn.cursor()
+        cur.executemany('UPDATE cases SET folder_path = ? WHERE id = ?',
+                        [(target, case_id) for case_id, target, trashed in moves if not trashed])
+        # A trashed case stays in TRASH_DIR; it is restored to the new place.
+        cur.executemany('UPDATE cases SET trashed_from = ? WHERE id = ?',
+                        [(target, case_id) for case_id, target, trashed in moves if trashed])
+    backup_db()
+    return len(moves)
+
+
+def purge_trash(older_than=TRASH_RETENTION_SECONDS):
+    """Permanently delete cases trashed more than `older_than` seconds ago.
+
+    Orphan folders the reconciler moved to the trash that long ago go too.
+    Returns the folder-removal Futures (see delete_cases()).
+    """
+    cutoff = int(time.time()) - older_than
+    cur = get_connection().cursor()
+    cur.execute('SELECT id FROM cases WHERE deleted_at < ?', (cutoff,))
+    case_ids = [r[0] for r in cur.fetchall()]
+    futures = delete_cases(case_ids) if case_ids else []
+    return futures + [_io_pool().submit(_remove_orphan, path) for path in _expired_orphans(cutoff)]
+
+
+def _expired_orphans(cutoff):
+    expired = []
+    if not os.path.isdir(TRASH_DIR):
+        return expired
+    with os.scandir(TRASH_DIR) as it:
+        for entry in it:
+            moved = entry.name.rsplit('_', 1)[-1]
+            if entry.name.startswith(ORPHAN_PREFIX) and moved.isdigit() and int(moved) < cutoff and entry.is_dir():
+                expired.append(entry.path)
+    return expired
+
+
+def _remove_orphan(folder):
+    # No attachment rows say which blobs its files link to, so each file is
+    # removed through the blob store, which finds out where it has to.
+    for dirpath, _, names in os.walk(folder):
+        for name in names:
+            _blob_store.unlink(os.path.join(dirpath, name))
+    remove_tree(folder)
+
+
+def _run_trash_purger():
+    delay = TRASH_PURGE_FIRST_DELAY
+    while not _workers_stop.wait(delay):
+        delay = TRASH_PURGE_INTERVAL
+        try:
+            purge_trash()
+            collect_blobs()
+        except Exception as e:
+            print(f"Trash purge error: {e}")
+
+
+def request_document_index(case_id):
+    """Queue a case for the background document indexer."""
+    with _index_lock:
+        _index_queue.add(str(case_id))
+    _index_wake.set()
+
+
+def index_case_documents(case_id):
+    """Extract text from new or changed documents in a case folder into the search index.
+
+    Files whose mtime and size match what was recorded last time are
+    skipped; a changed file is hashed, and its text is only extracted if no
+    file with the same content has been seen before. Returns True if the
+    case's indexed text changed.
+    """
+    cur = get_connection().cursor()
+    cur.execute('SELECT rowid, folder_path FROM cases WHERE id = ? AND deleted_at IS NULL', (case_id,))
+    row = cur.fetchone()
+    if not row:
+        return False
+    rowid, folder = row
+    cur.execute('SELECT name, mtime, size, sha256 FROM case_documents WHERE case_id = ?', (case_id,))
+    seen = {r[0]: r[1:] for r in cur.fetchall()}
+
+    found = {}
+    if folder and os.path.isdir(folder):
+        for entry in os.scandir(folder):
+            if entry.is_file() and is_supported(entry.name):
+                st = entry.stat()
+                found[entry.name] = (st.st_mtime, st.st_size, entry.path)
+
+    changed = bool(seen.keys() - found.keys())
+    rows = []
+    texts = []
+    for name, (mtime, size, path) in found.items():
+        old = seen.get(name)
+        if old and old[0] == mtime and old[1] == size:
+            continue
+        try:
+            digest, _ = hash_file(path)
+        except OSError:
+            continue
+        if not old or old[2] != digest:
+            changed = True
+            cur.execute('SELECT 1 FROM document_text WHERE sha256 = ?', (digest,))
+            if not cur.fetchone():
+                try:
+                    text = extract_text(path)
+                except Exception as e:
+                    print(f"Document index error ({path}): {e}")
+                    text = None
+                # NULL content marks a file that could not be read; it is
+                # recorded like any other, so it is not retried until it changes.
+                texts.append((digest, normalize_text(text) if text is not None else None))
+        rows.append((case_id, name, mtime, size, digest))
+
+    if not rows and not changed:
+        return False
+    with transaction() as conn:
+        cur = conn.cursor()
+        cur.executemany('INSERT OR IGNORE INTO document_text (sha256, content) VALUES (?, ?)', texts)
+        cur.executemany('''INSERT INTO case_documents (case_id, name, mtime, size, sha256) VALUES (?, ?, ?, ?, ?)
+                           ON CONFLICT(case_id, name) DO UPDATE SET mtime = excluded.mtime, size = excluded.size,
+                                                                   sha256 = excluded.sha256''', rows)
+        cur.executemany('DELETE FROM case_documents WHERE case_id = ? AND name = ?',
+                        [(case_id, name) for name in seen.keys() - found.keys()])
+        if changed:
+            cur.execute('''SELECT group_concat(t.content, char(10)) FROM case_documents d
+                           JOIN document_text t ON t.sha256 = d.sha256
+                           WHERE d.case_id = ? AND length(t.content) > 0''', (case_id,))
+            content = cur.fetchone()[0]
+            cur.execute(f'UPDATE cases_norm SET {FTS_CONTENT_COLUMN} = ? WHERE rowid = ?',
+                        (content[:MAX_CASE_CONTENT] if content else None, rowid))
+    return changed
+
+
+def _index_documents_safely(case_id):
+    # One case failing (a folder that cannot be listed, a locked database)
+    # must not stop the others; it is tried again on the next sweep.
+    try:
+        index_case_documents(case_id)
+    except Exception as e:
+        print(f"Document index error ({case_id}): {e}")
+
+
+def index_all_documents():
+    """Run index_case_documents() over every case, then drop text no case uses any more."""
+    cur = get_connection().cursor()
+    cur.execute('SELECT id FROM cases WHERE deleted_at IS NULL')
+    for (case_id,) in cur.fetchall():
+        if _workers_stop.is_set():
+            return
+        _index_documents_safely(case_id)
+    with transaction() as conn:
+        conn.execute('DELETE FROM document_text WHERE sha256 NOT IN (SELECT sha256 FROM case_documents)')
+
+
+def _run_document_indexer():
+    next_sweep = 0
+    while not _workers_stop.is_set():
+        try:
+            if time.time() >= next_sweep:
+                try:
+                    index_all_documents()
+                finally:
+                    # A failed sweep waits for the next interval like a good one.
+                    next_sweep = time.time() + DOCUMENT_SWEEP_INTERVAL
+            with _index_lock:
+                queued = list(_index_queue)
+                _index_queue.clear()
+                _index_wake.clear()
+            for case_id in queued:
+                _index_documents_safely(case_id)
+        except Exception as e:
+            print(f"Document index error: {e}")
+        _index_wake.wait(max(0, next_sweep - time.time()))
+
+
+def _io_pool():
+    global _io_executor
+    if _io_executor is None:
+        _io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='uploads-io')
+    return _io_executor
+
+
+def _archive_connection():
+    """Return this thread's connection with archive.db attached as `archive`.
+
+    The archive schema is created on first use and gains any columns added
+    to `cases` since, so rows can always be copied across by column name.
+    """
     conn = get_connection()
+    if any(r[1] == 'archive' for r in conn.execute('PRAGMA database_list')):
+        return conn
+    conn.execute('ATTACH DATABASE ? AS archive', (ARCHIVE_DB_PATH,))
+    conn.execute('PRAGMA archive.journal_mode=WAL')
+    for table, columns in (('cases', conn.execute('PRAGMA main.table_info(cases)').fetchall()),
+                           ('attachments', conn.execute('PRAGMA main.table_info(attachments)').fetchall())):
+        have = {r[1] for r in conn.execute(f'PRAGMA archive.table_info({table})')}
+        if not have:
+            cols = ', '.join(f"{r[1]} {r[2]}{' PRIMARY KEY' if r[5] and table == 'cases' else ''}" for r in columns)
+            conn.execute(f'CREATE TABLE archive.{table} ({cols})')
+        else:
+            for r in columns:
+                if r[1] not in have:
+                    conn.execute(f'ALTER TABLE archive.{table} ADD COLUMN {r[1]} {r[2]}')
+    conn.execute(f"CREATE TABLE IF NOT EXISTS archive.cases_norm (rowid INTEGER PRIMARY KEY, {', '.join(f'{c} TEXT' for c in INDEX_COLUMNS)})")
+    have = {r[1] for r in conn.execute('PRAGMA archive.table_info(cases_norm)')}
+    for c in INDEX_COLUMNS:
+        if c not in have:
+            conn.execute(f'ALTER TABLE archive.cases_norm ADD COLUMN {c} TEXT')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_archive_date ON cases (date_ord)')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_archive_attachments ON attachments (case_id)')
+    return conn
+
+
+def _pack_folder(case_id, folder):
+    """Pack a case folder into ARCHIVE_DIR/<id>.tar.xz and return the archive path."""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_DIR, f'{case_id}.tar.xz')
+    tmp = path + '.part'
+    try:
+        with tarfile.open(tmp, 'w:xz', preset=6) as tar:
+            tar.add(folder, arcname=case_id)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return path
+
+
+def _drop_archived(cur, case_id):
+    cur.execute('DELETE FROM archive.cases_norm WHERE rowid = (SELECT rowid FROM archive.cases WHERE id = ?)', (case_id,))
+    cur.execute('DELETE FROM archive.attachments WHERE case_id = ?', (case_id,))
+    cur.execute('DELETE FROM archive.cases WHERE id = ?', (case_id,))
+
+
+def _settle_interrupted_moves(conn):
+    """Resolve cases left in both databases by an interrupted archive or unarchive run.
+
+    The cases.db copy is kept: after an interrupted archive run its folder
+    has not been removed yet, and after an interrupted unarchive run the
+    folder has already been unpacked. The archive.db copy and its packed
+    folder are dropped. Returns the number of cases resolved.
+    """
+    rows = conn.execute('''SELECT a.id, a.folder_path, m.folder_path FROM archive.cases a
+                           JOIN main.cases m ON m.id = a.id''').fetchall()
+    for case_id, packed, folder in rows:
+        with transaction() as conn:
+            _drop_archived(conn.cursor(), case_id)
+        if packed and packed.endswith('.tar.xz') and os.path.isfile(packed) and folder and os.path.isdir(folder):
+            os.remove(packed)
+    return len(rows)
+
+
+def archive_inactive_cases(older_than_days=ARCHIVE_AFTER_DAYS, limit=None):
+    """Move inactive cases into archive.db and pack their folders with lzma.
+
+    Picks cases with status ARCHIVE_STATUS dated more than `older_than_days`
+    ago (an index range scan on (status, date_ord)). Each case is handled
+    on its own: the folder is packed, the rows are copied into archive.db
+    in one transaction and deleted from cases.db in a second, and only then
+    is the folder deleted. One COMMIT over both files would not be atomic
+    (cases.db is in WAL mode), so the move is made restartable instead: a
+    crash between the two transactions leaves the case in both databases,
+    and the next archive or unarchive run keeps the cases.db copy (see
+    _settle_interrupted_moves). Returns the number archived.
+    """
+    cutoff = jdatetime.date.today().toordinal() - older_than_days
+    conn = _archive_connection()
+    _settle_interrupted_moves(conn)
     cur = conn.cursor()
-    cur.execute('SELECT folder_path FROM cases WHERE id = ?', (case_id,))
-    row = cur.fetchone()
-    folder = None
-    if row:
-        folder = row[0]
-    cur.execute('DELETE FROM cases WHERE id = ?', (case_id,))
-    conn.commit()
-    conn.close()
-    # remove folder if exists
-    if folder and os.path.exists(folder):
+    cur.execute('SELECT id, folder_path FROM main.cases WHERE status = ? AND date_ord < ? AND deleted_at IS NULL'
+                + (' LIMIT ?' if limit else ''),
+                (ARCHIVE_STATUS, cutoff, limit) if limit else (ARCHIVE_STATUS, cutoff))
+    candidates = cur.fetchall()
+    if not candidates:
+        return 0
+    case_cols = ', '.join(r[1] for r in conn.execute('PRAGMA main.table_info(cases)'))
+    att_cols = ', '.join(r[1] for r in conn.execute('PRAGMA main.table_info(attachments)'))
+    norm_cols = ', '.join(INDEX_COLUMNS)
+    archived = 0
+    for case_id, folder in candidates:
+        if _workers_stop.is_set():
+            break
+        packed = _pack_folder(case_id, folder) if folder and os.path.isdir(folder) else None
         try:
-            shutil.rmtree(folder)
+            with transaction() as conn:
+                cur = conn.cursor()
+                cur.execute(f'INSERT INTO archive.cases ({case_cols}) SELECT {case_cols} FROM main.cases WHERE id = ?', (case_id,))
+                cur.execute('UPDATE archive.cases SET folder_path = ? WHERE id = ?', (packed or folder, case_id))
+                cur.execute(f'''INSERT INTO archive.cases_norm (rowid, {norm_cols})
+                               SELECT a.rowid, {', '.join(f'n.{c}' for c in INDEX_COLUMNS)}
+                               FROM main.cases m JOIN main.cases_norm n ON n.rowid = m.rowid
+                               JOIN archive.cases a ON a.id = m.id WHERE m.id = ?''', (case_id,))
+                cur.execute(f'INSERT INTO archive.attachments ({att_cols}) SELECT {att_cols} FROM main.attachments WHERE case_id = ?', (case_id,))
         except Exception:
-            pass
+            if packed:
+                os.remove(packed)
+            raise
+        with transaction() as conn:
+            conn.execute('DELETE FROM main.cases WHERE id = ?', (case_id,))
+        if packed:
+            remove_tree(folder, _case_blobs(conn, case_id, 'archive'))
+        archived += 1
     backup_db()
+    _backup_archive()
+    return archived
 
 
-def search_cases(filter_type: str, query: str):
-    conn = get_connection()
-    cur = conn.cursor()
-    q = f"%{query}%"
-    # Always include 'subject' in the returned columns so the UI can display it
-    if filter_type == 'title':
-           cur.execute('SELECT id, title, subject, date, case_type, duration, status, contract_amount FROM cases WHERE title LIKE ? ORDER BY date DESC', (q,))
-    elif filter_type == 'subject':
-           cur.execute('SELECT id, title, subject, date, case_type, duration, status, contract_amount FROM cases WHERE subject LIKE ? ORDER BY date DESC', (q,))
-    elif filter_type == 'date':
-           cur.execute('SELECT id, title, subject, date, case_type, duration, status, contract_amount FROM cases WHERE date LIKE ? ORDER BY date DESC', (q,))
-    elif filter_type == 'case_type':
-           cur.execute('SELECT id, title, subject, date, case_type, duration, status, contract_amount FROM cases WHERE case_type LIKE ? ORDER BY date DESC', (q,))
-    elif filter_type == 'id':
-           cur.execute('SELECT id, title, subject, date, case_type, duration, status, contract_amount FROM cases WHERE id LIKE ? ORDER BY date DESC', (q,))
-    else:  # full search
-           cur.execute('''SELECT id, title, subject, date, case_type, duration, status, contract_amount FROM cases
-                       WHERE id LIKE ? OR title LIKE ? OR subject LIKE ? OR description LIKE ? OR contract_amount LIKE ? OR case_type LIKE ? ORDER BY date DESC''', (q, q, q, q, q, q))
-    rows = cur.fetchall()
-    conn.close()
+def _case_blobs(conn, case_id, schema='main'):
+    """Return the blob paths of a case's attachments, for remove_tree()."""
+    return [blob_path(r[0]) for r in conn.execute(f'SELECT sha256 FROM {schema}.attachments WHERE case_id = ?', (case_id,))]
+
+
+def _unpack_folder(packed, case_id, parent):
+    """Unpack a folder packed by _pack_folder() into `parent`."""
+    with tarfile.open(packed, 'r:xz') as tar:
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(parent, filter='data')
+            return
+        # No extraction filters before Python 3.10.12 / 3.11.4: accept only
+        # plain files, folders and hard links (tar.add() stores a second name
+        # of the same blob as one) that stay inside the case folder.
+        def inside(name):
+            parts = os.path.normpath(name).split(os.sep)
+            return not os.path.isabs(name) and parts[0] == case_id and '..' not in parts
+
+        members = tar.getmembers()
+        for member in members:
+            if not inside(member.name) or not (member.isfile() or member.isdir()
+                                               or (member.islnk() and inside(member.linkname))):
+                raise tarfile.TarError(f'Unsafe member in {packed}: {member.name}')
+        tar.extractall(parent, members)
+
+
+def _relink_unpacked(folder, attachments):
+    """Replace unpacked attachment files with links into the blob store.
+
+    A file whose blob is gone (collected before collect_blobs() counted
+    archive.db) is stored again from the unpacked copy.
+    """
+    for name, digest in attachments:
+        path = os.path.join(folder, name)
+        if not os.path.isfile(path):
+            continue
+        if os.path.exists(_blob_store.path(digest)) or _blob_store.put(path)[0] == digest:
+            _blob_store.link(digest, path)
+
+
+def unarchive_cases(case_ids):
+    """Bring archived cases back into the hot database and unpack their folders. Returns the number restored.
+
+    Like archive_inactive_cases(), each case moves in two transactions,
+    the copy into cases.db and then the delete from archive.db, so an
+    interrupted run can simply be repeated.
+    """
+    if not os.path.exists(ARCHIVE_DB_PATH):
+        return 0
+    conn = _archive_connection()
+    _settle_interrupted_moves(conn)
+    case_cols = ', '.join(r[1] for r in conn.execute('PRAGMA main.table_info(cases)'))
+    att_cols = ', '.join(r[1] for r in conn.execute('PRAGMA main.table_info(attachments)'))
+    restored = 0
+    for case_id in map(str, case_ids):
+        row = conn.execute('SELECT folder_path FROM archive.cases WHERE id = ?', (case_id,)).fetchone()
+        if not row:
+            continue
+        packed = row[0] if row[0] and row[0].endswith('.tar.xz') and os.path.isfile(row[0]) else None
+        folder = case_folder(case_id)
+        if packed:
+            # Anything already there is a partial unpack from an interrupted run.
+            if os.path.isdir(folder):
+                remove_tree(folder, _case_blobs(conn, case_id, 'archive'))
+            os.makedirs(os.path.dirname(folder), exist_ok=True)
+            _unpack_folder(packed, case_id, os.path.dirname(folder))
+            _relink_unpacked(folder, conn.execute('SELECT name, sha256 FROM archive.attachments WHERE case_id = ?',
+                                                  (case_id,)).fetchall())
+        with transaction() as conn:
+            cur = conn.cursor()
+            cur.execute(f'INSERT INTO main.cases ({case_cols}) SELECT {case_cols} FROM archive.cases WHERE id = ?', (case_id,))
+            cur.execute('UPDATE main.cases SET folder_path = ? WHERE id = ?', (folder if packed else row[0], case_id))
+            cur.execute(f'INSERT OR IGNORE INTO main.attachments ({att_cols}) SELECT {att_cols} FROM archive.attachments WHERE case_id = ?', (case_id,))
+            _index_case(cur, case_id)
+        with transaction() as conn:
+            _drop_archived(conn.cursor(), case_id)
+        if packed:
+            os.remove(packed)
+        request_document_index(case_id)
+        restored += 1
+    backup_db()
+    _backup_archive()
+    return restored
+
+
+def _backup_archive():
+    """Copy archive.db to BACKUP_DIR; it only changes when cases are archived or restored."""
+    dst = sqlite3.connect(os.path.join(BACKUP_DIR, 'archive.db'))
+    try:
+        _archive_connection().backup(dst, name='archive')
+    finally:
+        dst.close()
+
+
+def _fts_match_expr(query, column=None):
+    """Build an FTS5 MATCH expression that ANDs the words of `query`.
+
+    `query` must already be normalized. With `column`, the match is limited
+    to that column. Returns None when the query has a word too short for the
+    trigram index, in which case the caller falls back to LIKE.
+    """
+    terms = query.split()
+    if not terms or any(len(t) < FTS_MIN_TERM for t in terms):
+        return None
+    expr = ' '.join('"' + t.replace('"', '""') + '"' for t in terms)
+    return f'{column} : ({expr})' if column else expr
+
+
+DEFAULT_SEARCH_COLUMNS = ('id', 'title', 'subject', 'date', 'case_type', 'duration', 'status', 'contract_amount')
+# Computed fields that can be requested alongside the real columns.
+COMPUTED_COLUMNS = {
+    'duration_days': 'c.duration_to_ord - c.duration_from_ord',
+    # Correlated subqueries on the attachments primary key (case_id, name),
+    # in the database the case row is read from ({schema}: main or archive).
+    'attachment_count': '(SELECT COUNT(*) FROM {schema}.attachments a WHERE a.case_id = c.id)',
+    'attachment_size': '(SELECT COALESCE(SUM(a.size), 0) FROM {schema}.attachments a WHERE a.case_id = c.id)',
+}
+# Orderings are total (they end in a unique column) so keyset pagination can
+# resume exactly after the last row of a page.
+RANKED_ORDER = 'ORDER BY cases_fts.rank, c.rowid'
+DATE_ORDER = 'ORDER BY c.date_ord DESC, c.id DESC'
+# Sort keys of the result grid columns. Dates, amounts and durations sort on
+# their typed shadows, so they order as numbers rather than as display text.
+SORT_KEYS = {
+    'id': 'c.id',
+    'title': 'c.title',
+    'subject': 'c.subject',
+    'date': 'c.date_ord',
+    'case_type': 'c.case_type',
+    'duration': 'c.duration_to_ord - c.duration_from_ord',
+    'status': 'c.status',
+    'contract_amount': 'c.contract_amount_int',
+    'attachments': COMPUTED_COLUMNS['attachment_count'],
+}
+
+_case_columns = None
+
+
+def _table_columns():
+    global _case_columns
+    if _case_columns is None:
+        _case_columns = frozenset(r[1] for r in get_connection().execute('PRAGMA table_info(cases)'))
+    return _case_columns
+
+
+@functools.lru_cache(maxsize=None)
+def _record_type(fields):
+    return collections.namedtuple('CaseRecord', fields)
+
+
+def _schema_expr(expr, archive):
+    return expr.format(schema='archive' if archive else 'main')
+
+
+def _projection(columns, snippets=False, ranked=False, archive=False):
+    """Return (select sql, record type) for a tuple of column names.
+
+    Records are namedtuples, so callers can use r.title as well as r[1].
+    With `archive`, computed columns read archive.db's tables.
+    """
+    columns = tuple(columns or DEFAULT_SEARCH_COLUMNS)
+    exprs = []
+    for col in columns:
+        if col in COMPUTED_COLUMNS:
+            exprs.append(f'{_schema_expr(COMPUTED_COLUMNS[col], archive)} AS {col}')
+        elif col in _table_columns():
+            exprs.append(f'c.{col}')
+        else:
+            raise ValueError(f'Unknown column: {col}')
+    if snippets:
+        exprs.append("snippet(cases_fts, -1, '[', ']', '…', 32)" if ranked else 'NULL')
+        columns += ('snippet',)
+    return 'SELECT ' + ', '.join(exprs), _record_type(columns)
+
+
+def _search_source(filter_type, query):
+    """Return (FROM/WHERE sql, params, ranked) for a search_cases filter."""
+    if filter_type == 'date':
+        return 'FROM cases c WHERE c.date LIKE ? AND c.deleted_at IS NULL', [f"%{query}%"], False
+
+    # 'full' searches every indexed column; the other filters name one.
+    column = filter_type if filter_type in FTS_COLUMNS else None
+    nq = normalize_text(query)
+    match = _fts_match_expr(nq, column)
+    if match:
+        return ('FROM cases_fts JOIN cases c ON c.rowid = cases_fts.rowid WHERE cases_fts MATCH ? AND c.deleted_at IS NULL',
+                [match], True)
+
+    cols = (column,) if column else INDEX_COLUMNS
+    where = ' OR '.join(f'n.{c} LIKE ?' for c in cols)
+    return (f'FROM cases c JOIN cases_norm n ON n.rowid = c.rowid WHERE ({where}) AND c.deleted_at IS NULL',
+            [f"%{nq}%"] * len(cols), False)
+
+
+def _archive_source(filter_type, query):
+    """Return (FROM/WHERE sql, params) for a search_cases filter over archive.db.
+
+    Archived cases have no full-text index; they are matched with LIKE on
+    their normalized text, which is fine for a cold, rarely searched set.
+    """
+    if filter_type == 'date':
+        return 'FROM archive.cases c WHERE c.date LIKE ?', [f"%{query}%"]
+    column = filter_type if filter_type in FTS_COLUMNS else None
+    cols = (column,) if column else INDEX_COLUMNS
+    where = ' OR '.join(f'n.{c} LIKE ?' for c in cols)
+    return (f'FROM archive.cases c JOIN archive.cases_norm n ON n.rowid = c.rowid WHERE ({where})',
+            [f"%{normalize_text(query)}%"] * len(cols))
+
+
+# Criteria understood by compile_filter(). Values that are None or '' are
+# ignored; status and case_type also take a list of allowed values.
+FILTER_KEYS = ('status', 'case_type', 'date_from', 'date_to', 'end_from', 'end_to',
+               'amount_min', 'amount_max', 'party', 'text')
+
+
+def _filter_bound(criteria, key, parse):
+    value = criteria.get(key)
+    if value is None or value == '':
+        return None
+    parsed = parse(value)
+    if parsed is None:
+        raise ValueError(f'Invalid value for {key}: {value!r}')
+    return parsed
+
+
+def _filter_amount(value):
+    return value if isinstance(value, int) else parse_amount(str(value))
+
+
+def compile_filter(criteria, archive=False):
+    """Compile filter criteria into (FROM/WHERE sql, params, ranked).
+
+    `criteria` is a dict with any of FILTER_KEYS; every given criterion must
+    hold (they are ANDed). Equality and ranges go to the typed, indexed
+    columns (status, case_type, date_ord, duration_to_ord,
+    contract_amount_int). `text` and `party` become one MATCH on the search
+    index (party as a column filter on its party names); a term too short
+    for the trigram index falls back to LIKE on the normalized text. With
+    `archive`, the statement is for archive.db, which has no search index.
+    Raises ValueError for an unknown key or a date or amount it cannot read.
+    """
+    unknown = set(criteria) - set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown filter: {', '.join(sorted(unknown))}")
+    where = [] if archive else ['c.deleted_at IS NULL']
+    params = []
+    for key in ('status', 'case_type'):
+        values = criteria.get(key)
+        if isinstance(values, str):
+            values = [values]
+        values = [v for v in (values or ()) if v]
+        if values:
+            where.append(f"c.{key} IN ({', '.join('?' * len(values))})")
+            params += values
+    for column, low, high, parse in (('date_ord', 'date_from', 'date_to', jalali_ordinal),
+                                     ('duration_to_ord', 'end_from', 'end_to', jalali_ordinal),
+                                     ('contract_amount_int', 'amount_min', 'amount_max', _filter_amount)):
+        low, high = _filter_bound(criteria, low, parse), _filter_bound(criteria, high, parse)
+        if low is not None and high is not None:
+            where.append(f'c.{column} BETWEEN ? AND ?')
+            params += [low, high]
+        elif low is not None:
+            where.append(f'c.{column} >= ?')
+            params.append(low)
+        elif high is not None:
+            where.append(f'c.{column} <= ?')
+            params.append(high)
+
+    matches, likes = [], []
+    for key, column in (('text', None), ('party', FTS_PARTIES_COLUMN)):
+        value = normalize_text(criteria.get(key) or '').strip()
+        if not value:
+            continue
+        match = None if archive else _fts_match_expr(value, column)
+        if match:
+            matches.append(f'({match})')
+            continue
+        cols = (column,) if column else INDEX_COLUMNS
+        likes.append('(' + ' OR '.join(f'n.{c} LIKE ?' for c in cols) + ')')
+        params += [f'%{value}%'] * len(cols)
+    where += likes
+
+    schema = 'archive.' if archive else ''
+    source = f'FROM {schema}cases c'
+    if likes:
+        source += f' JOIN {schema}cases_norm n ON n.rowid = c.rowid'
+    if matches:
+        source = 'FROM cases_fts JOIN cases c ON c.rowid = cases_fts.rowid' + source[len('FROM cases c'):]
+        where.insert(0, 'cases_fts MATCH ?')
+        params.insert(0, ' AND '.join(matches))
+    return f"{source} WHERE {' AND '.join(where)}" if where else source, params, bool(matches)
+
+
+def filter_results(criteria, columns=None, include_archive: bool = False, order_by=None, snippets: bool = False):
+    """Return a CaseResults of the cases matching every criterion (see compile_filter).
+
+    Ordered by rank when there is a text or party match, else newest first,
+    unless `order_by` (as for search_results) says otherwise. With
+    `snippets`, records get a `snippet` field around the text and party
+    matches.
+    """
+    source, params, ranked = compile_filter(criteria)
+    order = _order_clause(order_by, RANKED_ORDER if ranked else DATE_ORDER)
+    archive_source, archive_params = compile_filter(criteria, archive=True)[:2] if include_archive else (None, ())
+    ids, hot = _case_ids(f'SELECT c.id {source} {order}', params,
+                         archive_source and f'SELECT c.id {archive_source} {_order_clause(order_by, DATE_ORDER, archive=True)}',
+                         archive_params)
+    return CaseResults(ids, columns, hot, snippets, params[0] if ranked else None)
+
+
+def explain_filter(criteria, order_by=None):
+    """Return the SQL filter_results() runs for `criteria` and SQLite's plan for it.
+
+    The plan is the detail column of EXPLAIN QUERY PLAN, one string per
+    step (e.g. 'SEARCH c USING INDEX idx_cases_type_date (case_type=? AND
+    date_ord>? AND date_ord<?)'), for the hot database.
+    """
+    source, params, ranked = compile_filter(criteria)
+    sql = f'SELECT c.id {source} {_order_clause(order_by, RANKED_ORDER if ranked else DATE_ORDER)}'
+    plan = [r[3] for r in get_connection().execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+    return sql, plan
+
+
+def search_cases(filter_type: str, query: str, snippets: bool = False, columns=None, include_archive: bool = False):
+    """Search cases and return named records.
+
+    `columns` picks the fields of each record (any cases column or one of
+    COMPUTED_COLUMNS); it defaults to DEFAULT_SEARCH_COLUMNS. The query is
+    normalized the same way the search index is (see
+    normalizer.normalize_text), so Arabic/Persian letter variants, digits and
+    zero-width characters do not affect matching. Text searches run a ranked
+    (bm25) query on the full-text index. With `snippets`, records get a
+    `snippet` field: a short excerpt of the normalized text with the match
+    wrapped in [ ] (None for searches that are not ranked).
+    With `include_archive`, archived cases that match are appended after
+    the hot results (see archive_inactive_cases).
+    """
+    source, params, ranked = _search_source(filter_type, query)
+    select, record = _projection(columns, snippets, ranked)
+    cur = get_connection().cursor()
+    cur.execute(f'{select} {source} {RANKED_ORDER if ranked else DATE_ORDER}', params)
+    rows = [record._make(r) for r in cur.fetchall()]
+    if include_archive and os.path.exists(ARCHIVE_DB_PATH):
+        source, params = _archive_source(filter_type, query)
+        select, _ = _projection(columns, snippets, archive=True)
+        cur = _archive_connection().cursor()
+        cur.execute(f'{select} {source} {DATE_ORDER}', params)
+        rows.extend(record._make(r) for r in cur.fetchall())
+    return rows
+
+
+def cases_in_date_range(date_from: str, date_to: str, columns=None, include_archive: bool = False):
+    """Return named records for cases dated between two Jalali dates, newest first.
+
+    With `include_archive`, matching archived cases follow the hot ones.
+    """
+    select, record = _projection(columns)
+    bounds = (jalali_ordinal(date_from), jalali_ordinal(date_to))
+    cur = get_connection().cursor()
+    cur.execute(f'{select} FROM cases c WHERE c.date_ord BETWEEN ? AND ? AND c.deleted_at IS NULL {DATE_ORDER}', bounds)
+    rows = [record._make(r) for r in cur.fetchall()]
+    if include_archive and os.path.exists(ARCHIVE_DB_PATH):
+        select, _ = _projection(columns, archive=True)
+        cur = _archive_connection().cursor()
+        cur.execute(f'{select} FROM archive.cases c WHERE c.date_ord BETWEEN ? AND ? {DATE_ORDER}', bounds)
+        rows.extend(record._make(r) for r in cur.fetchall())
     return rows
 
 
+def search_cases_page(filter_type: str, query: str, after_key=None, limit: int = 200, columns=None):
+    """Return one page of search_cases results as (rows, next_key).
+
+    Uses keyset pagination: pass the returned `next_key` as `after_key` to
+    get the following page; it is None once the last page has been read.
+    Each page is a bounded index seek instead of an OFFSET scan.
+    """
+    source, params, ranked = _search_source(filter_type, query)
+    if ranked:
+        key_cols = 'cases_fts.rank, c.rowid'
+        if after_key is not None:
+            source += ' AND (cases_fts.rank > ? OR (cases_fts.rank = ? AND c.rowid > ?))'
+            params += [after_key[0], after_key[0], after_key[1]]
+    else:
+        key_cols = 'c.date_ord, c.id'
+        if after_key is not None:
+            # date_ord DESC puts NULL dates last; they are ordered by id alone.
+            if after_key[0] is None:
+                source += ' AND c.date_ord IS NULL AND c.id < ?'
+                params += [after_key[1]]
+            else:
+                source += ' AND (c.date_ord < ? OR (c.date_ord = ? AND c.id < ?) OR c.date_ord IS NULL)'
+                params += [after_key[0], after_key[0], after_key[1]]
+    select, record = _projection(columns)
+    cur = get_connection().cursor()
+    cur.execute(f'{select}, {key_cols} {source} {RANKED_ORDER if ranked else DATE_ORDER} LIMIT ?',
+                params + [limit])
+    rows = cur.fetchall()
+    next_key = tuple(rows[-1][-2:]) if len(rows) == limit else None
+    return [record._make(r[:-2]) for r in rows], next_key
+
+
+def iter_search_cases(filter_type: str, query: str, batch_size: int = 500, columns=None):
+    """Yield search_cases results in batches of at most `batch_size` records."""
+    after_key = None
+    while True:
+        rows, after_key = search_cases_page(filter_type, query, after_key, batch_size, columns)
+        if rows:
+            yield rows
+        if after_key is None:
+            return
+
+
+class CaseResults:
+    """An ordered result set whose records are loaded a page at a time.
+
+    Only the matching case ids are read up front. Records for a slice are
+    fetched by primary key when first asked for, and the most recently used
+    pages are kept, so a grid can show any part of a 100k-row result without
+    holding all of it. The first `hot` ids are in cases.db, the rest in
+    archive.db. Supports len(), indexing, slicing and iteration like a list
+    of records; ids of rows deleted since the search come back as None.
+
+    With `snippets`, records get a `snippet` field as in search_cases().
+    It is filled for hot rows when `match` (the MATCH expression of the
+    search) is given, by running that match again for just the page's ids.
+    """
+
+    def __init__(self, ids, columns=None, hot=None, snippets=False, match=None):
+        self.ids = ids
+        self.columns = columns
+        self.hot = len(ids) if hot is None else hot
+        self.snippets = snippets
+        self.match = match if snippets else None
+        self._pages = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self.ids))
+            rows = []
+            for page in range(start // RESULT_PAGE_SIZE, -(-stop // RESULT_PAGE_SIZE)):
+                base = page * RESULT_PAGE_SIZE
+                rows.extend(self._page(page)[max(start - base, 0):stop - base])
+            return rows[::step]
+        if index < 0:
+            index += len(self.ids)
+        if not 0 <= index < len(self.ids):
+            raise IndexError(index)
+        return self._page(index // RESULT_PAGE_SIZE)[index % RESULT_PAGE_SIZE]
+
+    def __iter__(self):
+        for start in range(0, len(self.ids), RESULT_PAGE_SIZE):
+            yield from self._fetch(start, start + RESULT_PAGE_SIZE)
+
+    def iter_rows(self, columns, batch_size=SQL_BATCH_SIZE):
+        """Yield tuples of `columns` (plain cases columns) for every row, in result order.
+
+        Reads straight from the cursor a batch of ids at a time and bypasses
+        the page cache, so exporting a large result holds one batch at most.
+        """
+        select = 'SELECT ' + ', '.join(f'c.{c}' for c in columns)
+        for start in range(0, len(self.ids), batch_size):
+            found = {r[-1]: r[:-1] for r in self._select(lambda archive: select, start, start + batch_size)}
+            for case_id in self.ids[start:start + batch_size]:
+                if case_id in found:
+                    yield found[case_id]
+
+    def _page(self, page):
+        rows = self._pages.get(page)
+        if rows is None:
+            rows = self._fetch(page * RESULT_PAGE_SIZE, (page + 1) * RESULT_PAGE_SIZE)
+            self._pages[page] = rows
+            if len(self._pages) > RESULT_CACHE_PAGES:
+                self._pages.popitem(last=False)
+        else:
+            self._pages.move_to_end(page)
+        return rows
+
+    def _fetch(self, start, stop):
+        record = _projection(self.columns, self.snippets)[1]
+
+        def select(archive):
+            ranked = self.match is not None and not archive
+            return _projection(self.columns, self.snippets, ranked, archive)[0]
+
+        found = {r[-1]: record._make(r[:-1]) for r in self._select(select, start, stop, self.match)}
+        return [found.get(case_id) for case_id in self.ids[start:stop]]
+
+    def _select(self, select, start, stop, match=None):
+        """Yield rows of `select(archive)` plus a trailing id for ids[start:stop], from whichever database holds them.
+
+        With `match`, hot rows are read through the full-text index with
+        that MATCH expression, so `select` can use snippet().
+        """
+        for lo, hi, archive in ((start, min(stop, self.hot), False), (max(start, self.hot), stop, True)):
+            ids = self.ids[lo:hi]
+            if not ids:
+                continue
+            where = f"c.id IN ({', '.join('?' * len(ids))})"
+            if archive:
+                yield from _archive_connection().execute(f'{select(True)}, c.id FROM archive.cases c WHERE {where}', ids)
+            elif match is not None:
+                yield from get_connection().execute(
+                    f'{select(False)}, c.id FROM cases_fts JOIN cases c ON c.rowid = cases_fts.rowid '
+                    f'WHERE cases_fts MATCH ? AND {where}', [match, *ids])
+            else:
+                yield from get_connection().execute(f'{select(False)}, c.id FROM cases c WHERE {where}', ids)
+
+
+def _order_clause(order_by, default, archive=False):
+    """Return the ORDER BY for `order_by`, a (SORT_KEYS column, descending) pair, or `default`.
+
+    With `archive`, the order is for a query over archive.db.
+    """
+    if not order_by:
+        return default
+    column, descending = order_by
+    if column not in SORT_KEYS:
+        raise ValueError(f'Unknown sort column: {column}')
+    direction = 'DESC' if descending else 'ASC'
+    # c.id makes the order total, so equal keys keep a stable order.
+    return f'ORDER BY {_schema_expr(SORT_KEYS[column], archive)} {direction}, c.id {direction}'
+
+
+def case_table_columns():
+    """Return the column names of the cases table, in table order."""
+    return [r[1] for r in get_connection().execute('PRAGMA main.table_info(cases)')]
+
+
+def _case_ids(sql, params, archive_sql=None, archive_params=()):
+    ids = [r[0] for r in get_connection().execute(sql, params)]
+    hot = len(ids)
+    if archive_sql and os.path.exists(ARCHIVE_DB_PATH):
+        ids.extend(r[0] for r in _archive_connection().execute(archive_sql, archive_params))
+    return ids, hot
+
+
+def search_results(filter_type: str, query: str, columns=None, include_archive: bool = False, order_by=None,
+                   snippets: bool = False):
+    """Like search_cases(), but return a CaseResults that loads records as they are read.
+
+    `order_by` is a (column, descending) pair naming one of SORT_KEYS; the
+    default is search_cases() order. Archived matches are sorted among
+    themselves and still follow the hot ones. `snippets` is as for
+    search_cases().
+    """
+    source, params, ranked = _search_source(filter_type, query)
+    archive_source, archive_params = _archive_source(filter_type, query) if include_archive else (None, ())
+    order = _order_clause(order_by, RANKED_ORDER if ranked else DATE_ORDER)
+    ids, hot = _case_ids(f'SELECT c.id {source} {order}', params,
+                         archive_source and f'SELECT c.id {archive_source} {_order_clause(order_by, DATE_ORDER, archive=True)}',
+                         archive_params)
+    return CaseResults(ids, columns, hot, snippets, params[0] if ranked else None)
+
+
+def date_range_results(date_from: str, date_to: str, columns=None, include_archive: bool = False, order_by=None):
+    """Like cases_in_date_range(), but return a CaseResults that loads records as they are read.
+
+    `order_by` is as for search_results().
+    """
+    bounds = (jalali_ordinal(date_from), jalali_ordinal(date_to))
+    order = _order_clause(order_by, DATE_ORDER)
+    ids, hot = _case_ids(f'SELECT c.id FROM cases c WHERE c.date_ord BETWEEN ? AND ? AND c.deleted_at IS NULL {order}',
+                         bounds,
+                         include_archive and f'SELECT c.id FROM archive.cases c WHERE c.date_ord BETWEEN ? AND ? '
+                                             f'{_order_clause(order_by, DATE_ORDER, archive=True)}',
+                         bounds)
+    return CaseResults(ids, columns, hot)
+
+
+class QueryWorker:
+    """Run queries on a background thread where only the newest one counts.
+
+    submit() replaces any job that has not started and interrupts the one
+    that is running (sqlite3 Connection.interrupt() on the worker's own
+    connection), so a burst of keystrokes never queues up stale searches.
+    The UI thread polls poll() from after(); results of superseded jobs are
+    dropped and never returned.
+    """
+
+    def __init__(self, name='query-worker'):
+        self._cond = threading.Condition()
+        self._job = None
+        self._generation = 0
+        self._running = None
+        self._result = None
+        self._conn = None
+        self._stopped = False
+        threading.Thread(target=self._run, name=name, daemon=True).start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the worker, superseding earlier jobs."""
+        with self._cond:
+            self._generation += 1
+            self._job = (self._generation, fn, args, kwargs)
+            self._result = None
+            if self._running is not None and self._conn is not None:
+                self._conn.interrupt()
+            self._cond.notify()
+
+    def poll(self):
+        """Return (value, error) of the latest job once it has finished, else None."""
+        with self._cond:
+            result, self._result = self._result, None
+            return result
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._job = None
+            if self._running is not None and self._conn is not None:
+                self._conn.interrupt()
+            self._cond.notify()
+
+    def _run(self):
+        self._conn = get_connection()
+        while True:
+            with self._cond:
+                while self._job is None and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    break
+                generation, fn, args, kwargs = self._job
+                self._job = None
+                self._running = generation
+            try:
+                result = (fn(*args, **kwargs), None)
+            except Exception as e:
+                # An interrupted query raises here; its generation is stale.
+                result = (None, e)
+            with self._cond:
+                self._running = None
+                if generation == self._generation and not self._stopped:
+                    self._result = result
+        close_connection()
+
+
 def backup_db():
-    ensure_dirs()
-    if not os.path.exists(DB_PATH):
-        return
-    ts = jdatetime.datetime.now().strftime('%Y%m%d%H%M%S')
-    dst = os.path.join(BACKUP_DIR, f'cases_{ts}.db')
-    try:
-        shutil.copy2(DB_PATH, dst)
-    except Exception:
-        pass
+    """Schedule a backup; bursts of writes are coalesced into one snapshot."""
+    _backup_scheduler.request()
+
+
+def backup_now():
+    """Take a snapshot immediately, even if nothing changed since the last one."""
+    return _backup_scheduler.snapshot(force=True)
 
 
 # Initialize DB on import
 init_db()
+_blob_store = BlobStore(BLOBS_DIR)
+_backup_scheduler = BackupScheduler(DB_PATH, BACKUP_DIR)
+_backup_scheduler.start()
+atexit.register(_backup_scheduler.stop)
+threading.Thread(target=_run_trash_purger, name='trash-purger', daemon=True).start()
+threading.Thread(target=_run_document_indexer, name='document-indexer', daemon=True).start()
+atexit.register(_workers_stop.set)
+atexit.register(_index_wake.set)
@@ -0,0 +1,97 @@
+import os
+import zlib
+import codecs
+import zipfile
+import xml.etree.ElementTree as ET
+
+
+# Extraction stops after this many characters of one document; the rest of
+# a very long file adds little to search and a lot to the index.
+MAX_CHARS = 200000
+
+_W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_S_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+def _read_txt(path):
+    limit = MAX_CHARS * 4
+    with open(path, 'rb') as f:
+        raw = f.read(limit)
+    # The cut at `limit` can fall inside a multi-byte character; an
+    # incremental decoder holds that partial character back instead of
+    # failing on it, unless the whole file was read.
+    try:
+        return codecs.getincrementaldecoder('utf-8-sig')().decode(raw, final=len(raw) < limit)
+    except UnicodeDecodeError:
+        pass
+    # Older Persian text files are usually Windows-1256.
+    try:
+        return raw.decode('cp1256')
+    except UnicodeDecodeError:
+        return raw.decode('utf-8', errors='replace')
+
+
+def _xml_text(zf, member, text_tag, break_tag):
+    """Stream the text of `text_tag` elements out of one XML member of a zip file."""
+    parts = []
+    length = 0
+    with zf.open(member) as f:
+        for event, elem in ET.iterparse(f, events=('end',)):
+            if elem.tag == text_tag and elem.text:
+                parts.append(elem.text)
+                length += len(elem.text)
+            elif elem.tag == break_tag:
+                parts.append('\n')
+                elem.clear()
+            if length >= MAX_CHARS:
+                break
+    return ''.join(parts)
+
+
+def _read_docx(path):
+    with zipfile.ZipFile(path) as zf:
+        return _xml_text(zf, 'word/document.xml', _W_NS + 't', _W_NS + 'p')
+
+
+def _read_xlsx(path):
+    with zipfile.ZipFile(path) as zf:
+        names = zf.namelist()
+        parts = []
+        # openpyxl and Excel keep cell strings in the shared string table;
+        # inline strings (t="inlineStr") live in the sheets themselves.
+        if 'xl/sharedStrings.xml' in names:
+            parts.append(_xml_text(zf, 'xl/sharedStrings.xml', _S_NS + 't', _S_NS + 'si'))
+        for name in names:
+            if name.startswith('xl/worksheets/') and name.endswith('.xml'):
+                parts.append(_xml_text(zf, name, _S_NS + 't', _S_NS + 'row'))
+        return '\n'.join(p for p in parts if p.strip())
+
+
+EXTRACTORS = {
+    '.txt': _read_txt,
+    '.csv': _read_txt,
+    '.docx': _read_docx,
+    '.xlsx': _read_xlsx,
+}
+
+
+def is_supported(name):
+    return os.path.splitext(name)[1].lower() in EXTRACTORS
+
+
+# What a damaged or unexpected file can raise while it is read: a bad zip
+# container, a corrupt deflate stream (zlib.error), a truncated member
+# (EOFError), broken XML, or an encrypted member (RuntimeError).
+READ_ERRORS = (OSError, EOFError, KeyError, ValueError, RuntimeError, zlib.error,
+               zipfile.BadZipFile, ET.ParseError)
+
+
+def extract_text(path):
+    """Return the plain text of a document, or None if its type is not supported or it cannot be read."""
+    reader = EXTRACTORS.get(os.path.splitext(path)[1].lower())
+    if reader is None:
+        return None
+    try:
+        return reader(path)[:MAX_CHARS]
+    except READ_ERRORS:
+        return None
@@ -0,0 +1,18 @@
+"""Move existing case folders into the year/month layout of files/uploads.
+
+Run once with the application closed:
+
+    python migrate_uploads.py
+"""
+from database import shard_upload_folders, backup_now
+
+
+def main():
+    moved = shard_upload_folders()
+    if moved:
+        backup_now()
+    print(f'{moved} case folder(s) moved to the year/month layout.')
+
+
+if __name__ == '__main__':
+    main()
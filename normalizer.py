@@ -0,0 +1,28 @@
+import re
+
+
+# One translate() table covering the spelling variants users mix when typing
+# Persian: Arabic yeh/kaf, heh with yeh, Persian and Arabic-Indic digits,
+# and characters that should simply vanish (diacritics, tatweel, zero-width
+# joiners/non-joiners and direction marks).
+_TRANSLATION = {
+    ord('ي'): 'ی', ord('ى'): 'ی', ord('ئ'): 'ی',
+    ord('ك'): 'ک',
+    ord('ۀ'): 'ه', ord('ة'): 'ه',
+    ord('أ'): 'ا', ord('إ'): 'ا', ord('ٱ'): 'ا',
+    ord('ؤ'): 'و',
+}
+_TRANSLATION.update({ord(p): str(i) for i, p in enumerate('۰۱۲۳۴۵۶۷۸۹')})
+_TRANSLATION.update({ord(a): str(i) for i, a in enumerate('٠١٢٣٤٥٦٧٨٩')})
+_TRANSLATION.update({c: None for c in range(0x064B, 0x0660)})  # harakat
+_TRANSLATION.update({c: None for c in (0x0670, 0x0640, 0x200B, 0x200C, 0x200D, 0x200E, 0x200F, 0xFEFF)})
+
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    """Return `text` in the canonical form used for indexing and searching."""
+    if text is None:
+        return ''
+    text = str(text).translate(_TRANSLATION).casefold()
+    return _SPACES.sub(' ', text).strip()
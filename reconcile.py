@@ -0,0 +1,363 @@
+"""Cross-check files/uploads against the database and report (or repair) differences.
+
+    python reconcile.py            # report only
+    python reconcile.py --clean    # also repair what can be repaired
+
+Work is done in short slices and checkpointed to files/reconcile.json, so
+an interrupted run resumes where it stopped. Findings are appended to
+files/reconcile_findings.jsonl as they are made, and the digests of copied
+attachments are cached in files/reconcile_digests.json.
+"""
+import os
+import sys
+import json
+import time
+
+from attachments import hash_file
+from database import (UPLOADS_DIR, TRASH_DIR, FILES_DIR, BLOB_GC_GRACE_SECONDS, ORPHAN_PREFIX, get_connection,
+                      get_attachments, link_attachments, adopt_attachments, blob_path)
+
+
+CHECKPOINT_PATH = os.path.join(FILES_DIR, 'reconcile.json')
+FINDINGS_PATH = os.path.join(FILES_DIR, 'reconcile_findings.jsonl')
+DIGESTS_PATH = os.path.join(FILES_DIR, 'reconcile_digests.json')
+SLICE_SECONDS = 1.0
+CASE_BATCH = 200
+FINDINGS = ('orphan_folder', 'unrecorded', 'missing_file', 'modified', 'missing_folder', 'missing_blob')
+# Files the OS drops into folders by itself.
+IGNORED_NAMES = {'Thumbs.db', 'desktop.ini'}
+
+
+def _is_number(name, digits):
+    return len(name) == digits and name.isascii() and name.isdigit()
+
+
+def _subdirs(path):
+    return sorted((e for e in os.scandir(path) if e.is_dir()), key=lambda e: e.name)
+
+
+def iter_case_folders(root, after=None):
+    """Yield (key, path) for every case folder under `root`, in key order.
+
+    Handles both the year/month layout and old flat folders. Keys are
+    tuples of path components; with `after`, folders up to and including
+    that key are skipped without listing the years and months before it.
+    """
+    if not os.path.isdir(root):
+        return
+    for top in _subdirs(root):
+        if after and top.name < after[0]:
+            continue
+        if not _is_number(top.name, 4):
+            key = (top.name,)
+            if not after or key > after:
+                yield key, top.path
+            continue
+        for month in _subdirs(top.path):
+            if after and top.name == after[0] and len(after) > 1 and month.name < after[1]:
+                continue
+            for case in _subdirs(month.path):
+                key = (top.name, month.name, case.name)
+                if not after or key > after:
+                    yield key, case.path
+
+
+class Reconciler:
+    """Incremental consistency check of upload folders against the database.
+
+    run() does a bounded amount of work and saves its position to a
+    checkpoint file; findings are appended to a separate file, so a slice
+    writes only what it found. A pass first walks the upload folders, then
+    the case rows:
+
+    - orphan_folder: a folder under uploads that no case points to
+    - unrecorded: a file in a case folder with no attachments row
+    - missing_file: an attachments row whose file is not in the folder
+    - modified: a file whose content differs from its attachments row (a
+      file that is a hard link to its blob is the blob; any other copy is
+      compared by size, then by sha256, which is cached by path, size and
+      mtime so an unchanged copy is hashed once)
+    - missing_folder: a case whose folder_path does not exist
+    - missing_blob: an attachment whose stored content is gone
+
+    A folder of copies that takes longer than a slice to hash is picked up
+    again by the next slice, where the digests already computed are cached.
+
+    With clean=True, orphan folders are moved into TRASH_DIR, where
+    purge_trash() deletes them after the trash retention; unrecorded files
+    are adopted into the blob store, missing files and folders are relinked
+    from their blobs, and missing blobs are stored again from the case
+    folder. Folders changed within the last BLOB_GC_GRACE_SECONDS are
+    skipped, as a case may be being saved into them.
+    """
+
+    def __init__(self, clean=False, checkpoint_path=CHECKPOINT_PATH, findings_path=FINDINGS_PATH,
+                 digests_path=DIGESTS_PATH):
+        self.clean = clean
+        self.checkpoint_path = checkpoint_path
+        self.findings_path = findings_path
+        self.digests_path = digests_path
+        self._out = None
+        # Path -> [size, mtime_ns, sha256] of files that are not links to their blob.
+        self._digests = self._load_digests()
+        self._digests_changed = False
+        # Case folder -> case id, read once per pass.
+        self._known = None
+        self.state = self._load()
+
+    def _fresh(self):
+        self._close()
+        self._known = None
+        with open(self.findings_path, 'wb'):
+            pass
+        return {'phase': 'folders', 'after': None, 'started': time.time(), 'findings_size': 0}
+
+    def _load(self):
+        try:
+            with open(self.checkpoint_path, encoding='utf-8') as f:
+                state = json.load(f)
+            # Findings appended after the last checkpoint are dropped; the
+            # resumed scan comes across them again.
+            with open(self.findings_path, 'ab') as f:
+                f.truncate(state['findings_size'])
+            return state
+        except (OSError, ValueError, KeyError):
+            return self._fresh()
+
+    def _load_digests(self):
+        try:
+            with open(self.digests_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        if self._digests_changed:
+            tmp = self.digests_path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self._digests, f, ensure_ascii=False)
+            os.replace(tmp, self.digests_path)
+            self._digests_changed = False
+        if self._out is not None:
+            self._out.flush()
+            self.state['findings_size'] = self._out.tell()
+        tmp = self.checkpoint_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp, self.checkpoint_path)
+
+    def _close(self):
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+
+    @property
+    def findings(self):
+        """Return the findings of the current pass as {kind: [{'case_id', 'path', 'fixed'}, ...]}."""
+        found = {kind: [] for kind in FINDINGS}
+        if self._out is not None:
+            self._out.flush()
+        try:
+            with open(self.findings_path, encoding='utf-8') as f:
+                for line in f:
+                    item = json.loads(line)
+                    found[item.pop('kind')].append(item)
+        except OSError:
+            pass
+        return found
+
+    @property
+    def finished(self):
+        return self.state['phase'] == 'done'
+
+    def _report(self, kind, case_id, path, fixed=False):
+        if self._out is None:
+            self._out = open(self.findings_path, 'ab')
+        item = {'kind': kind, 'case_id': case_id, 'path': path, 'fixed': fixed}
+        self._out.write(json.dumps(item, ensure_ascii=False).encode('utf-8') + b'\n')
+
+    def run(self, time_budget=SLICE_SECONDS):
+        """Work for about `time_budget` seconds; returns True once the pass is complete.
+
+        Calling run() again after a completed pass starts a new one.
+        """
+        if self.finished:
+            self.state = self._fresh()
+        deadline = time.monotonic() + time_budget
+        resumed = self.state['phase']
+        if self.state['phase'] == 'folders' and self._scan_folders(deadline):
+            self.state.update(phase='cases', after=0)
+        if (self.state['phase'] == 'cases' and (resumed == 'cases' or time.monotonic() < deadline)
+                and self._scan_cases(deadline)):
+            self.state.update(phase='done', after=None)
+            self._forget_deleted()
+        self._save()
+        if self.finished:
+            self._close()
+            self._known = None
+        return self.finished
+
+    def _folder_case(self, key, path):
+        """Return the id of the case whose folder is `path`, or None."""
+        if self._known is None:
+            cur = get_connection().cursor()
+            cur.execute('SELECT id, folder_path FROM cases WHERE folder_path IS NOT NULL')
+            self._known = {os.path.normcase(os.path.abspath(folder)): case_id for case_id, folder in cur.fetchall()}
+        norm = os.path.normcase(os.path.abspath(path))
+        case_id = self._known.get(norm)
+        if case_id is None:
+            # The map is from the start of the pass; look the folder's case
+            # up again before calling it an orphan.
+            row = get_connection().execute('SELECT id, folder_path FROM cases WHERE id = ?', (key[-1],)).fetchone()
+            if row and row[1] and os.path.normcase(os.path.abspath(row[1])) == norm:
+                case_id = self._known[norm] = row[0]
+        return case_id
+
+    def _scan_folders(self, deadline):
+        after = tuple(self.state['after']) if self.state['after'] else None
+        for key, path in iter_case_folders(UPLOADS_DIR, after):
+            if time.time() - os.path.getmtime(path) >= BLOB_GC_GRACE_SECONDS:
+                case_id = self._folder_case(key, path)
+                if case_id is None:
+                    self._orphan_folder(key, path)
+                elif not self._check_folder(case_id, path, deadline):
+                    return False
+            self.state['after'] = list(key)
+            # Checked after the folder, so every slice makes progress.
+            if time.monotonic() >= deadline:
+                return False
+        return True
+
+    def _orphan_folder(self, key, path):
+        fixed = False
+        if self.clean:
+            os.makedirs(TRASH_DIR, exist_ok=True)
+            os.rename(path, os.path.join(TRASH_DIR, f"{ORPHAN_PREFIX}{'_'.join(key)}_{int(time.time())}"))
+            fixed = True
+        self._report('orphan_folder', None, path, fixed)
+
+    def _check_folder(self, case_id, folder, deadline):
+        """Check one case folder; returns False, having reported nothing, if `deadline` passed first.
+
+        Copies are hashed before anything is reported. When that runs out
+        of time the digests so far stay cached, so the slice that checks the
+        folder again gets further.
+        """
+        recorded = {a['name']: a for a in get_attachments(case_id)}
+        present = {}
+        for entry in os.scandir(folder):
+            if entry.is_file() and not entry.name.startswith('.') and entry.name not in IGNORED_NAMES:
+                present[entry.name] = entry.stat()
+
+        changed = set()
+        hashed = False
+        for name, a in recorded.items():
+            st = present.get(name)
+            if st is None:
+                continue
+            path = os.path.join(folder, name)
+            if a['size'] is not None and st.st_size != a['size']:
+                changed.add(name)
+            elif not self._is_blob(path, a['sha256']):
+                digest = self._cached_digest(path, st)
+                if digest is None:
+                    # At least one file per slice, so the folder gets done.
+                    if hashed and time.monotonic() >= deadline:
+                        return False
+                    digest = self._hash(path, st)
+                    hashed = True
+                if digest != a['sha256']:
+                    changed.add(name)
+
+        unrecorded = [name for name in sorted(present) if name not in recorded and name != f'{case_id}.xlsx']
+        if unrecorded:
+            if self.clean:
+                adopt_attachments(case_id, folder, unrecorded)
+            for name in unrecorded:
+                self._report('unrecorded', case_id, os.path.join(folder, name), self.clean)
+
+        for name, a in recorded.items():
+            path = os.path.join(folder, name)
+            if name not in present:
+                fixed = False
+                if self.clean and os.path.exists(blob_path(a['sha256'])):
+                    link_attachments(folder, [a])
+                    fixed = True
+                self._report('missing_file', case_id, path, fixed)
+            elif name in changed:
+                self._report('modified', case_id, path)
+        return True
+
+    def _is_blob(self, path, digest):
+        """Return True if `path` is a hard link to the blob stored as `digest`, i.e. the (read-only) blob itself."""
+        try:
+            st, blob = os.stat(path), os.stat(blob_path(digest))
+        except FileNotFoundError:
+            return False
+        return (st.st_ino, st.st_dev) == (blob.st_ino, blob.st_dev)
+
+    def _cached_digest(self, path, st):
+        """Return the sha256 last computed for `path`, or None if it has changed size or mtime since."""
+        cached = self._digests.get(path)
+        return cached[2] if cached and cached[:2] == [st.st_size, st.st_mtime_ns] else None
+
+    def _hash(self, path, st):
+        digest = hash_file(path)[0]
+        self._digests[path] = [st.st_size, st.st_mtime_ns, digest]
+        self._digests_changed = True
+        return digest
+
+    def _forget_deleted(self):
+        gone = [path for path in self._digests if not os.path.exists(path)]
+        for path in gone:
+            del self._digests[path]
+        self._digests_changed = self._digests_changed or bool(gone)
+
+    def _scan_cases(self, deadline):
+        cur = get_connection().cursor()
+        while True:
+            cur.execute('SELECT rowid, id, folder_path FROM cases WHERE rowid > ? AND deleted_at IS NULL ORDER BY rowid LIMIT ?',
+                        (self.state['after'], CASE_BATCH))
+            rows = cur.fetchall()
+            if not rows:
+                return True
+            for rowid, case_id, folder in rows:
+                self._check_case(case_id, folder)
+                self.state['after'] = rowid
+                if time.monotonic() >= deadline:
+                    return False
+
+    def _check_case(self, case_id, folder):
+        attachments = get_attachments(case_id)
+        if not folder or not os.path.isdir(folder):
+            fixed = False
+            if self.clean and folder and attachments and all(os.path.exists(blob_path(a['sha256'])) for a in attachments):
+                link_attachments(folder, attachments)
+                fixed = True
+            self._report('missing_folder', case_id, folder, fixed)
+            return
+        for a in attachments:
+            if os.path.exists(blob_path(a['sha256'])):
+                continue
+            path = os.path.join(folder, a['name'])
+            fixed = False
+            if self.clean and os.path.isfile(path):
+                adopt_attachments(case_id, folder, [a['name']])
+                fixed = True
+            self._report('missing_blob', case_id, path, fixed)
+
+
+def main():
+    reconciler = Reconciler(clean='--clean' in sys.argv[1:])
+    while not reconciler.run():
+        pass
+    for kind in FINDINGS:
+        items = reconciler.findings[kind]
+        fixed = sum(1 for item in items if item['fixed'])
+        print(f'{kind}: {len(items)}' + (f' ({fixed} fixed)' if fixed else ''))
+        for item in items[:20]:
+            print(f"  {item['path']}")
+
+
+if __name__ == '__main__':
+    main()
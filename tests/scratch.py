@@ -0,0 +1,48 @@
+"""Import database.py from a copy in a temporary folder.
+
+database.py keeps its data next to itself and opens it on import, so the
+modules are copied into a scratch directory and imported from there; the
+real files/ folder is never touched.
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ('database.py', 'attachments.py', 'backup.py', 'extractor.py', 'normalizer.py', 'reconcile.py')
+
+
+def load():
+    """Copy the modules into a new temporary folder and import database from there.
+
+    Returns (folder, database module).
+    """
+    workdir = tempfile.mkdtemp()
+    for name in MODULES:
+        shutil.copy(os.path.join(ROOT, name), workdir)
+        sys.modules.pop(name[:-3], None)
+    sys.path.insert(0, workdir)
+    import database
+    return workdir, database
+
+
+def unload(workdir, db):
+    """Stop the module's background threads and remove the folder load() made."""
+    db._workers_stop.set()
+    db._index_wake.set()
+    db._backup_scheduler.stop()
+    db.close_connection()
+    sys.path.remove(workdir)
+    for name in MODULES:
+        sys.modules.pop(name[:-3], None)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def store(db, path):
+    """Ingest one file into the blob store and return its attachment records."""
+    job = db.ingest_attachments([path])
+    while not job.done():
+        time.sleep(0.01)
+    return job.records()
@@ -0,0 +1,132 @@
+"""Archive round trips, run against a scratch copy of database.py (see scratch.py)."""
+import os
+import tarfile
+import unittest
+
+import scratch
+
+workdir = None
+db = None
+
+
+def setUpModule():
+    global workdir, db
+    workdir, db = scratch.load()
+
+
+def tearDownModule():
+    scratch.unload(workdir, db)
+
+
+def _store(path):
+    return scratch.store(db, path)
+
+
+def _archived(case_id):
+    conn = db._archive_connection()
+    return conn.execute('SELECT 1 FROM archive.cases WHERE id = ?', (case_id,)).fetchone() is not None
+
+
+class ArchiveTest(unittest.TestCase):
+
+    def test_unarchive_after_blob_collection(self):
+        case_id = '140001011200000'
+        src = os.path.join(workdir, 'contract.txt')
+        with open(src, 'w', encoding='utf-8') as f:
+            f.write('قرارداد اجاره')
+        records = _store(src)
+        folder = db.case_folder(case_id)
+        db.link_attachments(folder, records)
+        db.add_case({'id': case_id, 'title': 'اجاره', 'date': '1400-01-01', 'status': db.ARCHIVE_STATUS,
+                     'folder_path': folder}, records)
+
+        db.archive_inactive_cases(older_than_days=30)
+        self.assertTrue(_archived(case_id))
+        self.assertFalse(os.path.exists(folder))
+        # No grace period: only the archived reference keeps the blob.
+        db.collect_blobs(grace=-60)
+        self.assertTrue(os.path.exists(db.blob_path(records[0]['sha256'])))
+
+        self.assertEqual(db.unarchive_cases([case_id]), 1)
+        self.assertFalse(_archived(case_id))
+        self.assertEqual(db.get_case_by_id(case_id)['id'], case_id)
+        for a in db.get_attachments(case_id):
+            with open(db.blob_path(a['sha256']), encoding='utf-8') as f:
+                self.assertEqual(f.read(), 'قرارداد اجاره')
+            with open(os.path.join(db.case_folder(case_id), a['name']), encoding='utf-8') as f:
+                self.assertEqual(f.read(), 'قرارداد اجاره')
+
+    def test_archived_rows_count_their_attachments(self):
+        case_id = '140002011200000'
+        src = os.path.join(workdir, 'scan.txt')
+        with open(src, 'w', encoding='utf-8') as f:
+            f.write('اسکن شناسنامه')
+        records = _store(src)
+        folder = db.case_folder(case_id)
+        db.link_attachments(folder, records)
+        db.add_case({'id': case_id, 'title': 'شناسنامه', 'date': '1400-02-01', 'status': db.ARCHIVE_STATUS,
+                     'folder_path': folder}, records)
+        db.archive_inactive_cases(older_than_days=30)
+
+        results = db.search_results('title', 'شناسنامه', columns=('id', 'attachment_count'), include_archive=True,
+                                    order_by=('attachments', True))
+        self.assertEqual([(r.id, r.attachment_count) for r in results], [(case_id, 1)])
+        db.unarchive_cases([case_id])
+
+    def test_interrupted_unarchive_is_settled(self):
+        case_id = '140003011200000'
+        db.add_case({'id': case_id, 'title': 'نیمه‌کاره', 'date': '1400-03-01', 'status': db.ARCHIVE_STATUS})
+        db.archive_inactive_cases(older_than_days=30)
+        # The first of unarchive's two transactions committed, the second never ran.
+        cols = ', '.join(db.case_table_columns())
+        with db.transaction() as conn:
+            conn.execute(f'INSERT INTO main.cases ({cols}) SELECT {cols} FROM archive.cases WHERE id = ?', (case_id,))
+
+        self.assertEqual(db.unarchive_cases([case_id]), 0)
+        self.assertFalse(_archived(case_id))
+        self.assertEqual(db.get_case_by_id(case_id)['id'], case_id)
+
+    def test_unarchive_without_tar_filters_keeps_hard_links(self):
+        case_id = '140004011200000'
+        src = os.path.join(workdir, 'copy.txt')
+        with open(src, 'w', encoding='utf-8') as f:
+            f.write('رونوشت')
+        record = _store(src)[0]
+        # Two names for one blob: tar.add() stores the second as a hard link.
+        records = [record, dict(record, name='copy2.txt')]
+        folder = db.case_folder(case_id)
+        db.link_attachments(folder, records)
+        db.add_case({'id': case_id, 'title': 'رونوشت', 'date': '1400-04-01', 'status': db.ARCHIVE_STATUS,
+                     'folder_path': folder}, records)
+        db.archive_inactive_cases(older_than_days=30)
+        with tarfile.open(os.path.join(db.ARCHIVE_DIR, f'{case_id}.tar.xz')) as tar:
+            self.assertTrue(any(m.islnk() for m in tar.getmembers()))
+
+        data_filter = tarfile.data_filter
+        del tarfile.data_filter
+        try:
+            self.assertEqual(db.unarchive_cases([case_id]), 1)
+        finally:
+            tarfile.data_filter = data_filter
+        for name in ('copy.txt', 'copy2.txt'):
+            with open(os.path.join(folder, name), encoding='utf-8') as f:
+                self.assertEqual(f.read(), 'رونوشت')
+
+    def test_unarchive_without_tar_filters_rejects_links_out_of_the_case(self):
+        packed = os.path.join(workdir, 'escape.tar.xz')
+        with tarfile.open(packed, 'w:xz') as tar:
+            link = tarfile.TarInfo('140005011200000/passwd')
+            link.type = tarfile.LNKTYPE
+            link.linkname = '../etc/passwd'
+            tar.addfile(link)
+        data_filter = tarfile.data_filter
+        del tarfile.data_filter
+        try:
+            with self.assertRaises(tarfile.TarError):
+                db._unpack_folder(packed, '140005011200000', os.path.join(workdir, 'unpack'))
+        finally:
+            tarfile.data_filter = data_filter
+
+
+if __name__ == '__main__':
+    unittest.main()
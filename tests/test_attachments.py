@@ -0,0 +1,107 @@
+"""Blob store behaviour, run against a scratch copy of the modules (see scratch.py)."""
+import os
+import stat
+import unittest
+from unittest import mock
+
+import scratch
+
+workdir = None
+db = None
+attachments = None
+
+
+def setUpModule():
+    global workdir, db, attachments
+    workdir, db = scratch.load()
+    import attachments
+
+
+def tearDownModule():
+    scratch.unload(workdir, db)
+
+
+def _write(name, text):
+    path = os.path.join(workdir, name)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return path
+
+
+def _writable(path):
+    return bool(os.stat(path).st_mode & stat.S_IWRITE)
+
+
+def _windows_unlink(unlink):
+    """os.unlink as on Windows, where a read-only file cannot be deleted."""
+    def fake(path, *, dir_fd=None):
+        if not os.stat(path, dir_fd=dir_fd, follow_symlinks=False).st_mode & stat.S_IWRITE:
+            raise PermissionError(13, 'Access is denied', path)
+        unlink(path, dir_fd=dir_fd)
+    return fake
+
+
+class BlobStoreTest(unittest.TestCase):
+
+    def test_identical_files_are_stored_once_and_read_only(self):
+        first = scratch.store(db, _write('a.txt', 'وکالت‌نامه'))[0]
+        second = scratch.store(db, _write('b.txt', 'وکالت‌نامه'))[0]
+        self.assertEqual(first['sha256'], second['sha256'])
+        blob = db.blob_path(first['sha256'])
+        self.assertFalse(_writable(blob))
+        leftovers = [n for _, _, names in os.walk(os.path.dirname(os.path.dirname(os.path.dirname(blob))))
+                     for n in names if n.endswith('.part')]
+        self.assertEqual(leftovers, [])
+
+    def test_removing_a_case_folder_on_windows_keeps_its_blobs_read_only(self):
+        record = scratch.store(db, _write('c.txt', 'صورتجلسه'))[0]
+        blob = db.blob_path(record['sha256'])
+        folder = os.path.join(workdir, 'case')
+        db.link_attachments(folder, [record])
+        with mock.patch('os.unlink', _windows_unlink(os.unlink)):
+            attachments.remove_tree(folder, [blob])
+        self.assertFalse(os.path.exists(folder))
+        self.assertTrue(os.path.exists(blob))
+        self.assertFalse(_writable(blob))
+
+    def test_relinking_on_windows_keeps_the_old_blob_read_only(self):
+        old = scratch.store(db, _write('d.txt', 'نسخه اول'))[0]
+        new = scratch.store(db, _write('e.txt', 'نسخه دوم'))[0]
+        folder = os.path.join(workdir, 'relink')
+        db.link_attachments(folder, [old])
+        with mock.patch('os.unlink', _windows_unlink(os.unlink)):
+            db.link_attachments(folder, [dict(new, name=old['name'])])
+        self.assertFalse(_writable(db.blob_path(old['sha256'])))
+        with open(os.path.join(folder, old['name']), encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'نسخه دوم')
+
+
+class FailedSaveTest(unittest.TestCase):
+
+    def test_unlink_attachments_restores_the_folder(self):
+        kept = scratch.store(db, _write('f.txt', 'قرارداد'))[0]
+        replaced = scratch.store(db, _write('g.txt', 'متمم قدیم'))[0]
+        folder = os.path.join(workdir, 'edit')
+        db.link_attachments(folder, [kept, replaced])
+        before = [kept, replaced]
+
+        added = scratch.store(db, _write('h.txt', 'پیوست تازه'))[0]
+        changed = dict(scratch.store(db, _write('i.txt', 'متمم جدید'))[0], name=replaced['name'])
+        db.link_attachments(folder, [added, changed])
+        db.unlink_attachments(folder, [added, changed], before)
+
+        self.assertEqual(sorted(os.listdir(folder)), sorted([kept['name'], replaced['name']]))
+        with open(os.path.join(folder, replaced['name']), encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'متمم قدیم')
+
+    def test_remove_case_folder_keeps_blobs(self):
+        record = scratch.store(db, _write('j.txt', 'رسید'))[0]
+        folder = os.path.join(workdir, 'unsaved')
+        db.link_attachments(folder, [record])
+        db.remove_case_folder(folder, [record])
+        self.assertFalse(os.path.exists(folder))
+        self.assertFalse(_writable(db.blob_path(record['sha256'])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+"""Backup retention and page snapshots, run against a scratch copy of the modules (see scratch.py)."""
+import os
+import sqlite3
+import unittest
+from unittest import mock
+
+import scratch
+
+workdir = None
+db = None
+backup = None
+
+HOUR = 3600
+DAY = 86400
+
+
+def setUpModule():
+    global workdir, db, backup
+    workdir, db = scratch.load()
+    import backup
+
+
+def tearDownModule():
+    scratch.unload(workdir, db)
+
+
+def _entry(ts, age, now):
+    return {'name': f'cases_{ts}.pages', 'ts': ts, 'created': now - age, 'size': 1}
+
+
+class RetentionTest(unittest.TestCase):
+
+    def test_grandfather_father_son(self):
+        now = 1_700_000_000
+        entries = [
+            _entry('14020710120000', 10 * 60, now),         # last hour: all kept
+            _entry('14020710115000', 20 * 60, now),
+            _entry('14020710093000', 2.5 * HOUR, now),      # same hour as the next: one kept
+            _entry('14020710091000', 2.8 * HOUR, now),
+            _entry('14020708220000', 2 * DAY, now),         # same day as the next: one kept
+            _entry('14020708080000', 2.5 * DAY, now),
+            _entry('14020610080000', 30 * DAY, now),        # older: one per month
+            _entry('14020602080000', 38 * DAY, now),
+            _entry('14010101080000', 400 * DAY, now),
+        ]
+        expired = {e['ts'] for e in backup.expired_backups(entries, now)}
+        self.assertEqual(expired, {'14020710091000', '14020708080000', '14020602080000'})
+
+    def test_last_tier_with_an_age_limit_expires_everything_past_it(self):
+        now = 1_700_000_000
+        entries = [_entry('14020710120000', HOUR, now), _entry('14020610120000', 40 * DAY, now)]
+        expired = backup.expired_backups(entries, now, retention=((7 * DAY, None),))
+        self.assertEqual([e['ts'] for e in expired], ['14020610120000'])
+
+    def test_parse_backup_name(self):
+        self.assertEqual(backup.parse_backup_name('cases_14020710120000.pages'), '14020710120000')
+        self.assertEqual(backup.parse_backup_name('cases_14020710120000.db'), '14020710120000')
+        self.assertIsNone(backup.parse_backup_name('cases_1402.pages'))
+        self.assertIsNone(backup.parse_backup_name('last_snapshot.db'))
+
+
+class PageSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = os.path.join(workdir, self.id().rsplit('.', 1)[-1])
+        self.backup_dir = os.path.join(self.dir, 'backup')
+        os.makedirs(self.backup_dir)
+        self.db_path = os.path.join(self.dir, 'cases.db')
+        self.conn = sqlite3.connect(self.db_path, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT)')
+        self.conn.executemany('INSERT INTO t (v) VALUES (?)', [(f'ردیف {i} ' * 20,) for i in range(3000)])
+        self.schedulers = []
+
+    def tearDown(self):
+        for s in self.schedulers:
+            s.stop()
+        self.conn.close()
+
+    def _scheduler(self, **kwargs):
+        s = backup.BackupScheduler(self.db_path, self.backup_dir, quiet_seconds=3600, **kwargs)
+        s.start()
+        self.schedulers.append(s)
+        return s
+
+    def _snapshot(self, scheduler, copies=None):
+        """Take a snapshot; returns its path and how many pages were hashed.
+
+        `copies` is how many full copies of the database it should make.
+        """
+        with mock.patch.object(backup.ChunkStore, 'put', autospec=True, side_effect=backup.ChunkStore.put) as put, \
+                mock.patch.object(scheduler, '_backup_to', side_effect=scheduler._backup_to) as copy:
+            path = scheduler.snapshot(force=True)
+        if copies is not None:
+            self.assertEqual(copy.call_count, copies)
+        # Pages passed with a known digest were not read back and hashed.
+        return path, sum(1 for c in put.call_args_list if (c.args[2:] or [c.kwargs.get('digest')])[0] is None)
+
+    def _assert_restores(self, path):
+        out = os.path.join(self.dir, 'restored.db')
+        backup.restore_backup(path, out)
+        restored = sqlite3.connect(out)
+        try:
+            self.assertEqual(restored.execute('PRAGMA integrity_check').fetchone()[0], 'ok')
+            self.assertEqual(restored.execute('SELECT * FROM t ORDER BY id').fetchall(),
+                             self.conn.execute('SELECT * FROM t ORDER BY id').fetchall())
+        finally:
+            restored.close()
+
+    def test_snapshots_restore_and_store_only_changed_pages(self):
+        scheduler = self._scheduler()
+        first, stored = self._snapshot(scheduler)
+        self.assertTrue(first.endswith(backup.PAGES_SUFFIX))
+        self.assertGreater(stored, 50)
+        self._assert_restores(first)
+
+        self.conn.execute("UPDATE t SET v = 'ویرایش' WHERE id = 1500")
+        second, stored = self._snapshot(scheduler, copies=0)
+        self.assertEqual(stored, 1)
+        self._assert_restores(second)
+
+        # A new scheduler picks up the base image left by the last one.
+        scheduler.stop()
+        self.conn.execute("UPDATE t SET v = 'پس از راه‌اندازی' WHERE id = 10")
+        third, stored = self._snapshot(self._scheduler(), copies=0)
+        self.assertEqual(stored, 1)
+        self._assert_restores(third)
+
+    def test_checkpoint_by_another_connection_falls_back_to_a_full_compare(self):
+        scheduler = self._scheduler()
+        self._snapshot(scheduler)
+        self.conn.execute("UPDATE t SET v = 'یک' WHERE id = 1")
+        # Moves that change into the database file and restarts the WAL.
+        self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.conn.execute("UPDATE t SET v = 'دو' WHERE id = 2900")
+        path, stored = self._snapshot(scheduler, copies=1)
+        self.assertLessEqual(stored, 3)
+        self._assert_restores(path)
+
+    def test_prune_removes_expired_snapshots_and_their_pages(self):
+        # Anything older than now is in a one-per-month tier.
+        scheduler = self._scheduler(retention=((0, None), (None, 6)))
+        old = scheduler.snapshot(force=True)
+        self.conn.execute('DELETE FROM t WHERE id > 100')
+        self.conn.execute('VACUUM')
+        entries = scheduler.manifest.entries()
+        # Give the second snapshot a later timestamp in the same month.
+        with mock.patch.object(backup.jdatetime.datetime, 'now',
+                               return_value=backup.jdatetime.datetime.strptime(entries[0]['ts'], '%Y%m%d%H%M%S')
+                               + backup.jdatetime.timedelta(seconds=1)):
+            new = scheduler.snapshot(force=True)
+        chunks = backup.ChunkStore(os.path.join(self.backup_dir, backup.CHUNKS_DIR_NAME))
+        chunks._load_known()
+        before = len(chunks._known)
+
+        self.assertEqual(scheduler.prune(), 0)
+        self.assertFalse(os.path.exists(old))
+        self.assertEqual([e['name'] for e in scheduler.manifest.entries()], [os.path.basename(new)])
+        chunks = backup.ChunkStore(os.path.join(self.backup_dir, backup.CHUNKS_DIR_NAME))
+        chunks._load_known()
+        self.assertLess(len(chunks._known), before)
+        self.assertEqual(chunks._known, set(backup.read_page_snapshot(new)['pages']))
+        self._assert_restores(new)
+
+
+if __name__ == '__main__':
+    unittest.main()
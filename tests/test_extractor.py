@@ -0,0 +1,54 @@
+"""Text extraction from documents, run against a scratch copy of the modules (see scratch.py)."""
+import os
+import unittest
+
+import scratch
+
+workdir = None
+db = None
+extractor = None
+
+
+def setUpModule():
+    global workdir, db, extractor
+    workdir, db = scratch.load()
+    import extractor
+
+
+def tearDownModule():
+    scratch.unload(workdir, db)
+
+
+def _write(name, data):
+    path = os.path.join(workdir, name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+class ReadTxtTest(unittest.TestCase):
+
+    def test_long_utf8_file_cut_inside_a_character(self):
+        # One ASCII byte first, so the cut after MAX_CHARS * 4 bytes falls in
+        # the middle of a two-byte Persian letter.
+        text = 'a' + 'سلام دنیا ' * (extractor.MAX_CHARS // 2)
+        path = _write('long.txt', text.encode('utf-8'))
+        self.assertGreater(os.path.getsize(path), extractor.MAX_CHARS * 4)
+        self.assertEqual(extractor.extract_text(path), text[:extractor.MAX_CHARS])
+
+    def test_utf8_with_bom(self):
+        path = _write('bom.txt', 'قرارداد'.encode('utf-8-sig'))
+        self.assertEqual(extractor.extract_text(path), 'قرارداد')
+
+    def test_windows_1256_file(self):
+        path = _write('old.txt', 'قرارداد اجاره'.encode('cp1256'))
+        self.assertEqual(extractor.extract_text(path), 'قرارداد اجاره')
+
+    def test_truncated_utf8_file_falls_back_to_windows_1256(self):
+        # A whole file that ends inside a character is not valid UTF-8.
+        path = _write('cut.txt', 'قرارداد'.encode('utf-8')[:-1])
+        self.assertEqual(extractor.extract_text(path), 'قرارداد'.encode('utf-8')[:-1].decode('cp1256'))
+
+
+if __name__ == '__main__':
+    unittest.main()
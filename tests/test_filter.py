@@ -0,0 +1,105 @@
+"""The combined filter compiler, run against a scratch copy of database.py (see scratch.py)."""
+import unittest
+
+import scratch
+
+workdir = None
+db = None
+
+# id, status, case_type, date, duration_to, contract_amount, mojer, title
+CASES = (
+    ('140001011000001', 'در جریان', 'اجاره', '1400-01-10', '1401-01-10', '1,000,000', 'احمد رضایی', 'اجاره مغازه'),
+    ('140002011000002', 'در جریان', 'پیمان', '1400-02-10', '1400-12-29', '5,000,000', 'مریم کریمی', 'پیمان ساخت'),
+    ('140003011000003', 'خاتمه یافته', 'اجاره', '1400-03-10', '1400-09-10', '۲,۵۰۰,۰۰۰', 'علی احمدی', 'اجاره انبار'),
+    ('140004011000004', 'معلق', 'خرید', '1400-04-10', '1401-04-10', '12,000,000', 'سارا نوری', 'خرید تجهیزات احمد'),
+)
+ARCHIVED = ('139001011000009', None, 'اجاره', '1390-01-10', '1391-01-10', '700,000', 'احمد رضایی', 'اجاره قدیمی')
+
+
+def _ids(criteria, **kwargs):
+    return [r.id for r in db.filter_results(criteria, columns=('id',), **kwargs)]
+
+
+def setUpModule():
+    global workdir, db
+    workdir, db = scratch.load()
+    for case_id, status, case_type, date, end, amount, mojer, title in CASES + (ARCHIVED,):
+        db.add_case({'id': case_id, 'status': status or db.ARCHIVE_STATUS, 'case_type': case_type, 'date': date,
+                     'duration_to': end, 'contract_amount': amount, 'mojer': mojer, 'title': title})
+    db.archive_inactive_cases(older_than_days=30)
+
+
+def tearDownModule():
+    scratch.unload(workdir, db)
+
+
+class CompileFilterTest(unittest.TestCase):
+
+    def test_list_values_are_one_in_clause(self):
+        source, params, ranked = db.compile_filter({'status': ['در جریان', 'معلق', '']})
+        self.assertIn('c.status IN (?, ?)', source)
+        self.assertFalse(ranked)
+        self.assertEqual(sorted(_ids({'status': ['در جریان', 'معلق']})),
+                         ['140001011000001', '140002011000002', '140004011000004'])
+        self.assertEqual(_ids({'case_type': 'خرید'}), ['140004011000004'])
+
+    def test_ranges_on_typed_columns(self):
+        # Amounts in any digit script and with separators; bounds are inclusive.
+        self.assertEqual(sorted(_ids({'amount_min': '2,500,000', 'amount_max': '۵۰۰۰۰۰۰'})),
+                         ['140002011000002', '140003011000003'])
+        self.assertEqual(_ids({'amount_min': 10000000}), ['140004011000004'])
+        self.assertEqual(sorted(_ids({'date_from': '1400-02-01', 'date_to': '1400-03-10'})),
+                         ['140002011000002', '140003011000003'])
+        self.assertEqual(sorted(_ids({'end_to': '1400-12-29'})), ['140002011000002', '140003011000003'])
+        # Newest first without a text match.
+        self.assertEqual(_ids({'case_type': 'اجاره', 'date_from': '1400-01-01'}),
+                         ['140003011000003', '140001011000001'])
+
+    def test_party_matches_only_party_names(self):
+        source, params, ranked = db.compile_filter({'party': 'احمد'})
+        self.assertTrue(ranked)
+        self.assertIn('cases_fts MATCH ?', source)
+        self.assertEqual(params[0], f'({db.FTS_PARTIES_COLUMN} : ("احمد"))')
+        # 'احمد' in a title (140004...) is not a party.
+        self.assertEqual(sorted(_ids({'party': 'احمد'})), ['140001011000001', '140003011000003'])
+        self.assertEqual(_ids({'party': 'احمد', 'text': 'مغازه'}), ['140001011000001'])
+
+    def test_short_terms_fall_back_to_like(self):
+        source, params, ranked = db.compile_filter({'text': 'پی'})
+        self.assertFalse(ranked)
+        self.assertNotIn('MATCH', source)
+        self.assertIn('JOIN cases_norm n', source)
+        self.assertEqual(set(params), {'%پی%'})
+        self.assertEqual(_ids({'text': 'پی', 'status': 'در جریان'}), ['140002011000002'])
+
+    def test_archive_variant(self):
+        source, params, ranked = db.compile_filter({'party': 'احمد', 'case_type': 'اجاره'}, archive=True)
+        self.assertTrue(source.startswith('FROM archive.cases c JOIN archive.cases_norm n'))
+        self.assertNotIn('MATCH', source)
+        self.assertNotIn('deleted_at', source)
+        self.assertFalse(ranked)
+        ids = _ids({'party': 'احمد', 'case_type': 'اجاره'}, include_archive=True)
+        # Hot matches in rank order, then the archived one.
+        self.assertEqual(sorted(ids[:2]), ['140001011000001', '140003011000003'])
+        self.assertEqual(ids[2:], ['139001011000009'])
+
+    def test_invalid_criteria(self):
+        with self.assertRaises(ValueError):
+            db.compile_filter({'colour': 'سبز'})
+        with self.assertRaises(ValueError):
+            db.compile_filter({'date_from': '1400-13-40'})
+        with self.assertRaises(ValueError):
+            db.compile_filter({'amount_max': 'زیاد'})
+        self.assertEqual(db.compile_filter({'status': '', 'text': None})[0], 'FROM cases c WHERE c.deleted_at IS NULL')
+
+    def test_explain_reports_the_index_used(self):
+        sql, plan = db.explain_filter({'case_type': 'اجاره', 'date_from': '1400-01-01', 'date_to': '1400-12-29'})
+        self.assertTrue(sql.startswith('SELECT c.id FROM cases c WHERE'))
+        self.assertTrue(any('idx_cases_type_date' in step for step in plan), plan)
+        sql, plan = db.explain_filter({'text': 'اجاره'}, order_by=('contract_amount', True))
+        self.assertIn('ORDER BY c.contract_amount_int DESC, c.id DESC', sql)
+        self.assertTrue(any('cases_fts' in step for step in plan), plan)
+
+
+if __name__ == '__main__':
+    unittest.main()
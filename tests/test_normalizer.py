@@ -0,0 +1,64 @@
+"""Persian normalization at write and search time, run against a scratch copy of the modules (see scratch.py)."""
+import unittest
+
+import scratch
+
+workdir = None
+db = None
+normalizer = None
+
+
+def setUpModule():
+    global workdir, db, normalizer
+    workdir, db = scratch.load()
+    import normalizer
+    db.add_case({'id': '140201011000001', 'title': 'كتاب علي', 'subject': 'مي\u200cخواهم', 'date': '1402-01-01',
+                 'contract_amount': '۱۲۰۰٠٠٠'})
+
+
+def tearDownModule():
+    scratch.unload(workdir, db)
+
+
+class NormalizeTextTest(unittest.TestCase):
+
+    def test_arabic_letters_become_persian(self):
+        self.assertEqual(normalizer.normalize_text('كتاب علي'), 'کتاب علی')
+        self.assertEqual(normalizer.normalize_text('مدرسة'), 'مدرسه')
+
+    def test_digits_become_ascii(self):
+        self.assertEqual(normalizer.normalize_text('۱۴۰۲-٠١-۰۵'), '1402-01-05')
+
+    def test_invisible_characters_vanish(self):
+        self.assertEqual(normalizer.normalize_text('می\u200cخواهم'), 'میخواهم')
+        self.assertEqual(normalizer.normalize_text('\u200fسلام\u200d'), 'سلام')
+        self.assertEqual(normalizer.normalize_text('مُحَمَّد'), 'محمد')
+        self.assertEqual(normalizer.normalize_text('کـــتاب'), 'کتاب')
+
+    def test_spaces_case_and_none(self):
+        self.assertEqual(normalizer.normalize_text('  Lease\t\nAGREEMENT  '), 'lease agreement')
+        self.assertEqual(normalizer.normalize_text(None), '')
+        self.assertEqual(normalizer.normalize_text(1402), '1402')
+
+
+class NormalizedSearchTest(unittest.TestCase):
+
+    def _found(self, filter_type, query):
+        return [r.id for r in db.search_cases(filter_type, query, columns=('id',))]
+
+    def test_persian_query_finds_arabic_spelling(self):
+        self.assertEqual(self._found('title', 'کتاب علی'), ['140201011000001'])
+        self.assertEqual(self._found('full', 'كتاب'), ['140201011000001'])
+
+    def test_query_without_zwnj_finds_text_with_it(self):
+        self.assertEqual(self._found('subject', 'میخواهم'), ['140201011000001'])
+        self.assertEqual(self._found('subject', 'می\u200cخواهم'), ['140201011000001'])
+
+    def test_digit_scripts_match_each_other(self):
+        self.assertEqual(self._found('contract_amount', '1200000'), ['140201011000001'])
+        self.assertEqual(db.get_connection().execute('SELECT contract_amount_int FROM cases WHERE id = ?',
+                                                     ('140201011000001',)).fetchone()[0], 1200000)
+
+
+if __name__ == '__main__':
+    unittest.main()
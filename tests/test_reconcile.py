@@ -0,0 +1,120 @@
+"""Reconciler passes, run against a scratch copy of the modules (see scratch.py)."""
+import os
+import time
+import shutil
+import unittest
+from unittest import mock
+
+import scratch
+
+workdir = None
+db = None
+reconcile = None
+
+
+def setUpModule():
+    global workdir, db, reconcile
+    workdir, db = scratch.load()
+    import reconcile
+
+
+def tearDownModule():
+    scratch.unload(workdir, db)
+
+
+def _age(path):
+    """Date a folder back past the reconciler's grace period."""
+    old = time.time() - db.BLOB_GC_GRACE_SECONDS - 60
+    os.utime(path, (old, old))
+
+
+def _copied_case(case_id, texts):
+    """Add a case whose attachments are plain copies rather than links to their blobs."""
+    records = []
+    for i, text in enumerate(texts):
+        src = os.path.join(workdir, f'{case_id}_{i}.txt')
+        with open(src, 'w', encoding='utf-8') as f:
+            f.write(text)
+        records.extend(scratch.store(db, src))
+    folder = db.case_folder(case_id)
+    os.makedirs(folder)
+    for r in records:
+        shutil.copyfile(db.blob_path(r['sha256']), os.path.join(folder, r['name']))
+    db.add_case({'id': case_id, 'title': 'رونوشت', 'date': '1403-01-01', 'folder_path': folder}, records)
+    _age(folder)
+    return folder, records
+
+
+def _run_pass(reconciler, **kwargs):
+    """Run slices until the pass is complete; returns how many it took."""
+    slices = 1
+    while not reconciler.run(**kwargs):
+        slices += 1
+    return slices
+
+
+class ReconcileTest(unittest.TestCase):
+
+    def setUp(self):
+        for path in (reconcile.CHECKPOINT_PATH, reconcile.FINDINGS_PATH, reconcile.DIGESTS_PATH):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def tearDown(self):
+        for case_id in db.search_cases('title', 'رونوشت', columns=('id',)):
+            db.delete_cases([case_id.id])
+        for future in db.purge_trash(older_than=-60):
+            future.result()
+
+    def test_orphan_folders_are_trashed_then_purged(self):
+        orphan = db.case_folder('140301011000099')
+        os.makedirs(orphan)
+        _age(orphan)
+        reconciler = reconcile.Reconciler(clean=True)
+        _run_pass(reconciler)
+        self.assertEqual([i['path'] for i in reconciler.findings['orphan_folder']], [orphan])
+        trashed = [n for n in os.listdir(db.TRASH_DIR) if n.startswith(db.ORPHAN_PREFIX)]
+        self.assertEqual(len(trashed), 1)
+
+        self.assertEqual(db.purge_trash(), [])
+        for future in db.purge_trash(older_than=-60):
+            future.result()
+        self.assertEqual([n for n in os.listdir(db.TRASH_DIR) if n.startswith(db.ORPHAN_PREFIX)], [])
+
+    def test_copies_are_hashed_once_until_they_change(self):
+        folder, records = _copied_case('140302011000001', ['نسخه یکم'])
+        path = os.path.join(folder, records[0]['name'])
+        with mock.patch.object(reconcile, 'hash_file', wraps=reconcile.hash_file) as hashed:
+            _run_pass(reconcile.Reconciler())
+            self.assertEqual(hashed.call_count, 1)
+            reconciler = reconcile.Reconciler()
+            _run_pass(reconciler)
+            self.assertEqual(hashed.call_count, 1)
+            self.assertEqual(reconciler.findings['modified'], [])
+
+            # Same size, new content and mtime.
+            os.chmod(path, 0o644)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('نسخه دوم')
+            _age(folder)
+            reconciler = reconcile.Reconciler()
+            _run_pass(reconciler)
+            self.assertEqual(hashed.call_count, 2)
+            self.assertEqual([i['path'] for i in reconciler.findings['modified']], [path])
+
+    def test_a_folder_of_copies_spans_slices_without_repeating_findings(self):
+        folder, records = _copied_case('140303011000001', ['یکم', 'دوم', 'سوم'])
+        with open(os.path.join(folder, 'extra.txt'), 'w', encoding='utf-8') as f:
+            f.write('ثبت نشده')
+        _age(folder)
+        reconciler = reconcile.Reconciler()
+        with mock.patch.object(reconcile, 'hash_file', wraps=reconcile.hash_file) as hashed:
+            # No time at all: each slice hashes one copy and stops.
+            slices = _run_pass(reconciler, time_budget=0)
+        self.assertEqual(hashed.call_count, 3)
+        self.assertGreaterEqual(slices, 3)
+        self.assertEqual([i['path'] for i in reconciler.findings['unrecorded']], [os.path.join(folder, 'extra.txt')])
+
+
+if __name__ == '__main__':
+    unittest.main()
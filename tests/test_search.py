@@ -0,0 +1,179 @@
+"""Search APIs, run against a scratch copy of database.py (see scratch.py)."""
+import unittest
+from unittest import mock
+
+import scratch
+
+workdir = None
+db = None
+
+# (id, title, date); two cases share a date and one has none, so the
+# date order needs its id tie-break and its NULL handling.
+CASES = (
+    ('140101011000001', 'اجاره مغازه تجاری', '1401-01-01'),
+    ('140102011000002', 'اجاره انبار', '1401-02-01'),
+    ('140102011000003', 'اجاره دفتر کار', '1401-02-01'),
+    ('140103011000004', 'پیمان ساخت', '1401-03-01'),
+    ('140104011000005', 'اجاره واحد مسکونی', None),
+)
+
+
+def setUpModule():
+    global workdir, db
+    workdir, db = scratch.load()
+    for case_id, title, date in CASES:
+        db.add_case({'id': case_id, 'title': title, 'subject': 'قرارداد', 'date': date})
+
+
+def tearDownModule():
+    scratch.unload(workdir, db)
+
+
+def _statements(fn, *args, **kwargs):
+    """Return fn's result and the SQL statements it ran on this thread's connection.
+
+    Statements SQLite runs internally (the full-text index's own lookups)
+    are traced with a leading '--' and left out.
+    """
+    sql = []
+    conn = db.get_connection()
+    conn.set_trace_callback(lambda s: s.startswith('--') or sql.append(s))
+    try:
+        return fn(*args, **kwargs), sql
+    finally:
+        conn.set_trace_callback(None)
+
+
+def _pages(filter_type, query, limit):
+    ids, after_key = [], None
+    while True:
+        rows, after_key = db.search_cases_page(filter_type, query, after_key, limit, columns=('id',))
+        ids.append([r.id for r in rows])
+        if after_key is None:
+            return ids
+
+
+class KeysetPageTest(unittest.TestCase):
+
+    def test_ranked_pages_cover_search_order(self):
+        expected = [r.id for r in db.search_cases('title', 'اجاره', columns=('id',))]
+        self.assertEqual(len(expected), 4)
+        pages = _pages('title', 'اجاره', 3)
+        self.assertEqual([len(p) for p in pages], [3, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_date_order_pages_resume_past_ties_and_null_dates(self):
+        # Two letters are too short for the trigram index: LIKE, newest first.
+        pages = _pages('subject', 'قر', 2)
+        self.assertEqual(sum(pages, []), ['140103011000004', '140102011000003', '140102011000002',
+                                          '140101011000001', '140104011000005'])
+
+    def test_iter_search_cases_streams_batches(self):
+        batches = list(db.iter_search_cases('subject', 'قر', batch_size=2, columns=('id', 'title')))
+        self.assertEqual([len(b) for b in batches], [2, 2, 1])
+        self.assertEqual(batches[0][0].title, 'پیمان ساخت')
+
+
+
+class ProjectionTest(unittest.TestCase):
+
+    def test_search_cases_is_one_projected_statement(self):
+        columns = ('id', 'title', 'date', 'duration_days')
+        db.search_cases('title', 'اجاره', columns=columns)
+        rows, sql = _statements(db.search_cases, 'title', 'اجاره', snippets=True, columns=columns)
+        self.assertEqual(len(sql), 1)
+        self.assertNotIn(' IN (', sql[0])
+        self.assertEqual(rows[0]._fields, columns + ('snippet',))
+        self.assertIn('[اجاره]', rows[0].snippet)
+
+    def test_cases_in_date_range_is_one_projected_statement(self):
+        rows, sql = _statements(db.cases_in_date_range, '1401-01-15', '1401-03-01', columns=('id', 'date'))
+        self.assertEqual(len(sql), 1)
+        self.assertEqual([(r.id, r.date) for r in rows], [('140103011000004', '1401-03-01'),
+                                                          ('140102011000003', '1401-02-01'),
+                                                          ('140102011000002', '1401-02-01')])
+
+
+# A result set larger than a few pages, on its own 1399 dates and with
+# words no other test searches for.
+BULK = 450
+
+
+def _bulk_case(i):
+    return {'id': f'1399{i:011d}', 'title': f'پرونده انبوه {i}', 'subject': 'انبوه',
+            'date': f'1399-{i % 12 + 1:02d}-{i % 28 + 1:02d}', 'contract_amount': f'{(i * 37) % 1000 * 1000:,}'}
+
+
+class CaseResultsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.bulk = [_bulk_case(i) for i in range(BULK)]
+        for data in cls.bulk:
+            db.add_case(data)
+        # Newest first, ties by id descending, as DATE_ORDER.
+        cls.by_date = [d['id'] for d in sorted(cls.bulk, key=lambda d: (db.jalali_ordinal(d['date']), d['id']),
+                                               reverse=True)]
+
+    @classmethod
+    def tearDownClass(cls):
+        db.delete_cases([d['id'] for d in cls.bulk])
+
+    def _results(self, **kwargs):
+        return db.date_range_results('1399-01-01', '1399-12-29', columns=('id', 'date'), **kwargs)
+
+    def test_len_index_and_slices_across_pages(self):
+        results = self._results()
+        self.assertEqual(len(results), BULK)
+        page = db.RESULT_PAGE_SIZE
+        self.assertEqual([r.id for r in results[page - 3:page + 2]], self.by_date[page - 3:page + 2])
+        self.assertEqual([r.id for r in results[10:2 * page + 10:7]], self.by_date[10:2 * page + 10:7])
+        self.assertEqual(results[-1].id, self.by_date[-1])
+        self.assertEqual(results[page].id, self.by_date[page])
+        with self.assertRaises(IndexError):
+            results[BULK]
+
+    def test_iteration_follows_result_order(self):
+        self.assertEqual([r.id for r in self._results()], self.by_date)
+
+    def test_order_by_amount_sorts_numerically(self):
+        results = self._results(order_by=('contract_amount', False))
+        expected = [d['id'] for d in sorted(self.bulk, key=lambda d: (db.parse_amount(d['contract_amount']), d['id']))]
+        as_text = [d['id'] for d in sorted(self.bulk, key=lambda d: (d['contract_amount'], d['id']))]
+        self.assertNotEqual(expected, as_text)
+        self.assertEqual([r.id for r in results], expected)
+
+    def test_order_by_date_ascending(self):
+        results = self._results(order_by=('date', False))
+        self.assertEqual([r.id for r in results], self.by_date[::-1])
+
+    def test_rows_deleted_since_the_search_are_none(self):
+        results = db.search_results('subject', 'انبوه', columns=('id',))
+        self.assertEqual(len(results), BULK)
+        gone = results.ids[BULK - 1]
+        data = db.get_case_by_id(gone)
+        db.delete_cases([gone])
+        try:
+            self.assertIsNone(results[BULK - 1])
+            self.assertEqual(sum(r is None for r in results), 1)
+        finally:
+            db.add_case({**data, 'id': gone})
+
+    def test_page_cache_is_bounded(self):
+        results = self._results()
+        pages = -(-BULK // db.RESULT_PAGE_SIZE)
+        with mock.patch.object(db, 'RESULT_CACHE_PAGES', 2):
+            for i in range(0, BULK, db.RESULT_PAGE_SIZE):
+                results[i]
+        self.assertGreater(pages, 2)
+        self.assertEqual(list(results._pages), list(range(pages - 2, pages)))
+
+    def test_iter_rows_reads_in_batches(self):
+        results = self._results()
+        rows = list(results.iter_rows(('id', 'date'), batch_size=64))
+        self.assertEqual([r[0] for r in rows], self.by_date)
+        self.assertEqual(rows[0][1], db.get_case_by_id(self.by_date[0])['date'])
+
+
+if __name__ == '__main__':
+    unittest.main()
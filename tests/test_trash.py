@@ -0,0 +1,47 @@
+"""Soft delete and restore, run against a scratch copy of database.py (see scratch.py)."""
+import os
+import unittest
+
+import scratch
+
+workdir = None
+db = None
+
+
+def setUpModule():
+    global workdir, db
+    workdir, db = scratch.load()
+
+
+def tearDownModule():
+    scratch.unload(workdir, db)
+
+
+class TrashTest(unittest.TestCase):
+
+    def test_delete_case_moves_the_folder_to_the_trash(self):
+        case_id = '140201011000001'
+        folder = db.case_folder(case_id)
+        os.makedirs(folder)
+        with open(os.path.join(folder, 'note.txt'), 'w', encoding='utf-8') as f:
+            f.write('یادداشت')
+        db.add_case({'id': case_id, 'title': 'حذف', 'date': '1402-01-01', 'folder_path': folder})
+
+        self.assertEqual(db.delete_case(case_id), 1)
+        self.assertFalse(os.path.exists(folder))
+        self.assertEqual(db.search_cases('id', case_id, columns=('id',)), [])
+        self.assertIsNone(db.get_case_by_id(case_id))
+        trashed = db.get_connection().execute('SELECT folder_path FROM cases WHERE id = ?', (case_id,)).fetchone()[0]
+        self.assertTrue(trashed.startswith(db.TRASH_DIR))
+        self.assertTrue(os.path.exists(os.path.join(trashed, 'note.txt')))
+
+        self.assertEqual(db.restore_cases([case_id]), 1)
+        self.assertEqual(db.get_case_by_id(case_id)['folder_path'], folder)
+        self.assertTrue(os.path.exists(os.path.join(folder, 'note.txt')))
+
+    def test_delete_case_of_a_missing_case(self):
+        self.assertEqual(db.delete_case('140201011099999'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
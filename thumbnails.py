@@ -0,0 +1,132 @@
+import os
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from PIL import Image, ImageOps
+
+
+THUMB_SIZE = (128, 128)
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+THUMB_WORKERS = 2
+
+
+class ThumbnailCache:
+    """Disk cache of attachment thumbnails, keyed by content hash.
+
+    Thumbnails are rendered with Pillow on a small worker pool and kept as
+    PNG files under `root`. The total size is bounded: when it goes over
+    `max_bytes` the least recently used thumbnails are deleted. File mtimes
+    carry the LRU order across runs (a cache hit touches the file).
+    """
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES, size=THUMB_SIZE, workers=THUMB_WORKERS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.size = size
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._index = None  # path -> bytes, least recently used first
+        self._total = 0
+        self._pending = {}
+        self._executor = None
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], f'{digest}_{self.size[0]}x{self.size[1]}.png')
+
+    def _load_index(self):
+        # Caller holds the lock.
+        if self._index is not None:
+            return
+        entries = []
+        if os.path.isdir(self.root):
+            for sub in os.scandir(self.root):
+                if not sub.is_dir():
+                    continue
+                for entry in os.scandir(sub.path):
+                    if entry.name.endswith('.png'):
+                        st = entry.stat()
+                        entries.append((st.st_mtime, entry.path, st.st_size))
+        entries.sort()
+        self._index = collections.OrderedDict((p, size) for _, p, size in entries)
+        self._total = sum(self._index.values())
+
+    def get(self, digest):
+        """Return the cached thumbnail path for `digest`, or None if it is not cached."""
+        path = self.path(digest)
+        with self._lock:
+            self._load_index()
+            if path not in self._index:
+                return None
+            self._index.move_to_end(path)
+        try:
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._total -= self._index.pop(path, 0)
+            return None
+        return path
+
+    def request(self, digest, source):
+        """Return a Future for the thumbnail of `source` (stored under `digest`).
+
+        The result is the thumbnail path, or None when Pillow cannot read the
+        file. Repeated requests for a digest that is still being rendered
+        share one Future.
+        """
+        cached = self.get(digest)
+        if cached:
+            future = Future()
+            future.set_result(cached)
+            return future
+        with self._lock:
+            future = self._pending.get(digest)
+            if future is None:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='thumbnails')
+                future = self._executor.submit(self._render, digest, source)
+                self._pending[digest] = future
+        return future
+
+    def _render(self, digest, source):
+        try:
+            path = self.path(digest)
+            try:
+                with Image.open(source) as im:
+                    # draft() lets JPEG decode at a reduced scale, which is
+                    # most of the win for large scans.
+                    im.draft('RGB', self.size)
+                    im = ImageOps.exif_transpose(im)
+                    im.thumbnail(self.size)
+                    if im.mode not in ('RGB', 'RGBA'):
+                        im = im.convert('RGBA')
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    tmp = path + '.tmp'
+                    im.save(tmp, 'PNG')
+            except (OSError, ValueError, Image.DecompressionBombError):
+                if os.path.exists(path + '.tmp'):
+                    os.remove(path + '.tmp')
+                return None
+            os.replace(tmp, path)
+            self._added(path, os.path.getsize(path))
+            return path
+        finally:
+            with self._lock:
+                self._pending.pop(digest, None)
+
+    def _added(self, path, size):
+        with self._lock:
+            self._load_index()
+            self._total += size - self._index.pop(path, 0)
+            self._index[path] = size
+            while self._total > self.max_bytes and len(self._index) > 1:
+                old, old_size = self._index.popitem(last=False)
+                self._total -= old_size
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
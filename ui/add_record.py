@@ -1,5 +1,4 @@
 import os
-import shutil
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import customtkinter as ctk
@@ -7,7 +6,7 @@ import jdatetime
 import csv
 import io
 
-from database import add_case, UPLOADS_DIR, update_case, get_case_by_id
+from database import add_case, case_folder, update_case, get_case_by_id, get_attachments, ingest_attachments, link_attachments, unlink_attachments, remove_case_folder
 
 CASE_TYPES = ['مزایده', 'مناقصه', 'تفاهم نامه', 'صورت جلسات', 'آموزشی کارگاهی', 'اجاره سالن ها', 'اجاره ورزشی', 'نانوایی', 'بوفه', 'مرکز رشد', 'مشاوره ای', 'پژوهشی', 'رستوران', 'خوابگاه', 'آرایشگاه', 'اماکن مازاد', 'سایر']
 
@@ -638,6 +637,72 @@ def open_add_record(master):
     btn_save.grid(row=7, column=0, columnspan=3, sticky='ew', padx=pad, pady=(pad, pad))
 
 
+INGEST_POLL_MS = 100
+
+
+def ingest_with_progress(top, paths, on_complete):
+    """Store the selected files on a worker pool while a progress window is shown.
+
+    `on_complete(attachments)` runs on the Tk thread once every file has been
+    stored. If any file fails, or the user cancels, it is not called and
+    nothing is saved.
+    """
+    if not paths:
+        on_complete([])
+        return
+    job = ingest_attachments(paths)
+
+    win = ctk.CTkToplevel(top)
+    win.title('ذخیره فایل‌های پیوست')
+    win.geometry('420x170')
+    win.resizable(False, False)
+    win.transient(top)
+    win.grab_set()
+
+    lbl_file = ctk.CTkLabel(win, text='', font=('vazirmatn', 12))
+    lbl_file.pack(fill='x', padx=15, pady=(15, 5))
+    bar = ctk.CTkProgressBar(win)
+    bar.set(0)
+    bar.pack(fill='x', padx=15, pady=5)
+    lbl_total = ctk.CTkLabel(win, text='', font=('vazirmatn', 11), text_color='gray')
+    lbl_total.pack(pady=5)
+
+    def cancel():
+        job.cancel()
+        btn_cancel.configure(state='disabled', text='در حال لغو...')
+
+    btn_cancel = ctk.CTkButton(win, text='انصراف', command=cancel, font=('vazirmatn', 12, 'bold'))
+    btn_cancel.pack(pady=(5, 15))
+    win.protocol('WM_DELETE_WINDOW', cancel)
+
+    count = convert_english_to_persian(str(len(job.paths)))
+
+    def poll():
+        done, total = job.progress()
+        bar.set(done / total if total else 1)
+        fractions = [job.file_progress(i) for i in range(len(job.paths))]
+        finished = sum(1 for f in fractions if f >= 1)
+        lbl_total.configure(text=f'{convert_english_to_persian(str(finished))} از {count} فایل')
+        current = next((i for i, f in enumerate(fractions) if 0 < f < 1), None)
+        if current is not None:
+            percent = convert_english_to_persian(str(int(fractions[current] * 100)))
+            lbl_file.configure(text=f'{os.path.basename(job.paths[current])} ({percent}٪)')
+        if not job.done():
+            win.after(INGEST_POLL_MS, poll)
+            return
+        win.grab_release()
+        win.destroy()
+        if job.cancelled:
+            return
+        if job.errors:
+            names = '\n'.join(os.path.basename(p) for p in job.errors)
+            messagebox.showerror('خطا', f'ذخیره فایل‌های زیر ناموفق بود و پرونده ذخیره نشد:\n{names}', parent=top)
+            return
+        on_complete(job.records())
+
+    poll()
+
+
 def save_case(top, selected_files, entry_title, entry_date, entry_duration_from, entry_duration_to, entry_mojer, entry_mostajjer, entry_karfarma, entry_piman, entry_subject, text_desc, entry_contract_amount, combo_case_type, entry_case_type_other, bank_data, status_var, export_var=None, guarantee_data=None):
     title = entry_title.get().strip()
     if not title:
@@ -649,14 +714,7 @@ def save_case(top, selected_files, entry_title, entry_date, entry_duration_from,
 
     date_str = entry_date.get().strip() or jdatetime.date.today().strftime('%Y-%m-%d')
 
-    folder = os.path.join(UPLOADS_DIR, case_id)
-    os.makedirs(folder, exist_ok=True)
-
-    for f in selected_files['list']:
-        try:
-            shutil.copy2(f, folder)
-        except Exception:
-            pass
+    folder = case_folder(case_id)
 
     # compute duration string
     from_val = entry_duration_from.get().strip()
@@ -707,17 +765,29 @@ def save_case(top, selected_files, entry_title, entry_date, entry_duration_from,
         'status': status_var.get()
     }
 
-    # Export to CSV and XLSX if checkbox is enabled
-    if export_var and export_var.get():
-        export_case_to_files(data)
-
-    try:
-        add_case(data)
+    def finish(attachments):
+        existed = os.path.isdir(folder)
+        try:
+            link_attachments(folder, attachments)
+            # Export to CSV and XLSX if checkbox is enabled
+            if export_var and export_var.get():
+                export_case_to_files(data)
+            add_case(data, attachments)
+        except Exception as e:
+            # No row was saved, so the folder just filled would be an orphan.
+            if not existed and os.path.isdir(folder):
+                try:
+                    remove_case_folder(folder, attachments)
+                except OSError:
+                    pass
+            messagebox.showerror('خطا', f'خطا در ذخیره: {e}', parent=top)
+            return
         messagebox.showinfo('موفق', f'پرونده با شماره {case_id} ایجاد شد', parent=top)
         top.master.deiconify()
         top.destroy()
-    except Exception as e:
-        messagebox.showerror('خطا', f'خطا در ذخیره: {e}', parent=top)
+
+    # The row is only written once every attachment has been stored.
+    ingest_with_progress(top, selected_files['list'], finish)
 
 
 def export_case_to_files(data):
@@ -1322,15 +1392,7 @@ def save_edit_case(top, case_id, selected_files, entry_title, entry_date, entry_
     folder = cur.get('folder_path')
     if not folder:
         # ensure we have a folder (create if missing)
-        folder = os.path.join(UPLOADS_DIR, case_id)
-        os.makedirs(folder, exist_ok=True)
-
-    # copy new attachments (if any)
-    for f in selected_files['list']:
-        try:
-            shutil.copy2(f, folder)
-        except Exception:
-            pass
+        folder = case_folder(case_id)
 
     # compute duration string
     from_val = entry_duration_from.get().strip()
@@ -1379,15 +1441,26 @@ def save_edit_case(top, case_id, selected_files, entry_title, entry_date, entry_
         'status': status_var.get()
     }
 
-    # Export to CSV and TXT if checkbox is enabled
-    if export_var and export_var.get():
-        data['id'] = case_id
-        export_case_to_files(data)
-
-    try:
-        update_case(case_id, data)
+    def finish(attachments):
+        previous = get_attachments(case_id)
+        try:
+            # link new attachments (if any)
+            link_attachments(folder, attachments)
+            # Export to CSV and TXT if checkbox is enabled
+            if export_var and export_var.get():
+                data['id'] = case_id
+                export_case_to_files(data)
+            update_case(case_id, data, attachments)
+        except Exception as e:
+            # The row still lists the old attachments; put the folder back to match.
+            try:
+                unlink_attachments(folder, attachments, previous)
+            except OSError:
+                pass
+            messagebox.showerror('خطا', f'خطا در ذخیره: {e}', parent=top)
+            return
         messagebox.showinfo('موفق', 'ویرایش ذخیره شد', parent=top)
         top.master.deiconify()
         top.destroy()
-    except Exception as e:
-        messagebox.showerror('خطا', f'خطا در ذخیره: {e}', parent=top)
+
+    ingest_with_progress(top, selected_files['list'], finish)
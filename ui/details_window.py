@@ -6,9 +6,21 @@ import tkinter as tk
 from tkinter import messagebox
 import customtkinter as ctk
 import jdatetime
-from database import get_case_by_id, update_case, delete_case
+from PIL import Image, ImageTk
+from database import get_case_by_id, get_archived_case, unarchive_cases, update_case, trash_cases, get_attachments, blob_path, THUMBS_DIR
+from thumbnails import ThumbnailCache, THUMB_SIZE
 from ui.add_record import open_edit_record
 
+# Shared by every details window so the worker pool and LRU index are built once.
+_thumbnail_cache = None
+
+
+def thumbnail_cache():
+    global _thumbnail_cache
+    if _thumbnail_cache is None:
+        _thumbnail_cache = ThumbnailCache(THUMBS_DIR)
+    return _thumbnail_cache
+
 def get_jalali_day_name(date_str):
     """Convert Jalali date string (YYYY-MM-DD) to day name with Farsi weekday."""
     try:
@@ -21,6 +33,133 @@ def get_jalali_day_name(date_str):
         return date_str
 
 
+class AttachmentStrip(ctk.CTkFrame):
+    """Horizontal strip of attachment thumbnails for one case.
+
+    Tiles are drawn on a canvas; thumbnails are requested only for tiles in
+    (or next to) the visible part of the strip, and the finished ones are
+    picked up by polling with after(). Clicking a tile opens the file.
+    """
+    TILE_WIDTH = THUMB_SIZE[0] + 24
+    TILE_HEIGHT = THUMB_SIZE[1] + 36
+    POLL_MS = 100
+
+    def __init__(self, master, on_open=None):
+        super().__init__(master)
+        self.on_open = on_open
+        bg = '#2b2b2b' if ctk.get_appearance_mode() == 'Dark' else '#dbdbdb'
+        fg = '#dce4ee' if ctk.get_appearance_mode() == 'Dark' else '#1a1a1a'
+        self.text_color = fg
+        self.canvas = tk.Canvas(self, height=self.TILE_HEIGHT, bg=bg, highlightthickness=0)
+        self.scrollbar = ctk.CTkScrollbar(self, orientation='horizontal', command=self._on_scroll)
+        self.canvas.configure(xscrollcommand=self.scrollbar.set)
+        self.canvas.pack(fill='x', expand=True)
+        self.scrollbar.pack(fill='x')
+        self.canvas.bind('<Configure>', lambda e: self._request_visible())
+        self.canvas.bind('<Shift-MouseWheel>', self._on_wheel)
+        self.canvas.bind('<MouseWheel>', self._on_wheel)
+        self.canvas.bind('<Button-4>', lambda e: self._scroll_units(-1))
+        self.canvas.bind('<Button-5>', lambda e: self._scroll_units(1))
+        self.items = []
+        self.images = {}
+        self.pending = {}
+        self.polling = False
+
+    def set_attachments(self, attachments, folder):
+        """Show `attachments` (records from get_attachments) of a case stored in `folder`."""
+        self.canvas.delete('all')
+        self.items = list(attachments)
+        self.folder = folder
+        self.images = {}
+        self.pending = {}
+        for i, a in enumerate(self.items):
+            x = i * self.TILE_WIDTH + self.TILE_WIDTH // 2
+            tag = f'tile{i}'
+            self.canvas.create_rectangle(x - THUMB_SIZE[0] // 2, 6, x + THUMB_SIZE[0] // 2, 6 + THUMB_SIZE[1],
+                                         outline='gray', tags=(tag, f'frame{i}'))
+            ext = os.path.splitext(a['name'])[1].lstrip('.').upper() or '?'
+            self.canvas.create_text(x, 6 + THUMB_SIZE[1] // 2, text=ext, fill='gray',
+                                    font=('vazirmatn', 14, 'bold'), tags=(tag, f'placeholder{i}'))
+            name = a['name'] if len(a['name']) <= 18 else a['name'][:8] + '…' + a['name'][-8:]
+            self.canvas.create_text(x, self.TILE_HEIGHT - 14, text=name, fill=self.text_color,
+                                    font=('vazirmatn', 10), tags=(tag,))
+            self.canvas.tag_bind(tag, '<Button-1>', lambda e, a=a: self._open(a))
+        self.canvas.configure(scrollregion=(0, 0, max(1, len(self.items)) * self.TILE_WIDTH, self.TILE_HEIGHT))
+        self.canvas.xview_moveto(0)
+        self._request_visible()
+
+    def _on_scroll(self, *args):
+        self.canvas.xview(*args)
+        self._request_visible()
+
+    def _on_wheel(self, event):
+        self._scroll_units(-1 if event.delta > 0 else 1)
+
+    def _scroll_units(self, units):
+        self.canvas.xview_scroll(units, 'units')
+        self._request_visible()
+
+    def _request_visible(self):
+        if not self.items:
+            return
+        left, right = self.canvas.xview()
+        first = int(left * len(self.items))
+        last = int(right * len(self.items)) + 1
+        # One tile of look-ahead on each side keeps short scrolls smooth.
+        for i in range(max(0, first - 1), min(len(self.items), last + 1)):
+            if i in self.images or i in self.pending:
+                continue
+            a = self.items[i]
+            if not (a.get('mime') or '').startswith('image/'):
+                continue
+            self.pending[i] = thumbnail_cache().request(a['sha256'], self._source(a))
+        if self.pending and not self.polling:
+            self.polling = True
+            self.after(self.POLL_MS, self._poll)
+
+    def _poll(self):
+        if not self.winfo_exists():
+            return
+        for i, future in list(self.pending.items()):
+            if not future.done():
+                continue
+            del self.pending[i]
+            path = None if future.exception() else future.result()
+            if not path:
+                self.images[i] = None
+                continue
+            try:
+                with Image.open(path) as im:
+                    self.images[i] = ImageTk.PhotoImage(im)
+            except OSError:
+                self.images[i] = None
+                continue
+            x = i * self.TILE_WIDTH + self.TILE_WIDTH // 2
+            self.canvas.delete(f'placeholder{i}')
+            self.canvas.create_image(x, 6 + THUMB_SIZE[1] // 2, image=self.images[i], tags=(f'tile{i}',))
+        if self.pending:
+            self.after(self.POLL_MS, self._poll)
+        else:
+            self.polling = False
+
+    def _source(self, a):
+        path = os.path.join(self.folder, a['name']) if self.folder else None
+        return path if path and os.path.exists(path) else blob_path(a['sha256'])
+
+    def _open(self, a):
+        if self.on_open:
+            self.on_open(self._source(a))
+
+
+def open_file(path):
+    if sys.platform.startswith('win'):
+        os.startfile(path)
+    elif sys.platform == 'darwin':
+        subprocess.run(['open', path])
+    else:
+        subprocess.run(['xdg-open', path])
+
+
 def open_details_window(master, case_id):
     """Open a Details window for a given case_id (function-based)."""
     master.withdraw()
@@ -96,11 +235,24 @@ def open_details_window(master, case_id):
                 row_dict['lbl_field'].grid_forget()
                 row_dict['lbl_value'].grid_forget()
 
+    def open_attachment(path):
+        try:
+            open_file(path)
+        except Exception as e:
+            messagebox.showerror('خطا', f'نشد باز شود: {e}')
+
+    strip = AttachmentStrip(top, on_open=open_attachment)
     frm = ctk.CTkFrame(top)
     frm.pack(pady=8)
 
+    # Archived cases are shown read-only from archive.db.
+    archived = {'value': False}
+
     def load():
         data = get_case_by_id(case_id)
+        archived['value'] = data is None
+        if data is None:
+            data = get_archived_case(case_id)
         if not data:
             messagebox.showerror('خطا', 'پرونده یافت نشد')
             top.destroy()
@@ -176,6 +328,13 @@ def open_details_window(master, case_id):
         }
         
         relayout_visible_rows()
+
+        attachments = get_attachments(case_id)
+        if attachments:
+            strip.pack(padx=12, pady=(0, 6), fill='x', before=frm)
+            strip.set_attachments(attachments, data.get('folder_path'))
+        else:
+            strip.pack_forget()
         return data, bank_info
 
     # Initialize data and bank_info
@@ -301,7 +460,7 @@ def open_details_window(master, case_id):
 
     def open_folder():
         # Always fetch the latest data directly from the DB to avoid stale state
-        current_data = get_case_by_id(case_id)
+        current_data = get_case_by_id(case_id) or get_archived_case(case_id)
         if not current_data:
             messagebox.showerror('خطا', 'پرونده یافت نشد یا حذف شده است.')
             return
@@ -310,12 +469,7 @@ def open_details_window(master, case_id):
             messagebox.showwarning('هشدار', 'فولدر پیوست برای این پرونده وجود ندارد یا مسیر آن نامعتبر است.')
             return
         try:
-            if sys.platform.startswith('win'):
-                os.startfile(folder)
-            elif sys.platform == 'darwin':
-                subprocess.run(['open', folder])
-            else:
-                subprocess.run(['xdg-open', folder])
+            open_file(folder)
         except Exception as e:
             messagebox.showerror('خطا', f'نشد باز شود: {e}')
 
@@ -350,8 +504,8 @@ def open_details_window(master, case_id):
         if not messagebox.askyesno('تایید', 'آیا از حذف این پرونده مطمئن هستید؟'):
             return
         try:
-            delete_case(case_id)
-            messagebox.showinfo('موفق', 'پرونده حذف شد')
+            trash_cases([case_id])
+            messagebox.showinfo('موفق', 'پرونده به سطل بازیافت منتقل شد')
             master.deiconify()
             top.destroy()
         except Exception as e:
@@ -373,6 +527,20 @@ def open_details_window(master, case_id):
     btn_edit = ctk.CTkButton(frm, text='ویرایش پرونده', command=edit, font=('vazirmatn', 13, 'bold'))
     btn_del = ctk.CTkButton(frm, text='حذف پرونده', command=delete, font=('vazirmatn', 13, 'bold'), fg_color="red", hover_color="darkred")
     
+    def unarchive():
+        try:
+            unarchive_cases([case_id])
+        except Exception as e:
+            messagebox.showerror('خطا', f'{e}')
+            return
+        btn_edit.configure(state='normal')
+        btn_del.configure(text='حذف پرونده', command=delete)
+        load()
+
+    if archived['value']:
+        btn_edit.configure(state='disabled')
+        btn_del.configure(text='خروج از بایگانی', command=unarchive)
+
     btn_open.grid(row=0, column=0, padx=6)
     btn_bank.grid(row=0, column=1, padx=6)
     btn_guarantee.grid(row=0, column=2, padx=6)
@@ -4,12 +4,11 @@ import customtkinter as ctk
 import jdatetime
 import os
 import csv
-import openpyxl
-from openpyxl.styles import Font, Border, Side, Alignment
-from openpyxl.utils import get_column_letter
 
 import tempfile
-from database import get_connection
+from database import date_range_results
+from ui.virtual_grid import VirtualGrid
+from xlsx_export import write_xlsx
 
 PERSIAN_TO_ENGLISH_MAP = {
     '۰': '0', '۱': '1', '۲': '2', '۳': '3', '۴': '4',
@@ -107,6 +106,9 @@ def open_reports_window(master):
     h_scroll.grid(row=2, column=0, sticky='ew', padx=pad, pady=(0, pad))
     tree.configure(yscroll=v_scroll.set, xscroll=h_scroll.set)
 
+    # Only the visible rows exist as tree items; the grid pages the rest in from the database
+    view = VirtualGrid(tree, v_scroll, lambda r: [str(v) if v else '-----' for v in r])
+
     # Status label
     lbl_status = ctk.CTkLabel(top, text='لطفا فیلتر را اعمال کنید', font=('vazirmatn', 11), text_color='gray')
     lbl_status.grid(row=3, column=0, padx=pad, pady=(pad, pad), sticky='w')
@@ -158,30 +160,25 @@ def open_reports_window(master):
                             font=('vazirmatn', 10), command=lambda: apply_sort_controls())
     rb_desc.pack(side='right', padx=2)
 
-    current_data = {'rows': [], 'sort_column': None, 'sort_reverse': False}
+    current_data = {'rows': [], 'range': None, 'sort_column': None, 'sort_reverse': False}
 
     def apply_sort_controls():
         """Apply sorting based on the radio button selections."""
         col = sort_col_var.get()
         reverse = sort_dir_var.get() == 'desc'
         
-        items = [(tree.set(k, col), k) for k in tree.get_children('')]
-        
-        # Try to sort as numbers first, fallback to strings
-        try:
-            items.sort(key=lambda x: float(x[0]) if x[0] != '-----' else float('-inf'), reverse=reverse)
-        except ValueError:
-            items.sort(key=lambda x: x[0], reverse=reverse)
-        
-        # Rearrange items in sorted position
-        for index, (val, k) in enumerate(items):
-            tree.move(k, '', index)
+        sort_rows(col, reverse)
+
+    def sort_rows(col, reverse):
+        """Re-run the current filter ordered by a column's typed sort key (see database.SORT_KEYS)."""
+        if not current_data['range']:
+            return
+        rows = date_range_results(*current_data['range'], columns=cols, order_by=(col, reverse))
+        current_data['rows'] = rows
+        view.reorder(rows)
 
     def sort_tree(col):
         """Sort the treeview by column, toggling between ascending and descending."""
-        # Get all items
-        items = [(tree.set(k, col), k) for k in tree.get_children('')]
-        
         # Check if we're sorting the same column (toggle direction)
         if current_data['sort_column'] == col:
             current_data['sort_reverse'] = not current_data['sort_reverse']
@@ -189,15 +186,7 @@ def open_reports_window(master):
             current_data['sort_column'] = col
             current_data['sort_reverse'] = False
         
-        # Try to sort as numbers first, fallback to strings
-        try:
-            items.sort(key=lambda x: float(x[0]) if x[0] != '-----' else float('-inf'), reverse=current_data['sort_reverse'])
-        except ValueError:
-            items.sort(key=lambda x: x[0], reverse=current_data['sort_reverse'])
-        
-        # Rearrange items in sorted position
-        for index, (val, k) in enumerate(items):
-            tree.move(k, '', index)
+        sort_rows(col, current_data['sort_reverse'])
         
         # Update column header to show sort direction
         arrow = ' ▼' if current_data['sort_reverse'] else ' ▲'
@@ -228,26 +217,12 @@ def open_reports_window(master):
             messagebox.showerror('خطا', f'فرمت تاریخ نامعتبر: {e}', parent=top)
             return
 
-        # Query database for cases in date range
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute('''SELECT id, title, subject, date, case_type, duration, contract_amount 
-                       FROM cases 
-                       WHERE date >= ? AND date <= ? 
-                       ORDER BY date DESC''', (date_from, date_to))
-        rows = cur.fetchall()
-        conn.close()
-
-        # Clear previous results
-        for i in tree.get_children():
-            tree.delete(i)
-
-        # Insert new results
-        for r in rows:
-            vals = [str(r[i]) if r[i] else '-----' for i in range(7)]
-            tree.insert('', 'end', values=vals)
+        # Query database for cases in date range; records are loaded as they are scrolled into view
+        rows = date_range_results(date_from, date_to, columns=cols)
+        view.set_rows(rows)
 
         current_data['rows'] = rows
+        current_data['range'] = (date_from, date_to)
         current_data['sort_column'] = None  # Reset sort state
         current_data['sort_reverse'] = False
         lbl_status.configure(text=f'تعداد پرونده‌های یافت شده: {len(rows)}', text_color='green')
@@ -274,54 +249,11 @@ def open_reports_window(master):
             return
 
         try:
-            workbook = openpyxl.Workbook()
-            sheet = workbook.active
-            sheet.title = "گزارش پرونده ها"
-            sheet.sheet_view.rightToLeft = True
-
-            # --- Styles ---
-            bold_font = Font(name='Vazirmatn', bold=True)
-            regular_font = Font(name='Vazirmatn')
-            thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-            center_alignment = Alignment(horizontal='center', vertical='center')
-
-            headers = ['شناسه بایگانی', 'عنوان', 'موضوع', 'تاریخ', 'نوع پرونده', 'مدت', 'مبلغ قرارداد']
-            headers.insert(0, 'ردیف') # Add Row column header
-            sheet.append(headers)
-
-            # Apply style to header
-            for col_num, header in enumerate(headers, 1):
-                cell = sheet.cell(row=1, column=col_num)
-                cell.font = bold_font
-                cell.border = thin_border
-                cell.alignment = center_alignment
-
-            # Apply style to data rows
-            for row_idx, row in enumerate(rows_to_export, start=2):
-                # Add row number to the start of the row data
-                row_with_num = [row_idx - 1] + list(row)
-                reshaped_row = [convert_english_to_persian(str(item) if item is not None else '') for item in row_with_num]
-                sheet.append(reshaped_row)
-                for col_idx, _ in enumerate(reshaped_row, 1):
-                    cell = sheet.cell(row=row_idx, column=col_idx)
-                    cell.font = regular_font
-                    cell.border = thin_border
-                    cell.alignment = center_alignment
-
-            # Adjust column widths
-            for col in sheet.columns:
-                max_length = 0
-                column = col[0].column_letter # Get the column letter
-                for cell in col:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = (max_length + 2) * 1.2
-                sheet.column_dimensions[column].width = adjusted_width
-
-            workbook.save(file_path)
+            headers = ['ردیف', 'شناسه بایگانی', 'عنوان', 'موضوع', 'تاریخ', 'نوع پرونده', 'مدت', 'مبلغ قرارداد']
+            # Records are read page by page as the file is written; the row number gets Persian digits too
+            rows = ([convert_english_to_persian(str(item) if item is not None else '') for item in [row_num] + list(row)]
+                    for row_num, row in enumerate((r for r in rows_to_export if r is not None), start=1))
+            write_xlsx(file_path, "گزارش پرونده ها", headers, rows, number_rows=False)
             messagebox.showinfo('موفق', f'گزارش با موفقیت صادر شد:\n{file_path}', parent=top)
         except Exception as e:
             messagebox.showerror('خطا', f'خطا در صادر کردن فایل XLSX: {str(e)}', parent=top)
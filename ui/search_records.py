@@ -5,11 +5,11 @@ from tkinter import ttk, messagebox, filedialog
 import customtkinter as ctk
 import jdatetime
 import csv
-import openpyxl
-from openpyxl.styles import Font, Border, Side, Alignment
-from openpyxl.utils import get_column_letter
-from database import search_cases, delete_case, get_connection
+from database import search_results, date_range_results, filter_results, explain_filter, trash_cases, restore_cases, case_table_columns, QueryWorker
+from xlsx_export import write_xlsx
+from ui.add_record import CASE_TYPES
 from ui.details_window import open_details_window
+from ui.virtual_grid import VirtualGrid
 
 PERSIAN_TO_ENGLISH_MAP = {
     '۰': '0', '۱': '1', '۲': '2', '۳': '3', '۴': '4',
@@ -54,6 +54,23 @@ def calculate_duration_text(duration_from, duration_to):
     except Exception as e:
         return '-----'
 
+def format_duration_days(days):
+    """Format a precomputed duration in days the same way calculate_duration_text does."""
+    if days is None:
+        return '-----'
+    if days < 0:
+        return 'تاریخ پایان قبل از شروع'
+    return f'{convert_english_to_persian(str(days))} \u200eروز'
+
+# Fields fetched for each result row; duration_days is computed in SQL.
+RESULT_COLUMNS = ('id', 'title', 'subject', 'date', 'case_type', 'status', 'contract_amount', 'duration_from', 'duration_to', 'duration_days', 'attachment_count')
+# Typing in the search box runs the search once the user pauses for this long.
+SEARCH_DEBOUNCE_MS = 250
+SEARCH_POLL_MS = 50
+# Columns of the cases table left out of the XLSX export.
+EXPORT_EXCLUDED_COLUMNS = ('folder_path', 'parties', 'contract_amount_int', 'date_ord', 'duration_from_ord',
+                           'duration_to_ord', 'deleted_at', 'trashed_from')
+
 class CustomJalaliCalendar(ctk.CTkFrame):
     """A custom Jalali calendar widget built with customtkinter."""
     def __init__(self, master, on_select=None, year=None, month=None, day=None):
@@ -181,6 +198,103 @@ def open_calendar(master, entry_widget):
     cal.pack(pady=10, padx=10, fill="both", expand=True)
 
 
+def open_filter_builder(master, criteria, on_apply):
+    """Open the combined filter window.
+
+    `criteria` (a dict of database.FILTER_KEYS) fills the fields and is
+    updated in place on apply; `on_apply()` then runs the search. The window
+    stays open so the filter can be refined, and shows the query plan
+    SQLite chose for it.
+    """
+    win = ctk.CTkToplevel(master)
+    win.title('فیلتر ترکیبی')
+    win.geometry('520x560')
+    win.resizable(False, False)
+    win.grid_columnconfigure(0, weight=1)
+    win.grid_columnconfigure(1, weight=1)
+
+    pad = 8
+    font_label = ('vazirmatn', 12, 'bold')
+    font_entry = ('vazirmatn', 12)
+    entries = {}
+
+    def add_field(row, column, key, text):
+        lbl = ctk.CTkLabel(win, text=text, font=font_label)
+        lbl.grid(row=row * 2, column=column, sticky='e', padx=pad, pady=(pad, 0))
+        entry = ctk.CTkEntry(win, justify='right', font=font_entry)
+        entry.grid(row=row * 2 + 1, column=column, sticky='ew', padx=pad)
+        value = criteria.get(key)
+        if value:
+            entry.insert(0, '، '.join(value) if isinstance(value, list) else str(value))
+        entries[key] = entry
+
+    # Right column holds the "from" side of each range (RTL)
+    add_field(0, 1, 'text', 'متن')
+    add_field(0, 0, 'party', 'نام طرف قرارداد')
+    add_field(1, 1, 'date_from', 'از تاریخ')
+    add_field(1, 0, 'date_to', 'تا تاریخ')
+    add_field(2, 1, 'end_from', 'پایان قرارداد از')
+    add_field(2, 0, 'end_to', 'پایان قرارداد تا')
+    add_field(3, 1, 'amount_min', 'مبلغ از')
+    add_field(3, 0, 'amount_max', 'مبلغ تا')
+
+    lbl_case_type = ctk.CTkLabel(win, text='نوع پرونده', font=font_label)
+    lbl_case_type.grid(row=8, column=1, sticky='e', padx=pad, pady=(pad, 0))
+    combo_case_type = ctk.CTkComboBox(win, values=['همه'] + CASE_TYPES, font=font_entry, state='readonly')
+    combo_case_type.set(criteria.get('case_type') or 'همه')
+    combo_case_type.grid(row=9, column=1, sticky='ew', padx=pad)
+
+    lbl_status_filter = ctk.CTkLabel(win, text='وضعیت', font=font_label)
+    lbl_status_filter.grid(row=8, column=0, sticky='e', padx=pad, pady=(pad, 0))
+    combo_status = ctk.CTkComboBox(win, values=['همه', 'در جریان', 'راکد'], font=font_entry, state='readonly')
+    combo_status.set(criteria.get('status') or 'همه')
+    combo_status.grid(row=9, column=0, sticky='ew', padx=pad)
+
+    lbl_plan = ctk.CTkLabel(win, text='', font=('vazirmatn', 10), text_color='gray', justify='left', wraplength=480)
+    lbl_plan.grid(row=11, column=0, columnspan=2, sticky='ew', padx=pad, pady=pad)
+
+    def read_criteria():
+        new = {}
+        for key, entry in entries.items():
+            value = entry.get().strip()
+            if value:
+                new[key] = convert_persian_to_english(value) if key.startswith(('date', 'end', 'amount')) else value
+        if combo_case_type.get() != 'همه':
+            new['case_type'] = combo_case_type.get()
+        if combo_status.get() != 'همه':
+            new['status'] = combo_status.get()
+        return new
+
+    def apply():
+        new = read_criteria()
+        try:
+            sql, plan = explain_filter(new)
+        except ValueError as e:
+            messagebox.showerror('خطا', f'فیلتر نامعتبر: {e}', parent=win)
+            return
+        criteria.clear()
+        criteria.update(new)
+        lbl_plan.configure(text='طرح اجرای پرس‌وجو:\n' + '\n'.join(plan))
+        on_apply()
+
+    def clear():
+        for entry in entries.values():
+            entry.delete(0, tk.END)
+        combo_case_type.set('همه')
+        combo_status.set('همه')
+        apply()
+
+    buttons = ctk.CTkFrame(win, fg_color='transparent')
+    buttons.grid(row=10, column=0, columnspan=2, sticky='ew', padx=pad, pady=(pad * 2, 0))
+    buttons.grid_columnconfigure((0, 1), weight=1)
+    btn_clear = ctk.CTkButton(buttons, text='پاک کردن', command=clear, font=font_label)
+    btn_clear.grid(row=0, column=0, sticky='ew', padx=(0, pad))
+    btn_apply = ctk.CTkButton(buttons, text='اعمال فیلتر', command=apply, font=font_label)
+    btn_apply.grid(row=0, column=1, sticky='ew')
+    win.bind('<Return>', lambda e: apply())
+    return win
+
+
 def open_search_records(master):
     """Open the Search Records window as a Toplevel and provide search UI."""
     master.withdraw()
@@ -188,7 +302,16 @@ def open_search_records(master):
     top.title('جستجوی پرونده‌ها — سیستم مدیریت پرونده مهاجر')
     top.geometry('1460x600')
 
+    # Searches run on a worker thread; a newer search interrupts the running one
+    search_worker = QueryWorker('search-worker')
+    search_timers = {'debounce': None, 'poll': None}
+    typed_query = {'text': None}
+
     def on_close():
+        search_worker.close()
+        for timer in search_timers.values():
+            if timer:
+                top.after_cancel(timer)
         master.deiconify()
         top.destroy()
     
@@ -212,17 +335,48 @@ def open_search_records(master):
     btn_export_xlsx = ctk.CTkButton(control_frame, text='خروجی فایل XLSX', font=('vazirmatn', 11, 'bold'), state="disabled")
     btn_export_xlsx.grid(row=0, column=1, padx=(0, pad))
 
+    # Undo the last delete (cases are moved to the trash first)
+    btn_undo = ctk.CTkButton(control_frame, text='بازگردانی حذف', command=lambda: undo_delete(), font=('vazirmatn', 11, 'bold'), state="disabled")
+    btn_undo.grid(row=0, column=2, padx=(0, pad))
+
     # Search button
     btn_search = ctk.CTkButton(control_frame, text='جستجوی پرونده ها', command=lambda: do_search(), font=('vazirmatn', 11, 'bold'))
     btn_search.grid(row=0, column=3, padx=(0, pad))
 
+    # Also search cases moved to the archive database
+    include_archive_var = tk.BooleanVar(value=False)
+    chk_archive = ctk.CTkCheckBox(control_frame, text='شامل بایگانی', variable=include_archive_var, font=('vazirmatn', 11), command=lambda: do_search())
+    chk_archive.grid(row=0, column=4, padx=(0, pad), sticky='e')
+
     # Search entry (column 5 - spans date area)
     entry_q = ctk.CTkEntry(control_frame, width=750, justify='right', font=('vazirmatn', 12))
     entry_q.grid(row=0, column=5, columnspan=8, padx=(pad, 2), sticky='ew')
+    entry_q.bind('<KeyRelease>', lambda e: schedule_search())
+    entry_q.bind('<Return>', lambda e: do_search())
+
+    # Criteria of the combined filter, edited in its own window
+    filter_criteria = {}
+    filter_window = {'win': None}
+
+    def show_filter_builder():
+        if filter_window['win'] is not None and filter_window['win'].winfo_exists():
+            filter_window['win'].focus()
+            return
+        filter_window['win'] = open_filter_builder(top, filter_criteria, lambda: do_search())
+
+    btn_edit_filter = ctk.CTkButton(control_frame, text='ویرایش فیلتر ترکیبی', command=show_filter_builder, font=('vazirmatn', 11, 'bold'))
 
     def on_filter_change(choice):
         """Show/hide date entries based on filter selection."""
         selected_filter = choice
+        if selected_filter == 'فیلتر ترکیبی':
+            entry_q.grid_remove()
+            for widget in (lbl_date_from, entry_date_from, btn_cal_from, btn_today_from, lbl_date_to, entry_date_to, btn_cal_to, btn_today_to):
+                widget.grid_remove()
+            btn_edit_filter.grid(row=0, column=5, columnspan=8, padx=(pad, 2), sticky='ew')
+            show_filter_builder()
+            return
+        btn_edit_filter.grid_remove()
         if selected_filter == 'بر اساس تاریخ':
             # Show date entries, hide text entry
             entry_q.grid_remove()
@@ -255,7 +409,7 @@ def open_search_records(master):
             btn_today_to.grid_remove()
 
     # Combobox filter
-    combo = ctk.CTkComboBox(control_frame, values=['جستجوی کلی', 'بر اساس عنوان', 'بر اساس موضوع', 'بر اساس تاریخ', 'بر اساس نوع پرونده', 'بر اساس شناسه بایگانی'], font=('vazirmatn', 12, 'bold'), width=150, state='readonly', command=on_filter_change)
+    combo = ctk.CTkComboBox(control_frame, values=['جستجوی کلی', 'بر اساس عنوان', 'بر اساس موضوع', 'بر اساس تاریخ', 'بر اساس نوع پرونده', 'بر اساس شناسه بایگانی', 'فیلتر ترکیبی'], font=('vazirmatn', 12, 'bold'), width=150, state='readonly', command=on_filter_change)
     combo.set('جستجوی کلی')  # Set to "جستجوی کلی" as default
     combo.grid(row=0, column=13, padx=(pad, 0))
 
@@ -295,8 +449,10 @@ def open_search_records(master):
 
 
     # --- RTL Treeview ---
-    # Columns order must match database query: id, title, subject, date, case_type, duration, status, contract_amount
-    cols = ('id', 'title', 'subject', 'date', 'case_type', 'duration', 'status', 'contract_amount')
+    # Columns order must match the values built in do_search
+    cols = ('id', 'title', 'subject', 'date', 'case_type', 'duration', 'status', 'contract_amount', 'attachments', 'snippet')
+    # The snippet column (matched text of a full-text search) has no sort key
+    sort_cols = cols[:-1]
     tree = ttk.Treeview(top, columns=cols, show='headings')
     # Headings
     tree.heading('title', text='عنوان')
@@ -307,6 +463,8 @@ def open_search_records(master):
     tree.heading('status', text='وضعیت')
     tree.heading('contract_amount', text='مبلغ قرارداد')
     tree.heading('id', text='شناسه بایگانی')
+    tree.heading('attachments', text='پیوست')
+    tree.heading('snippet', text='متن یافته شده')
 
     # Set column widths for all columns
     tree.column('id', width=140, minwidth=100)
@@ -317,10 +475,12 @@ def open_search_records(master):
     tree.column('duration', width=80, minwidth=70)
     tree.column('status', width=90, minwidth=80)
     tree.column('contract_amount', width=120, minwidth=100)
+    tree.column('attachments', width=60, minwidth=50)
+    tree.column('snippet', width=260, minwidth=120)
     tree.grid(row=1, column=0, padx=pad, pady=pad, sticky='nsew')
 
     # Bind heading clicks for sorting
-    for col in cols:
+    for col in sort_cols:
         tree.heading(col, command=lambda c=col: sort_tree(c))
 
     # Add scrollbars for horizontal and vertical scrolling
@@ -331,6 +491,24 @@ def open_search_records(master):
     vsb.grid(row=1, column=1, sticky='ns', padx=(0, pad), pady=pad)
     hsb.grid(row=2, column=0, sticky='ew', padx=pad, pady=(0, pad))
 
+    def render_row(r):
+        return [
+            str(r.id) if r.id else '-----',
+            str(r.title) if r.title else '-----',
+            str(r.subject) if r.subject else '-----',
+            str(r.date) if r.date else '-----',
+            str(r.case_type) if r.case_type else '-----',
+            format_duration_days(r.duration_days),
+            str(r.status) if r.status else '-----',
+            (f"{int(r.contract_amount):,} ریال" if r.contract_amount else '-----') if isinstance(r.contract_amount, (int, float)) or (isinstance(r.contract_amount, str) and r.contract_amount.replace(',', '').isdigit()) else str(r.contract_amount) if r.contract_amount else '-----',  # contract_amount with ریال
+            str(r.attachment_count),
+            # Only ranked (full-text) searches have a snippet
+            getattr(r, 'snippet', None) or ''
+        ]
+
+    # Only the visible rows exist as tree items; the grid pages the rest in from the database
+    view = VirtualGrid(tree, vsb, render_row, key=lambda r: r.id, on_select=lambda: on_selection_change(None))
+
     # Status label for showing number of results
     lbl_status = ctk.CTkLabel(top, text='لطفا جستجو کنید', font=('vazirmatn', 11), text_color='gray')
     lbl_status.grid(row=3, column=0, padx=pad, pady=(pad, pad), sticky='w')
@@ -356,10 +534,11 @@ def open_search_records(master):
         'case_type': 'نوع پرونده',
         'duration': 'مدت',
         'status': 'وضعیت',
-        'contract_amount': 'مبلغ قرارداد'
+        'contract_amount': 'مبلغ قرارداد',
+        'attachments': 'پیوست'
     }
     
-    for col in cols:
+    for col in sort_cols:
         rb = ctk.CTkRadioButton(sort_cols_frame, text=col_labels[col], variable=sort_col_var, value=col, 
                            font=('vazirmatn', 10), command=lambda: apply_sort_controls())
         rb.pack(side='right', padx=2)
@@ -385,7 +564,8 @@ def open_search_records(master):
 
     # Sort state and current data
     sort_state = {'column': None, 'reverse': False}
-    current_data = {'rows': []}
+    current_data = {'rows': [], 'order_by': None}
+    last_trashed = {'ids': []}
 
     def update_sort_ui():
         """Update radio buttons and column headers to match sort_state."""
@@ -404,9 +584,6 @@ def open_search_records(master):
     
     def sort_tree(col):
         """Sort the treeview by column, toggling between ascending and descending."""
-        # Get all items
-        items = [(tree.set(k, col), k) for k in tree.get_children('')]
-        
         # Check if we're sorting the same column (toggle direction)
         if sort_state['column'] == col:
             sort_state['reverse'] = not sort_state['reverse']
@@ -414,19 +591,15 @@ def open_search_records(master):
             sort_state['column'] = col
             sort_state['reverse'] = False
         
-        # Try to sort as numbers first, fallback to strings
-        try:
-            items.sort(key=lambda x: float(x[0]) if x[0] != '-----' else float('-inf'), reverse=sort_state['reverse'])
-        except ValueError:
-            items.sort(key=lambda x: x[0], reverse=sort_state['reverse'])
-        
-        # Rearrange items in sorted position
-        for index, (val, k) in enumerate(items):
-            tree.move(k, '', index)
+        sort_rows(col, sort_state['reverse'])
         
         # Update UI to show new sort state
         update_sort_ui()
 
+    def sort_rows(col, reverse):
+        """Re-run the current search ordered by a column's typed sort key (see database.SORT_KEYS)."""
+        do_search(order_by=(col, reverse))
+
     def map_filter(txt):
         m = {
             'جستجوی کلی': 'full',
@@ -434,11 +607,15 @@ def open_search_records(master):
             'بر اساس موضوع': 'subject',
             'بر اساس تاریخ': 'date',
             'بر اساس نوع پرونده': 'case_type',
-            'بر اساس شناسه بایگانی': 'id'
+            'بر اساس شناسه بایگانی': 'id',
+            'فیلتر ترکیبی': 'filter'
         }
         return m.get(txt, 'full')
 
-    def do_search():
+    def do_search(order_by=None):
+        if search_timers['debounce']:
+            top.after_cancel(search_timers['debounce'])
+            search_timers['debounce'] = None
         ft = map_filter(combo.get())
         
         # Handle date range search
@@ -461,47 +638,52 @@ def open_search_records(master):
                 messagebox.showerror('خطا', f'فرمت تاریخ نامعتبر: {e}', parent=top)
                 return
             
-            # Query database for cases in date range (include duration_from and duration_to)
-            conn = get_connection()
-            cur = conn.cursor()
-            cur.execute('''SELECT id, title, subject, date, case_type, duration, status, contract_amount, duration_from, duration_to
-                           FROM cases 
-                           WHERE date >= ? AND date <= ? 
-                           ORDER BY date DESC''', (date_from, date_to))
-            rows = cur.fetchall()
-            conn.close()
+            search_worker.submit(date_range_results, date_from, date_to, columns=RESULT_COLUMNS, include_archive=include_archive_var.get(), order_by=order_by)
+        elif ft == 'filter':
+            # All criteria of the combined filter in one query
+            search_worker.submit(filter_results, dict(filter_criteria), columns=RESULT_COLUMNS, include_archive=include_archive_var.get(), order_by=order_by, snippets=True)
         else:
             # Regular search
             q = entry_q.get().strip()
-            rows = search_cases(ft, q)
-            # Fetch duration_from and duration_to for all results
-            if rows:
-                case_ids = [str(r[0]) for r in rows]
-                conn = get_connection()
-                cur = conn.cursor()
-                cur.execute('SELECT id, duration_from, duration_to FROM cases WHERE id IN ({})'.format(','.join(['?' for _ in case_ids])), case_ids)
-                duration_data = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
-                conn.close()
-                # Add duration_from and duration_to to each row
-                rows = [r + (duration_data.get(r[0], ('', ''))[0], duration_data.get(r[0], ('', ''))[1]) for r in rows]
-        
-        for i in tree.get_children():
-            tree.delete(i)
-        for r in rows:
-            # r[0-7] = id, title, subject, date, case_type, duration, status, contract_amount
-            # r[8-9] = duration_from, duration_to (from our queries above)
-            duration_text = calculate_duration_text(r[8] if len(r) > 8 else None, r[9] if len(r) > 9 else None)
-            vals = [
-                str(r[0]) if r[0] else '-----',           # id
-                str(r[1]) if r[1] else '-----',           # title
-                str(r[2]) if r[2] else '-----',           # subject
-                str(r[3]) if r[3] else '-----',           # date
-                str(r[4]) if r[4] else '-----',           # case_type
-                duration_text,                              # duration (calculated)
-                str(r[6]) if r[6] else '-----',           # status
-                (f"{int(r[7]):,} ریال" if r[7] else '-----') if isinstance(r[7], (int, float)) or (isinstance(r[7], str) and r[7].replace(',', '').isdigit()) else str(r[7]) if r[7] else '-----'  # contract_amount with ریال
-            ]
-            tree.insert('', 'end', values=vals)
+            typed_query['text'] = q
+            search_worker.submit(search_results, ft, q, columns=RESULT_COLUMNS, include_archive=include_archive_var.get(), order_by=order_by, snippets=True)
+
+        # Only the newest search reports back, so this matches the rows poll_search gets
+        current_data['order_by'] = order_by
+        lbl_status.configure(text='در حال جستجو...', text_color='gray')
+        if search_timers['poll'] is None:
+            search_timers['poll'] = top.after(SEARCH_POLL_MS, poll_search)
+
+    def schedule_search():
+        """Search once typing pauses for SEARCH_DEBOUNCE_MS."""
+        # Keys that do not change the text (arrows, Home, ...) do not search again
+        if entry_q.get().strip() == typed_query['text']:
+            return
+        if search_timers['debounce']:
+            top.after_cancel(search_timers['debounce'])
+        search_timers['debounce'] = top.after(SEARCH_DEBOUNCE_MS, do_search)
+
+    def poll_search():
+        result = search_worker.poll()
+        if result is None:
+            search_timers['poll'] = top.after(SEARCH_POLL_MS, poll_search)
+            return
+        search_timers['poll'] = None
+        rows, error = result
+        if error is not None:
+            lbl_status.configure(text=f'خطا در جستجو: {error}', text_color='red')
+            return
+        show_results(rows)
+
+    def show_results(rows):
+        if current_data['order_by']:
+            # A re-sort of the same results: keep the selection and sort state
+            view.reorder(rows)
+            current_data['rows'] = rows
+            lbl_status.configure(text=f'تعداد نتایج یافت شده: {len(rows)}', text_color='green' if rows else 'gray')
+            return
+
+        view.set_rows(rows)
         
         # Update status label with result count
         lbl_status.configure(text=f'تعداد نتایج یافت شده: {len(rows)}', text_color='green' if rows else 'gray')
@@ -519,73 +701,73 @@ def open_search_records(master):
         update_sort_ui()
 
     def on_open_details(event):
-        sel = tree.selection()
-        if not sel:
+        case_id = view.item_key(tree.identify_row(event.y)) or view.item_key(tree.focus())
+        if case_id is None:
             return
-        item = tree.item(sel[0])
-        case_id = item['values'][0] # The case_id is the first value in the tuple
         open_details_window(top, case_id)
 
     def on_selection_change(event):
         """Enable/disable delete button based on selection."""
-        if tree.selection():
+        if view.selection():
             btn_delete.configure(state="normal")
         else:
             btn_delete.configure(state="disabled")
 
     def delete_selected_records():
         """Delete selected record(s) - handles both single and multiple selection."""
-        selected_items = tree.selection()
-        if not selected_items:
+        selected_ids = view.selection()
+        if not selected_ids:
             return
 
-        count = len(selected_items)
+        count = len(selected_ids)
         
         # For single selection, show simple confirmation
         if count == 1:
-            item = tree.item(selected_items[0])
-            case_id = item['values'][0]
+            case_id = selected_ids[0]
             if messagebox.askyesno('تایید حذف', f'آیا از حذف پرونده با شناسه {case_id} مطمئن هستید؟', parent=top):
                 try:
-                    delete_case(case_id)
-                    messagebox.showinfo('موفق', 'پرونده با موفقیت حذف شد.', parent=top)
+                    trash_cases([case_id])
+                    last_trashed['ids'] = [case_id]
+                    btn_undo.configure(state="normal")
+                    messagebox.showinfo('موفق', 'پرونده به سطل بازیافت منتقل شد.', parent=top)
                     do_search() # Refresh the list
                 except Exception as e:
                     messagebox.showerror('خطا', f'خطا در هنگام حذف: {e}', parent=top)
         else:
             # For multiple selection, show group delete confirmation
-            if messagebox.askyesno('تایید حذف گروهی', f'آیا از حذف {count} پرونده مطمئن هستید؟\nاین عملیات قابل بازگشت نیست.', parent=top):
-                deleted_count = 0
-                failed_count = 0
-                
-                for item_id in selected_items:
-                    try:
-                        item = tree.item(item_id)
-                        case_id = item['values'][0]
-                        delete_case(case_id)
-                        deleted_count += 1
-                    except Exception as e:
-                        failed_count += 1
-                        print(f"خطا در حذف پرونده {item['values'][0]}: {e}")
-                
-                # Show result message
-                if failed_count == 0:
-                    messagebox.showinfo('موفق', f'{deleted_count} پرونده با موفقیت حذف شد.', parent=top)
-                else:
-                    messagebox.showwarning('تکمیل با خطا', f'{deleted_count} پرونده حذف شد اما {failed_count} پرونده حذف نشد.', parent=top)
-                
+            if messagebox.askyesno('تایید حذف گروهی', f'آیا از حذف {count} پرونده مطمئن هستید؟\nپرونده‌ها به سطل بازیافت منتقل می‌شوند.', parent=top):
+                case_ids = selected_ids
+                try:
+                    # One transaction; folders are renamed into the trash, not copied or deleted
+                    deleted_count = trash_cases(case_ids)
+                except Exception as e:
+                    messagebox.showerror('خطا', f'خطا در هنگام حذف: {e}', parent=top)
+                    return
+                last_trashed['ids'] = case_ids
+                btn_undo.configure(state="normal")
+                messagebox.showinfo('موفق', f'{deleted_count} پرونده به سطل بازیافت منتقل شد.', parent=top)
                 do_search() # Refresh the list
 
+    def undo_delete():
+        """Restore the cases removed by the last delete from the trash."""
+        if not last_trashed['ids']:
+            return
+        try:
+            restored = restore_cases(last_trashed['ids'])
+        except Exception as e:
+            messagebox.showerror('خطا', f'خطا در بازگردانی: {e}', parent=top)
+            return
+        last_trashed['ids'] = []
+        btn_undo.configure(state="disabled")
+        messagebox.showinfo('موفق', f'{restored} پرونده بازگردانی شد.', parent=top)
+        do_search()
+
     tree.bind('<Double-1>', on_open_details)
-    tree.bind('<<TreeviewSelect>>', on_selection_change)
     tree.bind('<Control-a>', lambda e: select_all_items())
 
     def select_all_items():
-        """Select all items in the treeview."""
-        for item in tree.get_children():
-            tree.selection_add(item)
-        # Trigger selection change event
-        on_selection_change(None)
+        """Select every result, including rows scrolled out of view."""
+        view.select_all()
 
     def apply_sort_controls():
         """Apply sorting based on the radio button selections."""
@@ -596,17 +778,7 @@ def open_search_records(master):
         sort_state['column'] = col
         sort_state['reverse'] = reverse
         
-        items = [(tree.set(k, col), k) for k in tree.get_children('')]
-        
-        # Try to sort as numbers first, fallback to strings
-        try:
-            items.sort(key=lambda x: float(x[0]) if x[0] != '-----' else float('-inf'), reverse=reverse)
-        except ValueError:
-            items.sort(key=lambda x: x[0], reverse=reverse)
-        
-        # Rearrange items in sorted position
-        for index, (val, k) in enumerate(items):
-            tree.move(k, '', index)
+        sort_rows(col, reverse)
         
         # Update column headers to show sort direction
         update_sort_ui()
@@ -628,30 +800,6 @@ def open_search_records(master):
             return
 
         try:
-            workbook = openpyxl.Workbook()
-            sheet = workbook.active
-            sheet.title = "نتایج جستجو"
-            sheet.sheet_view.rightToLeft = True
-
-            # --- Styles ---
-            bold_font = Font(name='Vazirmatn', bold=True)
-            regular_font = Font(name='Vazirmatn')
-            thin_border = Border(left=Side(style='thin'), 
-                                 right=Side(style='thin'), 
-                                 top=Side(style='thin'), 
-                                 bottom=Side(style='thin'))
-            # readingOrder=2 forces RTL direction in the cell, which fixes display on Windows
-            center_alignment = Alignment(horizontal='center', vertical='center', readingOrder=2)
-
-            # --- Fetch full data for XLSX export ---
-            case_ids = [str(row[0]) for row in current_data['rows']]
-            conn = get_connection()
-            cur = conn.cursor()
-            cur.execute('SELECT * FROM cases WHERE id IN ({})'.format(','.join(['?' for _ in case_ids])), case_ids)
-            full_rows = cur.fetchall()
-            column_names = [desc[0] for desc in cur.description]
-            conn.close()
-
             # --- Define Headers and Columns for XLSX ---
             column_labels = {
                 'id': 'شناسه بایگانی',
@@ -679,63 +827,20 @@ def open_search_records(master):
                 'case_type': 'نوع پرونده',
                 'status': 'وضعیت',
             }
-            filtered_columns = [col for col in column_names if col not in ('folder_path', 'parties', 'duration')]
-            duration_index = column_names.index('duration') if 'duration' in column_names else -1
-
-            # --- Headers ---
-            persian_headers = [column_labels.get(col, col) for col in filtered_columns]
-            if duration_index != -1:
-                persian_headers.insert(duration_index, 'مدت')
-            persian_headers.insert(0, 'ردیف') # Add Row column header
-            
-            sheet.append(persian_headers)
-
-            # Style Header
-            for col_num, header in enumerate(persian_headers, 1):
-                cell = sheet.cell(row=1, column=col_num)
-                cell.font = bold_font
-                cell.border = thin_border
-                cell.alignment = center_alignment
-
-            # --- Data Rows ---
-            for row_idx, row in enumerate(full_rows, start=2):
-                duration_from_idx = column_names.index('duration_from') if 'duration_from' in column_names else -1
-                duration_to_idx = column_names.index('duration_to') if 'duration_to' in column_names else -1
-                row_list = list(row)
-                calculated_duration = '-----'
-                if duration_from_idx != -1 and duration_to_idx != -1:
+            # Every user-facing column of the case; folder and typed/bookkeeping columns are left out
+            column_names = [col for col in case_table_columns() if col not in EXPORT_EXCLUDED_COLUMNS]
+            persian_headers = [column_labels.get(col, col) for col in column_names]
+            duration_from_idx = column_names.index('duration_from')
+            duration_to_idx = column_names.index('duration_to')
+
+            def export_rows():
+                # Rows stream from the database a batch at a time, in the order shown
+                for row in current_data['rows'].iter_rows(column_names):
+                    row_list = list(row)
                     calculated_duration = calculate_duration_text(row_list[duration_from_idx], row_list[duration_to_idx])
+                    yield build_filtered_row(row_list, column_names, calculated_duration, add_rial=True)
 
-                filtered_row = build_filtered_row(row_list, column_names, calculated_duration, add_rial=True)
-                
-                # Add row number
-                filtered_row.insert(0, row_idx - 1)
-
-                # Reshape for display
-                reshaped_row = [str(item) if item is not None else '' for item in filtered_row]
-                sheet.append(reshaped_row)
-
-                # Apply font, border, and alignment to data cells
-                for col_idx, _ in enumerate(reshaped_row, 1):
-                    cell = sheet.cell(row=row_idx, column=col_idx)
-                    cell.font = regular_font
-                    cell.border = thin_border
-                    cell.alignment = center_alignment
-
-            # --- Adjust Column Widths ---
-            for col in sheet.columns:
-                max_length = 0
-                column = col[0].column_letter # Get the column letter
-                for cell in col:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = (max_length + 2) * 1.2
-                sheet.column_dimensions[column].width = adjusted_width
-
-            workbook.save(file_path)
+            write_xlsx(file_path, "نتایج جستجو", persian_headers, export_rows())
             
             messagebox.showinfo('موفق', f'گزارش با موفقیت صادر شد:\n{file_path}', parent=top)
         except Exception as e:
@@ -768,16 +873,5 @@ def open_search_records(master):
     # Set button commands
     btn_export_xlsx.configure(command=export_to_xlsx)
 
-    tree.bind('<Double-1>', on_open_details)
-    tree.bind('<<TreeviewSelect>>', on_selection_change)
-    tree.bind('<Control-a>', lambda e: select_all_items())
-
-    def select_all_items():
-        """Select all items in the treeview."""
-        for item in tree.get_children():
-            tree.selection_add(item)
-        # Trigger selection change event
-        on_selection_change(None)
-
     # Load all records on startup
     do_search()
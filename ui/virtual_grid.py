@@ -0,0 +1,171 @@
+class VirtualGrid:
+    """Show a long result sequence in a ttk.Treeview without an item per row.
+
+    The tree holds only as many items as fit in its visible height; scrolling
+    rewrites their values from `rows`, which can be a list or a
+    database.CaseResults that loads pages on demand. The vertical scrollbar
+    is driven by the grid (its position is over the whole result), so a
+    100k-row result costs the same Tk items as a 20-row one.
+
+    Selection is kept as row keys (`key(record)`, the first field by
+    default), so it survives scrolling rows out of view and back;
+    `on_select()` is called whenever the user changes it. Bind selection
+    through `on_select` rather than <<TreeviewSelect>>, which the grid uses.
+    """
+    WHEEL_ROWS = 3
+    DEFAULT_ROW_HEIGHT = 20
+
+    def __init__(self, tree, scrollbar, render, key=None, on_select=None):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.render = render
+        self.key = key or (lambda record: record[0])
+        self.on_select = on_select
+        self.rows = []
+        self.first = 0
+        self.items = []
+        self.keys = {}       # item -> key of the row it shows
+        self.selected = set()
+        self.anchor = None   # row index of the keyboard cursor
+
+        scrollbar.configure(command=self.yview)
+        tree.configure(yscrollcommand=lambda *args: None)
+        tree.bind('<Configure>', lambda e: self._resize(), add='+')
+        tree.bind('<<TreeviewSelect>>', self._on_select)
+        tree.bind('<MouseWheel>', self._on_wheel)
+        tree.bind('<Button-4>', lambda e: self.scroll(-self.WHEEL_ROWS))
+        tree.bind('<Button-5>', lambda e: self.scroll(self.WHEEL_ROWS))
+        tree.bind('<Up>', lambda e: self._move_cursor(-1))
+        tree.bind('<Down>', lambda e: self._move_cursor(1))
+        tree.bind('<Prior>', lambda e: self._move_cursor(-self.visible_rows()))
+        tree.bind('<Next>', lambda e: self._move_cursor(self.visible_rows()))
+        tree.bind('<Home>', lambda e: self._move_cursor(-len(self.rows)))
+        tree.bind('<End>', lambda e: self._move_cursor(len(self.rows)))
+
+    def set_rows(self, rows):
+        """Show `rows` from the top and clear the selection."""
+        self.rows = rows
+        self.first = 0
+        self.selected = set()
+        self.anchor = None
+        self.refresh()
+
+    def reorder(self, rows):
+        """Show `rows` (the same rows in a new order) from the top, keeping the selection."""
+        self.rows = rows
+        self.first = 0
+        self.anchor = None
+        self.refresh()
+
+    def refresh(self):
+        """Re-render the visible rows (after `rows` changed order or content)."""
+        self._fill()
+
+    def visible_rows(self):
+        height = self.tree.winfo_height()
+        if height <= 1:
+            return int(self.tree.cget('height'))
+        bbox = self.tree.bbox(self.items[0]) if self.items else None
+        if bbox:
+            top, row_height = bbox[1], bbox[3]
+        else:
+            top, row_height = self.DEFAULT_ROW_HEIGHT + 4, self.DEFAULT_ROW_HEIGHT
+        return max(1, (height - top) // max(1, row_height))
+
+    def _resize(self):
+        count = self.visible_rows()
+        if count != len(self.items):
+            self._fill(count)
+
+    def _fill(self, count=None):
+        count = count or self.visible_rows()
+        total = len(self.rows)
+        self.first = max(0, min(self.first, total - count))
+        rows = self.rows[self.first:self.first + count]
+        while len(self.items) > len(rows):
+            self.tree.delete(self.items.pop())
+        while len(self.items) < len(rows):
+            self.items.append(self.tree.insert('', 'end'))
+        self.keys = {}
+        show = []
+        for item, record in zip(self.items, rows):
+            if record is None:
+                self.tree.item(item, values=())
+                continue
+            self.tree.item(item, values=self.render(record))
+            self.keys[item] = self.key(record)
+            if self.keys[item] in self.selected:
+                show.append(item)
+        # Tk reports this as a selection event too; _on_select then derives
+        # the same selection back, so it needs no special casing.
+        self.tree.selection_set(show)
+        if total:
+            self.scrollbar.set(self.first / total, min(1.0, (self.first + len(rows)) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _on_select(self, event):
+        shown = set(self.keys.values())
+        self.selected -= shown
+        self.selected.update(self.keys[item] for item in self.tree.selection() if item in self.keys)
+        focus = self.tree.focus()
+        if focus in self.items:
+            self.anchor = self.first + self.items.index(focus)
+        if self.on_select:
+            self.on_select()
+
+    def yview(self, *args):
+        """Scrollbar command: ('moveto', fraction) or ('scroll', n, 'units'|'pages')."""
+        if not args:
+            return
+        if args[0] == 'moveto':
+            self.first = int(float(args[1]) * len(self.rows))
+            self._fill()
+        elif args[0] == 'scroll':
+            n = int(float(args[1]))
+            self.scroll(n * self.visible_rows() if args[2] == 'pages' else n)
+
+    def scroll(self, rows):
+        self.first += rows
+        self._fill()
+        return 'break'
+
+    def _on_wheel(self, event):
+        return self.scroll(-self.WHEEL_ROWS if event.delta > 0 else self.WHEEL_ROWS)
+
+    def see(self, index):
+        """Scroll so row `index` is visible."""
+        count = self.visible_rows()
+        if index < self.first:
+            self.first = index
+        elif index >= self.first + count:
+            self.first = index - count + 1
+        self._fill()
+
+    def _move_cursor(self, step):
+        if not self.rows:
+            return 'break'
+        index = self.first if self.anchor is None else self.anchor
+        index = max(0, min(len(self.rows) - 1, index + step))
+        self.anchor = index
+        record = self.rows[index]
+        self.selected = {self.key(record)} if record is not None else set()
+        self.see(index)
+        self.tree.focus(self.items[index - self.first])
+        return 'break'
+
+    def select_all(self):
+        # CaseResults knows its ids without loading every record.
+        keys = getattr(self.rows, 'ids', None)
+        self.selected = set(keys) if keys is not None else {self.key(r) for r in self.rows if r is not None}
+        self._fill()
+        if self.on_select:
+            self.on_select()
+
+    def selection(self):
+        """Return the keys of the selected rows."""
+        return list(self.selected)
+
+    def item_key(self, item):
+        """Return the key of the row a tree item currently shows, or None."""
+        return self.keys.get(item)